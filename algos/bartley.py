@@ -1,8 +1,53 @@
 import numpy as np
-from geopy.distance import geodesic
-from pulp import*
+from algos.spatial_index import DistanceField, StationIndex
 
-def optimize_new_ev_station_location(existing_stations, ev_user_locations, user_densities, ev_ranges, grid_size=(10, 10), min_ev_users=40):
+def candidate_grid(existing_stations, grid_size=(10, 10), margin=0.5):
+    """
+    Candidate locations on a grid around the existing stations, latitude major.
+
+    Parameters:
+    - existing_stations (list of tuples or np.ndarray): Coordinates of existing stations as (latitude, longitude).
+    - grid_size (tuple): Number of latitude and longitude steps.
+    - margin (float): Degrees added around the stations' bounding box.
+
+    Returns:
+    - np.ndarray: (grid_size[0] * grid_size[1], 2) candidate coordinates.
+    """
+    stations = np.asarray(existing_stations, dtype=float)
+    lat_range = np.linspace(stations[:, 0].min() - margin, stations[:, 0].max() + margin, grid_size[0])
+    lon_range = np.linspace(stations[:, 1].min() - margin, stations[:, 1].max() + margin, grid_size[1])
+    lat_mesh, lon_mesh = np.meshgrid(lat_range, lon_range, indexing='ij')
+    return np.column_stack((lat_mesh.ravel(), lon_mesh.ravel()))
+
+def build_model(nearest_station_dist, user_density_by_candidate, ev_range, min_ev_users, allowed=None):
+    """
+    PuLP model choosing one candidate, built from the precomputed arrays.
+
+    The range and density constraints each involve a single candidate, so they are applied as
+    variable bounds: only candidates satisfying both (and allowed, when given) get a variable,
+    the rest are fixed at 0.
+
+    Returns:
+    - tuple: (LpProblem, candidate indices, their LpVariables)
+    """
+    #only needed when the solver path is taken
+    from pulp import LpAffineExpression, LpMaximize, LpProblem, LpVariable
+
+    feasible = (nearest_station_dist <= ev_range) & (user_density_by_candidate >= min_ev_users)
+    if allowed is not None:
+        feasible &= allowed
+    feasible = np.flatnonzero(feasible)
+    x_vars = [LpVariable(f"x_{i}", cat="Binary") for i in feasible]
+
+    model = LpProblem("Optimal_EV_Station_Location", LpMaximize)
+    # Objective function: Maximize the distance to the nearest existing station
+    model += LpAffineExpression(zip(x_vars, nearest_station_dist[feasible].tolist())), "Maximize_Distance_to_Nearest_Station"
+    # Single Location Constraint: Only one new location can be selected
+    model += LpAffineExpression((x, 1) for x in x_vars) == 1, "Single_Location"
+    return model, feasible, x_vars
+
+def optimize_new_ev_station_location(existing_stations, ev_user_locations, user_densities, ev_ranges, grid_size=(10, 10), min_ev_users=40,
+                                     solver='auto', time_limit=None, index=None, candidate_filter=None, k=1):
     """
     Optimize the location for a new EV charging station.
 
@@ -13,97 +58,130 @@ def optimize_new_ev_station_location(existing_stations, ev_user_locations, user_
     - ev_ranges (list of floats): EV range for each cluster location.
     - grid_size (tuple): Size of the grid for generating candidate locations.
     - min_ev_users (int): Minimum number of EV users required near the new station.
+    - solver (str): 'auto' takes the best feasible candidate directly, which is exact for this single
+      selection model, 'milp' solves the PuLP model with CBC.
+    - time_limit (float): Seconds the MILP solver may take.
+    - index (StationIndex): Prebuilt nearest-station index over existing_stations, built here if omitted.
+    - candidate_filter (callable): Extra constraint, maps the (n, 2) candidate array to a boolean mask of allowed candidates.
+    - k (int): Number of stations to place greedily, each one counted as existing for the next.
 
     Returns:
-    - dict: Coordinates of the optimal new station location as {'Latitude': value, 'Longitude': value}.
+    - dict: Coordinates of the optimal new station location as {'Latitude': value, 'Longitude': value}, None if no candidate is feasible.
+      With k > 1 a list of up to k of them, shorter when the feasible candidates run out.
     """
     
     # Calculate the average EV range
     ev_range = np.mean(ev_ranges)
 
-    # Define grid boundaries based on the area around existing stations
-    min_lat = min([loc[0] for loc in existing_stations]) - 0.5
-    max_lat = max([loc[0] for loc in existing_stations]) + 0.5
-    min_lon = min([loc[1] for loc in existing_stations]) - 0.5
-    max_lon = max([loc[1] for loc in existing_stations]) + 0.5
-
-    # Generate candidate locations on a grid within the defined area
-    candidate_locations = []
-    lat_range = np.linspace(min_lat, max_lat, grid_size[0])
-    lon_range = np.linspace(min_lon, max_lon, grid_size[1])
-
-    for lat in lat_range:
-        for lon in lon_range:
-            candidate_locations.append((lat, lon))
-
-    # Initialize the optimization model
-    model = LpProblem("Optimal_EV_Station_Location", LpMaximize)
-
-    # Define decision variables for each candidate location
-    x_vars = {}
-    for i in range(len(candidate_locations)):
-        x_vars[i] = LpVariable(f"x_{i}", cat="Binary")
-
-    # Objective function: Maximize the distance to the nearest existing station
-    objective = 0
-    for i in range(len(candidate_locations)):
-        distance_to_nearest_station = float("inf")
-        for station in existing_stations:
-            distance = geodesic(candidate_locations[i], station).km
-            if distance < distance_to_nearest_station:
-                distance_to_nearest_station = distance
-        objective += x_vars[i] * distance_to_nearest_station
-    model += objective, "Maximize_Distance_to_Nearest_Station"
-
-    # Constraints
-    for i, candidate in enumerate(candidate_locations):
-        # Calculate distance to the nearest existing station
-        distance_to_nearest_station = float("inf")
-        for station in existing_stations:
-            distance = geodesic(candidate, station).km
-            if distance < distance_to_nearest_station:
-                distance_to_nearest_station = distance
-        
-        # EV Range Constraint: Distance to nearest station should not exceed EV range
-        model += distance_to_nearest_station * x_vars[i] <= ev_range
-
-        # User Density Constraint: Ensure minimum EV user density
-        user_density = 0
-        for j, user_location in enumerate(ev_user_locations):
-            if geodesic(candidate, user_location).km <= ev_range:
-                user_density += user_densities[j]
-        model += user_density * x_vars[i] >= min_ev_users
+    # Generate candidate locations on a grid within the area around existing stations
+    candidate_locations = candidate_grid(existing_stations, grid_size)
+
+    # Distance from every candidate to its nearest existing station, and the EV users within range of it
+    if index is None:
+        index = StationIndex(existing_stations)
+    nearest = DistanceField(candidate_locations, index)
+    allowed = np.ones(len(candidate_locations), dtype=bool)
+    if candidate_filter is not None:
+        #copied, the greedy loop masks out picked candidates and the filter's array belongs to the caller
+        allowed = np.array(candidate_filter(candidate_locations), dtype=bool)
+    #density only decides between candidates the range constraint and candidate_filter allow, the rest stay at 0
+    user_density_by_candidate = np.zeros(len(candidate_locations))
+    counted = np.zeros(len(candidate_locations), dtype=bool)
+    users = None
+
+    selected = []
+    for _ in range(k):
+        in_range = (nearest.distances <= ev_range) & allowed
+        #placed stations only bring candidates into range, so only those still need their EV users counted
+        uncounted = in_range & ~counted
+        if uncounted.any():
+            if users is None:
+                users = StationIndex(ev_user_locations)
+            user_density_by_candidate[uncounted] = users.count_within(candidate_locations[uncounted], ev_range, weights=user_densities)
+            counted |= uncounted
+
+        best = _select(nearest.distances, in_range, user_density_by_candidate, ev_range, min_ev_users, allowed, solver, time_limit)
+        if best is None:
+            break
+        selected.append({"Latitude": float(candidate_locations[best, 0]), "Longitude": float(candidate_locations[best, 1])})
+        if len(selected) < k:
+            nearest.add(candidate_locations[best])
+            #a candidate is placed at most once
+            allowed[best] = False
+
+    if k == 1:
+        return selected[0] if selected else None
+    return selected
+
+def _select(nearest_station_dist, in_range, user_density_by_candidate, ev_range, min_ev_users, allowed, solver, time_limit):
+    # Index of the candidate the model picks, None when no candidate is feasible
+    if solver == 'auto':
+        # Filtered argmax: candidates breaking a constraint score -inf
+        feasible = in_range & (user_density_by_candidate >= min_ev_users)
+        if not feasible.any():
+            return None
+        return int(np.argmax(np.where(feasible, nearest_station_dist, -np.inf)))
+    if solver == 'milp':
+        from pulp import PULP_CBC_CMD, LpStatusOptimal, value
+        model, feasible, x_vars = build_model(nearest_station_dist, user_density_by_candidate, ev_range, min_ev_users, allowed)
+        if len(x_vars) == 0:
+            return None
+        model.solve(PULP_CBC_CMD(msg=False, timeLimit=time_limit))
+        if model.status != LpStatusOptimal:
+            return None
+        # Retrieve the coordinates of the selected location
+        selected = [i for i, x in zip(feasible, x_vars) if value(x) is not None and value(x) > 0.5]
+        return int(selected[0]) if selected else None
+    raise ValueError(f"Unknown solver '{solver}', expected 'auto' or 'milp'")
 
-    # Single Location Constraint: Only one new location can be selected
-    model += lpSum(x_vars[i] for i in range(len(candidate_locations))) == 1
+def choose_new_location(existing_locations, ev_range=45.0, min_demand_share=0.25, grid_size=(50, 50), solver='auto', time_limit=None, index=None, k=1):
+    """
+    Choose a new location with the optimizer when only the existing stations are known.
 
-    # Solve the model
-    model.solve()
+    Every station stands in for one unit of EV user demand, so a candidate must be within ev_range
+    of at least min_demand_share of the stations.
 
-    # Retrieve the coordinates of the best new location
-    for i, point in enumerate(candidate_locations):
-        if value(x_vars[i]) == 1:
-            return {"Latitude": point[0], "Longitude": point[1]}
-        else:
-            # If no solution is found, return None
-            return None
+    Parameters:
+    - existing_locations (list of tuples): Coordinates of existing stations as (latitude, longitude).
+    - ev_range (float): EV range in kilometers.
+    - min_demand_share (float): Share of the stations that must be within range of the new one.
+    - grid_size (tuple): Size of the grid for generating candidate locations.
+    - solver (str): 'auto' or 'milp', see optimize_new_ev_station_location.
+    - time_limit (float): Seconds the MILP solver may take.
+    - index (StationIndex): Prebuilt nearest-station index over existing_locations, built here if omitted.
+    - k (int): Number of stations to place greedily, each one counted as existing for the next.
 
-# Sample Data for Testing the Function
-existing_stations = [
-    (33.65, -84.42),
-    (33.66, -84.44),
-    (33.67, -84.41)
-]
-
-ev_user_locations = [
-    (33.655, -84.423),
-    (33.662, -84.430),
-    (33.668, -84.417)
-]
-
-user_densities = [50, 70, 30]  # Number of EV users per user location
-ev_ranges = [45, 50, 40]  # EV range for each user cluster in km
-
-# Call the function with sample data
-optimal_location = optimize_new_ev_station_location(existing_stations, ev_user_locations, user_densities, ev_ranges)
-print("Optimal new station location based on sample data:", optimal_location)
+    Returns:
+    - tuple: New location as (latitude, longitude) coordinates, None if no candidate is feasible.
+      With k > 1 a list of up to k of them.
+    """
+    if index is None:
+        index = StationIndex(existing_locations)
+    min_ev_users = max(1, int(np.ceil(min_demand_share * len(index))))
+    location = optimize_new_ev_station_location(existing_locations, index.locations, np.ones(len(index)), [ev_range], grid_size=grid_size,
+                                                min_ev_users=min_ev_users, solver=solver, time_limit=time_limit, index=index, k=k)
+    if k > 1:
+        return [(l["Latitude"], l["Longitude"]) for l in location]
+    return None if location is None else (location["Latitude"], location["Longitude"])
+
+
+if __name__ == "__main__":
+    # Sample Data for Testing the Function
+    existing_stations = [
+        (33.65, -84.42),
+        (33.66, -84.44),
+        (33.67, -84.41)
+    ]
+
+    ev_user_locations = [
+        (33.655, -84.423),
+        (33.662, -84.430),
+        (33.668, -84.417)
+    ]
+
+    user_densities = [50, 70, 30]  # Number of EV users per user location
+    ev_ranges = [45, 50, 40]  # EV range for each user cluster in km
+
+    # Call the function with sample data
+    optimal_location = optimize_new_ev_station_location(existing_stations, ev_user_locations, user_densities, ev_ranges)
+    print("Optimal new station location based on sample data:", optimal_location)
@@ -0,0 +1,121 @@
+from collections import OrderedDict
+from threading import Lock
+
+import numpy as np
+from algos.distance import as_coordinates
+
+
+def _point_keys(points, decimals):
+    # Sorted unique int64 keys of the rounded coordinates, used to measure how much two station sets overlap
+    scale = 10 ** decimals
+    lat = np.round((points[:, 0] + 90) * scale).astype(np.int64)
+    lon = np.round((points[:, 1] + 180) * scale).astype(np.int64)
+    return np.unique(lat * (360 * scale + 1) + lon)
+
+
+class CentroidCache:
+    """
+    Recently fitted KMeans centroids, looked up by how much a new station set overlaps the ones
+    they were fitted on.
+
+    Station sets that share most of their points, such as the same city in consecutive years or
+    a map view panned slightly, converge in a couple of Lloyd iterations when started from the
+    previous centroids instead of a fresh k-means++ initialisation.
+
+    Parameters:
+    max_entries (int): Number of fitted station sets kept, least recently used evicted first.
+    min_overlap (float): Smallest Jaccard overlap of two station sets for a warm start.
+    decimals (int): Decimal places coordinates are rounded to before comparing sets.
+    """
+
+    def __init__(self, max_entries=256, min_overlap=0.5, decimals=5):
+        self.max_entries = max_entries
+        self.min_overlap = min_overlap
+        self.decimals = decimals
+        self._entries = OrderedDict()
+        self._lock = Lock()
+
+    def __getstate__(self):
+        #a process pool worker gets its own empty cache
+        return {**self.__dict__, '_entries': OrderedDict(), '_lock': None}
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = Lock()
+
+    def lookup(self, points, n_clusters) -> tuple:
+        """
+        Centroids of the cached station set overlapping points the most.
+
+        Parameters:
+        points (np.ndarray): (n, 2) station coordinates.
+        n_clusters (int): Number of centroids the fit needs.
+
+        Returns:
+        tuple: (centroids, overlap), (None, 0.0) when no cached set overlaps enough.
+        """
+        keys = _point_keys(points, self.decimals)
+        best, best_overlap = None, 0.0
+        with self._lock:
+            for fingerprint, (cached_keys, centroids) in self._entries.items():
+                if len(centroids) != n_clusters:
+                    continue
+                #cheap upper bound on the overlap before intersecting
+                if min(len(keys), len(cached_keys)) / max(len(keys), len(cached_keys)) < max(self.min_overlap, best_overlap):
+                    continue
+                shared = len(np.intersect1d(keys, cached_keys, assume_unique=True))
+                overlap = shared / (len(keys) + len(cached_keys) - shared)
+                if overlap >= self.min_overlap and overlap > best_overlap:
+                    best, best_overlap = fingerprint, overlap
+            if best is None:
+                return None, 0.0
+            self._entries.move_to_end(best)
+            return self._entries[best][1].copy(), best_overlap
+
+    def store(self, points, centroids):
+        keys = _point_keys(points, self.decimals)
+        with self._lock:
+            fingerprint = keys.tobytes()
+            self._entries[fingerprint] = (keys, np.array(centroids, dtype=float))
+            self._entries.move_to_end(fingerprint)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+
+def fit_centroids(locations, n_clusters=10, cache=None, random_state=0) -> np.ndarray:
+    """
+    KMeans cluster centers of a station set, warm-started from a cache when possible.
+
+    Parameters:
+    locations (list of tuples or np.ndarray): Station locations as (latitude, longitude) coordinates.
+    n_clusters (int): Number of clusters, lowered to the number of distinct stations when there are fewer.
+    cache (CentroidCache): Cache of earlier fits, None always fits from scratch.
+    random_state (int): Seed of the k-means++ initialisation of a cold fit.
+
+    Returns:
+    np.ndarray: (k, 2) cluster centers.
+    """
+    points = as_coordinates(locations)
+    distinct = np.unique(points, axis=0)
+    n_clusters = min(n_clusters, len(distinct))
+    if n_clusters == len(distinct):
+        #every distinct station is its own cluster
+        return distinct
+
+    centroids, overlap = (None, 0.0) if cache is None else cache.lookup(points, n_clusters)
+    if overlap == 1.0:
+        return centroids
+    #sklearn is imported on the first fit, not when the server starts
+    from sklearn.cluster import KMeans
+    if centroids is not None:
+        kmeans = KMeans(n_clusters=n_clusters, init=centroids, n_init=1)
+    else:
+        kmeans = KMeans(n_clusters=n_clusters, n_init="auto", random_state=random_state)
+    kmeans.fit(points)
+
+    if cache is not None:
+        cache.store(points, kmeans.cluster_centers_)
+    return kmeans.cluster_centers_
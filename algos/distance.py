@@ -0,0 +1,185 @@
+import numpy as np
+
+#mean earth radius used by geopy's great_circle, in kilometers
+EARTH_RADIUS_KM = 6371.0088
+
+#WGS-84 ellipsoid, the same one geopy.distance.geodesic uses by default
+WGS84_A = 6378.137
+WGS84_F = 1 / 298.257223563
+WGS84_B = WGS84_A * (1 - WGS84_F)
+
+#rows of the distance matrix computed at once so memory stays bounded for big station sets
+CHUNK_SIZE = 2048
+
+
+def as_coordinates(locations) -> np.ndarray:
+    """
+    Convert a list of (latitude, longitude) pairs or an array into a float (n, 2) array.
+
+    Parameters:
+    locations (list of tuples or np.ndarray): Locations as (latitude, longitude) coordinates.
+
+    Returns:
+    np.ndarray: Array of shape (n, 2).
+    """
+    return np.asarray(locations, dtype=float).reshape(-1, 2)
+
+
+def sorted_coordinates(locations) -> np.ndarray:
+    """
+    as_coordinates sorted by latitude, then longitude.
+
+    Some algorithms, such as Noah C, depend on the order of the stations. Running them on sorted
+    stations makes the result a function of the station set, the way station_fingerprint keys it,
+    whether the stations came from a client, the station store or the batch pipeline.
+
+    Parameters:
+    locations (list of tuples or np.ndarray): Locations as (latitude, longitude) coordinates.
+
+    Returns:
+    np.ndarray: Array of shape (n, 2).
+    """
+    points = as_coordinates(locations)
+    return points[np.lexsort((points[:, 1], points[:, 0]))]
+
+
+def haversine(lat1, lon1, lat2, lon2):
+    """
+    Great circle distance in kilometers on a spherical earth. Inputs are in degrees and broadcast.
+    """
+    lat1, lon1, lat2, lon2 = map(np.radians, (lat1, lon1, lat2, lon2))
+    a = np.sin((lat2 - lat1) / 2.0)**2 + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2.0)**2
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(np.clip(a, 0.0, 1.0)))
+
+
+def vincenty(lat1, lon1, lat2, lon2, max_iter=100, tol=1e-12):
+    """
+    Ellipsoidal (WGS-84) distance in kilometers using Vincenty's inverse formula.
+    Inputs are in degrees and broadcast. Agrees with geopy's geodesic to well under a millimetre;
+    the rare nearly antipodal pairs that do not converge fall back to the haversine distance.
+    """
+    lat1, lon1, lat2, lon2 = np.broadcast_arrays(*(np.asarray(v, dtype=float) for v in (lat1, lon1, lat2, lon2)))
+
+    L = np.radians(lon2 - lon1)
+    U1 = np.arctan((1 - WGS84_F) * np.tan(np.radians(lat1)))
+    U2 = np.arctan((1 - WGS84_F) * np.tan(np.radians(lat2)))
+    sin_u1, cos_u1 = np.sin(U1), np.cos(U1)
+    sin_u2, cos_u2 = np.sin(U2), np.cos(U2)
+
+    lam = L
+    converged = np.zeros(L.shape, dtype=bool)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        for _ in range(max_iter):
+            sin_lam, cos_lam = np.sin(lam), np.cos(lam)
+            sin_sigma = np.sqrt((cos_u2 * sin_lam)**2 + (cos_u1 * sin_u2 - sin_u1 * cos_u2 * cos_lam)**2)
+            cos_sigma = sin_u1 * sin_u2 + cos_u1 * cos_u2 * cos_lam
+            sigma = np.arctan2(sin_sigma, cos_sigma)
+            sin_alpha = np.where(sin_sigma == 0, 0.0, cos_u1 * cos_u2 * sin_lam / sin_sigma)
+            cos2_alpha = 1 - sin_alpha**2
+            #equatorial lines have cos2_alpha == 0
+            cos_2sigma_m = np.where(cos2_alpha == 0, 0.0, cos_sigma - 2 * sin_u1 * sin_u2 / cos2_alpha)
+            C = WGS84_F / 16 * cos2_alpha * (4 + WGS84_F * (4 - 3 * cos2_alpha))
+            lam_prev = lam
+            lam = L + (1 - C) * WGS84_F * sin_alpha * (
+                sigma + C * sin_sigma * (cos_2sigma_m + C * cos_sigma * (-1 + 2 * cos_2sigma_m**2)))
+            converged = np.abs(lam - lam_prev) < tol
+            if converged.all():
+                break
+
+        u2 = cos2_alpha * (WGS84_A**2 - WGS84_B**2) / WGS84_B**2
+        A = 1 + u2 / 16384 * (4096 + u2 * (-768 + u2 * (320 - 175 * u2)))
+        B = u2 / 1024 * (256 + u2 * (-128 + u2 * (74 - 47 * u2)))
+        delta_sigma = B * sin_sigma * (cos_2sigma_m + B / 4 * (
+            cos_sigma * (-1 + 2 * cos_2sigma_m**2)
+            - B / 6 * cos_2sigma_m * (-3 + 4 * sin_sigma**2) * (-3 + 4 * cos_2sigma_m**2)))
+        dist = WGS84_B * A * (sigma - delta_sigma)
+
+    if not converged.all():
+        dist = np.where(converged, dist, haversine(lat1, lon1, lat2, lon2))
+    return dist
+
+
+def _kernel(method):
+    if method == 'haversine':
+        return haversine
+    if method == 'geodesic':
+        return vincenty
+    raise ValueError(f"Unknown distance method '{method}', expected 'haversine' or 'geodesic'")
+
+
+def pairwise_distance(points, others, method='geodesic') -> np.ndarray:
+    """
+    Row-by-row distance between two equally sized sets of locations.
+
+    Parameters:
+    points (array-like): Locations as (latitude, longitude) coordinates.
+    others (array-like): Locations as (latitude, longitude) coordinates, same length as points.
+    method (str): 'haversine' for a spherical earth or 'geodesic' for the WGS-84 ellipsoid.
+
+    Returns:
+    np.ndarray: Distances in kilometers of shape (n,).
+    """
+    points, others = as_coordinates(points), as_coordinates(others)
+    return _kernel(method)(points[:, 0], points[:, 1], others[:, 0], others[:, 1])
+
+
+def distance_matrix(points, others, method='haversine') -> np.ndarray:
+    """
+    Full distance matrix between two sets of locations in one batched call.
+
+    Parameters:
+    points (array-like): n locations as (latitude, longitude) coordinates.
+    others (array-like): m locations as (latitude, longitude) coordinates.
+    method (str): 'haversine' for a spherical earth or 'geodesic' for the WGS-84 ellipsoid.
+
+    Returns:
+    np.ndarray: Distances in kilometers of shape (n, m).
+    """
+    points, others = as_coordinates(points), as_coordinates(others)
+    return _kernel(method)(points[:, 0, None], points[:, 1, None], others[None, :, 0], others[None, :, 1])
+
+
+def nearest_distance(points, others, method='geodesic', refine=4):
+    """
+    Distance from every point to its nearest location in others.
+
+    The search runs on the cheap haversine matrix in chunks. For the geodesic method the closest
+    few haversine matches are then re-measured on the ellipsoid, since the two metrics differ by
+    well under one percent and can only disagree on near ties.
+
+    Parameters:
+    points (array-like): n locations as (latitude, longitude) coordinates.
+    others (array-like): m locations as (latitude, longitude) coordinates.
+    method (str): 'haversine' or 'geodesic'.
+    refine (int): Number of haversine candidates re-measured when method is 'geodesic'.
+
+    Returns:
+    tuple: (distances in kilometers of shape (n,), index into others of shape (n,))
+    """
+    points, others = as_coordinates(points), as_coordinates(others)
+    _kernel(method)
+    n, m = len(points), len(others)
+    dist = np.empty(n)
+    idx = np.empty(n, dtype=np.intp)
+    k = min(refine, m)
+
+    for start in range(0, n, CHUNK_SIZE):
+        chunk = points[start:start + CHUNK_SIZE]
+        rows = np.arange(len(chunk))
+        matrix = distance_matrix(chunk, others, method='haversine')
+
+        if method == 'geodesic' and k > 1:
+            candidates = np.argpartition(matrix, k - 1, axis=1)[:, :k]
+            exact = vincenty(chunk[:, 0, None], chunk[:, 1, None], others[candidates, 0], others[candidates, 1])
+            closest = np.argmin(exact, axis=1)
+            best, best_dist = candidates[rows, closest], exact[rows, closest]
+        else:
+            best = np.argmin(matrix, axis=1)
+            best_dist = matrix[rows, best]
+            if method == 'geodesic':
+                best_dist = vincenty(chunk[:, 0], chunk[:, 1], others[best, 0], others[best, 1])
+
+        dist[start:start + len(chunk)] = best_dist
+        idx[start:start + len(chunk)] = best
+
+    return dist, idx
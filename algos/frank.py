@@ -1,49 +1,85 @@
 import numpy as np
-from geopy.distance import geodesic
-import json
+from algos.distance import as_coordinates, haversine
+from algos.spatial_index import DistanceField, StationIndex
 
+#degrees added around a station set that has no extent in one direction
+DEGENERATE_PAD = 0.05
 
-def choose_new_location(existing_locations, grid_size=(25, 25)):
+
+def choose_new_location(existing_locations, grid_size=(25, 25), method='geodesic', index=None, field='exact', k=1):
     """
     Choose a new location using spatial queuing given a set of existing locations.
 
     Parameters:
-    existing_locations (list of tuples): List of existing locations as (latitude, longitude) coordinates.
-    grid_size (tuple): Size of the grid as (width, height).
+    existing_locations (list of tuples or np.ndarray): List of existing locations as (latitude, longitude) coordinates.
+    grid_size (tuple): Size of the grid as (width, height), fine grids such as (500, 500) stay interactive.
+    method (str): Distance kernel, 'geodesic' (WGS-84) or the faster spherical 'haversine'.
+    index (StationIndex): Prebuilt nearest-station index over existing_locations, built here if omitted.
+    field (str): 'exact' measures every empty cell to its nearest station, 'edt' approximates that
+        with a Euclidean distance transform of the occupancy grid, which is faster on very fine grids.
+    k (int): Number of stations to place greedily, each one counted as existing for the next.
 
     Returns:
-    tuple: New location as (latitude, longitude) coordinates.
+    tuple: New location as (latitude, longitude) coordinates, a list of k of them when k > 1.
     """
-    grid = np.zeros(grid_size)
-    
-    min_lat = min(loc[0] for loc in existing_locations)
-    max_lat = max(loc[0] for loc in existing_locations)
-    min_lon = min(loc[1] for loc in existing_locations)
-    max_lon = max(loc[1] for loc in existing_locations)
-    
-    for loc in existing_locations:
-        lat_idx = int((loc[0] - min_lat) * (grid_size[0] / (max_lat - min_lat)))-1
-        lon_idx = int((loc[1] - min_lon) * (grid_size[1] / (max_lon - min_lon)))-1
+    locations = as_coordinates(existing_locations)
+    min_lat, min_lon = locations.min(axis=0)
+    max_lat, max_lon = locations.max(axis=0)
+    #a single row or column of stations still needs a grid with some extent
+    if max_lat == min_lat:
+        min_lat, max_lat = min_lat - DEGENERATE_PAD, max_lat + DEGENERATE_PAD
+    if max_lon == min_lon:
+        min_lon, max_lon = min_lon - DEGENERATE_PAD, max_lon + DEGENERATE_PAD
+    lat_step = (max_lat - min_lat) / grid_size[0]
+    lon_step = (max_lon - min_lon) / grid_size[1]
+
+    if field == 'edt':
+        cells = np.indices(grid_size).reshape(2, -1).T
+        distances = _edt_field(locations, grid_size, min_lat, min_lon, lat_step, lon_step).ravel()
+        nearest = DistanceField(cells * (lat_step, lon_step) + (min_lat, min_lon), distances=distances, method=method)
+    elif field == 'exact':
+        #occupancy grid, the -1 offset (which wraps stations on the lower edge to the last cell) is kept
+        #so results stay identical to the original loop
+        grid = np.zeros(grid_size)
+        lat_idx = ((locations[:, 0] - min_lat) * (grid_size[0] / (max_lat - min_lat))).astype(int) - 1
+        lon_idx = ((locations[:, 1] - min_lon) * (grid_size[1] / (max_lon - min_lon))).astype(int) - 1
         grid[lat_idx, lon_idx] = 1
-    
-    distances = np.zeros(grid_size)
-    
-    for lat_idx in range(grid_size[0]):
-        for lon_idx in range(grid_size[1]):
-            if grid[lat_idx, lon_idx] == 0:
-                min_distance = float('inf')
-                for loc in existing_locations:
-                    grid_lat = lat_idx * (max_lat - min_lat) / grid_size[0] + min_lat
-                    grid_lon = lon_idx * (max_lon - min_lon) / grid_size[1] + min_lon
-                    distance = geodesic((grid_lat, grid_lon), loc).kilometers
-                    if distance < min_distance:
-                        min_distance = distance
-                distances[lat_idx, lon_idx] = min_distance
-    
-    new_location_idx = np.unravel_index(np.argmax(distances), distances.shape)
-    new_location = ((new_location_idx[0]+1) * (max_lat - min_lat) / grid_size[0] + min_lat, 
-                    (new_location_idx[1]+1) * (max_lon - min_lon) / grid_size[1] + min_lon)
-    return new_location
+
+        #distance from every empty cell to its nearest station in one bulk index query, occupied cells stay at 0
+        cells = np.column_stack(np.nonzero(grid == 0))
+        grid_points = cells * (lat_step, lon_step) + (min_lat, min_lon)
+        if index is None and len(grid_points):
+            index = StationIndex(locations, method=method)
+        nearest = DistanceField(grid_points, index, method=method)
+    else:
+        raise ValueError(f"Unknown distance field '{field}', expected 'exact' or 'edt'")
+
+    new_locations = []
+    for _ in range(k):
+        #argmax of the whole grid, which is the first cell when no empty cell is away from a station
+        best = int(np.argmax(nearest.distances)) if len(nearest) else -1
+        new_location_idx = cells[best] if best >= 0 and nearest.distances[best] > 0 else (0, 0)
+        new_location = ((new_location_idx[0]+1) * lat_step + min_lat, 
+                        (new_location_idx[1]+1) * lon_step + min_lon)
+        new_locations.append(new_location)
+        #the placed station only lowers the field around it
+        if len(new_locations) < k:
+            nearest.add(new_location)
+    return new_locations[0] if k == 1 else new_locations
+
+def _edt_field(locations, grid_size, min_lat, min_lon, lat_step, lon_step):
+    # Distance in km from every cell to the nearest occupied cell, by Euclidean distance transform
+    from scipy.ndimage import distance_transform_edt
+    lat_idx = np.clip(np.floor((locations[:, 0] - min_lat) / lat_step).astype(int), 0, grid_size[0] - 1)
+    lon_idx = np.clip(np.floor((locations[:, 1] - min_lon) / lon_step).astype(int), 0, grid_size[1] - 1)
+    empty = np.ones(grid_size, dtype=bool)
+    empty[lat_idx, lon_idx] = False
+
+    #cell size in km measured at the middle of the grid
+    mid_lat = min_lat + lat_step * grid_size[0] / 2
+    cell_km = (haversine(mid_lat, min_lon, mid_lat + lat_step, min_lon),
+               haversine(mid_lat, min_lon, mid_lat, min_lon + lon_step))
+    return distance_transform_edt(empty, sampling=cell_km)
 
 # # SAMPLE existing_locations = [(37.7749, -122.4194), (34.0522, -118.2437), (40.7128, -74.0060)]
 # # Sample Payload
@@ -1,35 +1,37 @@
 import json
 import time
 import numpy as np
-from sklearn.cluster import KMeans
-from geopy.distance import geodesic
+from algos.clustering import fit_centroids
+from algos.distance import nearest_distance
+from algos.spatial_index import DistanceField, StationIndex
 
-def choose_new_location_kmeans(existing_locations, n_clusters=10, void_threshold_km=10.0):
+def choose_new_location_kmeans(existing_locations, n_clusters=10, void_threshold_km=10.0, method='geodesic', index=None, centroids=None, k=1):
     """
     Choose a new location using K-means clustering with void detection.
     Voids are coverage gaps in the coordinate grid.
     Void detection involves finding large areas between clusters that exceed some minimum distance threshold.
     
     Parameters:
-    existing_locations (list of tuples): List of existing locations as (latitude, longitude) coordinates.
-    n_clusters (int): Number of clusters to form.
+    existing_locations (list of tuples or np.ndarray): List of existing locations as (latitude, longitude) coordinates.
+    n_clusters (int): Number of clusters to form, fewer when there are fewer distinct stations.
     void_threshold_km (float): Minimum distance in kilometers to consider an area as a void.
+    method (str): Distance kernel, 'geodesic' (WGS-84) or the faster spherical 'haversine'.
+    index (StationIndex): Prebuilt nearest-station index over existing_locations, built here if omitted.
+    centroids (CentroidCache): Earlier KMeans fits to warm-start from when the stations overlap them, a cold fit when
+        None. A warm-started location depends on the fits cached before it, so callers that must answer the same
+        for the same stations (the server, the batch pipeline) leave it out.
+    k (int): Number of stations to place greedily, each one counted as existing for the next.
     
     Returns:
-    tuple: New location as (latitude, longitude) coordinates.
+    tuple: New location as (latitude, longitude) coordinates, a list of k of them when k > 1.
     """
-    locations_array = np.array(existing_locations)
+    locations_array = np.asarray(existing_locations, dtype=float)
     
-    kmeans = KMeans(n_clusters=n_clusters, n_init="auto", random_state=0)
-    kmeans.fit(locations_array)
-    
-    cluster_centers = kmeans.cluster_centers_
+    cluster_centers = fit_centroids(locations_array, n_clusters=n_clusters, cache=centroids)
     
     # create grid of potential points
-    min_lat = min(loc[0] for loc in existing_locations) - 0.1
-    max_lat = max(loc[0] for loc in existing_locations) + 0.1
-    min_lon = min(loc[1] for loc in existing_locations) - 0.1
-    max_lon = max(loc[1] for loc in existing_locations) + 0.1
+    min_lat, min_lon = locations_array.min(axis=0) - 0.1
+    max_lat, max_lon = locations_array.max(axis=0) + 0.1
     
     grid_size = 50
     lat_grid = np.linspace(min_lat, max_lat, grid_size)
@@ -39,73 +41,106 @@ def choose_new_location_kmeans(existing_locations, n_clusters=10, void_threshold
     lat_mesh, lon_mesh = np.meshgrid(lat_grid, lon_grid)
     potential_points = np.column_stack((lat_mesh.ravel(), lon_mesh.ravel()))
     
-    # calculate distances to nearest existing station for each potential point
-    void_scores = np.zeros(len(potential_points))
-    
-    for i, point in enumerate(potential_points):
-        # distance to nearest existing station
-        min_station_dist = min(geodesic(point, loc).kilometers for loc in existing_locations)
-        # distance to nearest cluster center
-        min_cluster_dist = min(geodesic(point, center).kilometers for center in cluster_centers)
-        
+    # calculate distances to nearest existing station and nearest cluster center for every potential point at once
+    if index is None:
+        index = StationIndex(locations_array, method=method)
+    min_station_dist = DistanceField(potential_points, index)
+    min_cluster_dist = nearest_distance(potential_points, cluster_centers, method=method)[0]
+    #the cluster term does not change as stations are placed
+    demand_weight = 1 / (min_cluster_dist + 1)
+
+    new_locations = []
+    for _ in range(k):
         # calculate void score (higher score = better candidate)
         #   min_station_dist: higher value is better because we want to place new stations far from existing ones
         #       this is the primary factor for identifying voids
         #       linear scale
         #   min_cluster_dist inverse: lower value is better because we want to stay relatively close to population centers (demand areas)
         #       nonlinear scale - diminishing returns as distance increases
-        if min_station_dist > void_threshold_km:
-            void_scores[i] = min_station_dist * (1 / (min_cluster_dist + 1))
-        else:
-            void_scores[i] = 0
-            
-    # find the point with the highest void score
-    best_point_idx = np.argmax(void_scores)
-    new_location = tuple(potential_points[best_point_idx])
-    
-    return new_location
+        void_scores = np.where(min_station_dist.distances > void_threshold_km, min_station_dist.distances * demand_weight, 0)
+
+        # find the point with the highest void score
+        best_point_idx = np.argmax(void_scores)
+        new_locations.append(tuple(potential_points[best_point_idx]))
+        # the new station closes the void around it for the next placement
+        if len(new_locations) < k:
+            min_station_dist.add(potential_points[best_point_idx])
 
-def analyze_coverage(existing_locations, new_location):
+    return new_locations[0] if k == 1 else new_locations
+
+def coverage_field(existing_locations, grid_size=20, margin=0.1, method='geodesic', index=None, bounds=None):
     """
-    Analyze the coverage improvement with the new location.
-    
+    Distance from every point of a grid over the stations to the nearest station, the "before"
+    state of a coverage analysis. New stations are then added to a copy of it.
+
     Parameters:
-    existing_locations (list of tuples): List of existing locations.
-    new_location (tuple): New station location.
-    
+    existing_locations (list of tuples or np.ndarray): List of existing locations.
+    grid_size (int): Number of grid points per side.
+    margin (float): Degrees added around the bounds.
+    method (str): Distance kernel, 'geodesic' (WGS-84) or the faster spherical 'haversine'.
+    index (StationIndex): Prebuilt nearest-station index over existing_locations, built here if omitted.
+    bounds (np.ndarray): (m, 2) locations the grid must cover, the existing locations if omitted.
+
     Returns:
-    dict: Coverage analysis metrics.
+    DistanceField: Nearest-station distance per grid point.
     """
-    all_locations = existing_locations + [new_location]
-    
-    # calculate average distance to nearest station before and after
-    grid_size = 20
-    min_lat = min(loc[0] for loc in all_locations) - 0.1
-    max_lat = max(loc[0] for loc in all_locations) + 0.1
-    min_lon = min(loc[1] for loc in all_locations) - 0.1
-    max_lon = max(loc[1] for loc in all_locations) + 0.1
-    
+    locations_array = np.asarray(existing_locations, dtype=float)
+    bounds = locations_array if bounds is None else np.asarray(bounds, dtype=float)
+    min_lat, min_lon = bounds.min(axis=0) - margin
+    max_lat, max_lon = bounds.max(axis=0) + margin
+
     lat_grid = np.linspace(min_lat, max_lat, grid_size)
     lon_grid = np.linspace(min_lon, max_lon, grid_size)
-    grid_points = [(lat, lon) for lat in lat_grid for lon in lon_grid]
-    
-    # calculate coverage metrics before and after new station
-    old_distances = []
-    new_distances = []
-    for point in grid_points:
-        old_min_dist = min(geodesic(point, loc).kilometers for loc in existing_locations)
-        new_min_dist = min(geodesic(point, loc).kilometers for loc in all_locations)
-        old_distances.append(old_min_dist)
-        new_distances.append(new_min_dist)
-    
+    lat_mesh, lon_mesh = np.meshgrid(lat_grid, lon_grid, indexing='ij')
+    grid_points = np.column_stack((lat_mesh.ravel(), lon_mesh.ravel()))
+
+    if index is None:
+        index = StationIndex(locations_array, method=method)
+    return DistanceField(grid_points, index)
+
+def coverage_metrics(before, new_locations):
+    """
+    Coverage improvement of adding new stations to a "before" distance field, which is left unchanged.
+
+    Parameters:
+    before (DistanceField): Nearest-station distances without the new stations, see coverage_field.
+    new_locations (list of tuples): New station locations.
+
+    Returns:
+    dict: Coverage analysis metrics.
+    """
+    # the after state is the before state with each new station folded in, no second nearest-station scan
+    after = DistanceField(before.points, distances=before.distances, method=before.method)
+    for new_location in new_locations:
+        after.add(new_location)
+    old_distances, new_distances = before.distances, after.distances
+
     return {
         "avg_distance_before": np.mean(old_distances),
         "avg_distance_after": np.mean(new_distances),
-        "max_distance_before": max(old_distances),
-        "max_distance_after": max(new_distances),
+        "max_distance_before": np.max(old_distances),
+        "max_distance_after": np.max(new_distances),
         "coverage_improvement_percent": (np.mean(old_distances) - np.mean(new_distances)) / np.mean(old_distances) * 100
     }
 
+def analyze_coverage(existing_locations, new_location, method='geodesic', grid_size=20):
+    """
+    Analyze the coverage improvement with the new location.
+    
+    Parameters:
+    existing_locations (list of tuples): List of existing locations.
+    new_location (tuple): New station location.
+    method (str): Distance kernel, 'geodesic' (WGS-84) or the faster spherical 'haversine'.
+    grid_size (int): Number of grid points per side.
+    
+    Returns:
+    dict: Coverage analysis metrics.
+    """
+    # calculate average distance to nearest station before and after, on a grid that covers the new location too
+    all_locations = np.vstack((np.asarray(existing_locations, dtype=float), np.asarray(new_location, dtype=float).reshape(1, 2)))
+    before = coverage_field(existing_locations, grid_size=grid_size, method=method, bounds=all_locations)
+    return coverage_metrics(before, [new_location])
+
 
 if __name__ == "__main__":
     sample_payload = '{"filtered_station_data":[[33.653984,-84.397653,"2016-07-02"],[33.662898,-84.428118,"2016-10-07"],[33.653832,-84.423689,"2016-10-14"],[33.65972,-84.413647,"2018-06-14"],[33.658678,-84.42534,"2018-08-14"],[33.658015,-84.421226,"2018-08-16"],[33.653021,-84.430135,"2018-12-12"],[33.660132,-84.431519,"2017-07-17"],[33.657669,-84.421716,"2019-05-04"],[33.657737,-84.421292,"2019-05-04"],[33.653491,-84.450653,"2019-05-31"],[33.650656,-84.447945,"2020-03-01"],[33.65071,-84.448031,"2020-03-01"],[33.662897,-84.428088,"2021-01-27"],[33.653845,-84.423648,"2021-01-27"],[33.653822,-84.423798,"2021-01-27"],[33.653822,-84.424038,"2021-01-27"],[33.653831,-84.424175,"2021-01-27"],[33.65382,-84.423958,"2021-01-27"],[33.6538,-84.423757,"2021-01-27"],[33.65384,-84.424202,"2021-01-27"],[33.653824,-84.424014,"2021-01-27"],[33.653829,-84.424175,"2021-01-27"],[33.653826,-84.424105,"2021-01-27"],[33.653831,-84.424127,"2021-01-27"],[33.653813,-84.423891,"2021-01-27"],[33.653992,-84.397638,"2021-01-27"],[33.659613,-84.413669,"2021-01-27"],[33.658779,-84.425338,"2021-01-27"],[33.658774,-84.42532,"2021-01-27"],[33.658024,-84.421291,"2021-01-27"],[33.658031,-84.421083,"2021-01-27"],[33.653077,-84.430127,"2021-01-27"],[33.653128,-84.430123,"2021-01-27"],[33.657663,-84.421635,"2021-01-27"],[33.657721,-84.42103,"2021-01-27"],[33.657681,-84.421077,"2021-01-27"],[33.657645,-84.420498,"2021-01-27"],[33.657735,-84.420794,"2021-01-27"],[33.657762,-84.420826,"2021-01-27"],[33.657731,-84.421346,"2021-01-27"],[33.650603,-84.44786,"2021-01-27"],[33.650685,-84.447986,"2021-01-27"],[33.653863,-84.423704,"2021-07-31"],[33.657722,-84.421188,"2021-12-22"],[33.65647,-84.40343,"2022-02-22"],[33.656433,-84.40341,"2022-02-22"],[33.6594071,-84.4174653,"2020-04-10"],[33.657222,-84.431829,"2023-03-10"],[33.657198,-84.431872,"2023-03-10"],[33.657271,-84.431706,"2023-03-10"],[33.657252,-84.431743,"2023-03-10"],[33.657288,-84.431662,"2023-03-10"],[33.653034,-84.4507,"2023-04-16"],[33.653022,-84.450828,"2024-06-07"],[33.653038,-84.450817,"2024-06-14"]]}'
@@ -0,0 +1,161 @@
+from collections import OrderedDict
+from importlib import import_module
+
+import numpy as np
+from algos.distance import as_coordinates
+
+
+class Algorithm:
+    """
+    A location algorithm as the server and the batch pipeline see it.
+
+    The entry point is imported on first use, so a deployment that disables an algorithm never
+    loads its dependencies.
+
+    Parameters:
+    name (str): Value stored in the Algorithm column of the batch output, e.g. 'Noah_S'.
+    label (str): Key of the algorithm in /run_model responses, e.g. 'Noah S'.
+    module (str): Module the entry point lives in.
+    function (str): Name of the entry point, called with the stations and keyword parameters.
+    params (dict): Default keyword parameters, overridable per call.
+    context (tuple): Shared per-request objects the entry point accepts: 'index' (StationIndex)
+        and 'centroids' (CentroidCache).
+    accepts_array (bool): The entry point takes an (n, 2) array, otherwise a list of [lat, lon] lists.
+    batch (bool): Run for every (Year, City, State) group by GeneratePredictions.
+    top_k (bool): The entry point takes k and places k stations itself, updating its distance field
+        after each one. Otherwise k placements rerun the algorithm with the placed stations added.
+    dependencies (tuple): Heavy modules the algorithm imports on first use, imported up front by load.
+    """
+
+    def __init__(self, name, label, module, function, params=None, context=(), accepts_array=True, batch=True, top_k=False, dependencies=()):
+        self.name = name
+        self.label = label
+        self.module = module
+        self.function = function
+        self.params = dict(params or {})
+        self.context = tuple(context)
+        self.accepts_array = accepts_array
+        self.batch = batch
+        self.top_k = top_k
+        self.dependencies = tuple(dependencies)
+        self._entry_point = None
+
+    def __repr__(self) -> str:
+        return f'Algorithm({self.name!r})'
+
+    def __getstate__(self):
+        #process pools pickle the algorithm, the entry point is re-imported on the other side
+        return {**self.__dict__, '_entry_point': None}
+
+    @property
+    def entry_point(self):
+        if self._entry_point is None:
+            self._entry_point = getattr(import_module(self.module), self.function)
+        return self._entry_point
+
+    def load(self):
+        """
+        Import the entry point and its dependencies now instead of on the first call, e.g. in a
+        gunicorn master started with --preload so the forked workers share the imported modules.
+        """
+        for module in self.dependencies:
+            import_module(module)
+        return self.entry_point
+
+    def __call__(self, points, context=None, k=1, **params):
+        """
+        Run the algorithm on one station set.
+
+        Parameters:
+        points (np.ndarray): (n, 2) station coordinates as (latitude, longitude).
+        context (dict): Shared per-request objects, the ones the algorithm does not accept are ignored.
+        k (int): Number of stations to place greedily.
+        params: Overrides of the default parameters.
+
+        Returns:
+        np.ndarray: New location as a (2,) array, None if the algorithm found no feasible location.
+            With k > 1 an (m, 2) array of the m <= k locations placed, None if there are none.
+        """
+        points = as_coordinates(points)
+        kwargs = {**self.params, **params}
+        if context:
+            kwargs.update((key, value) for key, value in context.items() if key in self.context)
+        if k == 1:
+            return self._run(points, kwargs)
+        if self.top_k:
+            locations = self._run(points, {**kwargs, 'k': k})
+            return None if locations is None or len(locations) == 0 else locations.reshape(-1, 2)
+
+        placed = []
+        for _ in range(k):
+            location = self._run(points, kwargs)
+            #an algorithm that ignores the placed stations would repeat itself
+            if location is None or any(np.array_equal(location, other) for other in placed):
+                break
+            placed.append(location)
+            points = np.vstack((points, location))
+            #a shared index only covers the original stations
+            kwargs.pop('index', None)
+        return np.array(placed) if placed else None
+
+    def _run(self, points, kwargs):
+        location = self.entry_point(points if self.accepts_array else points.tolist(), **kwargs)
+        return None if location is None else np.asarray(location, dtype=float)
+
+
+#registered algorithms in response and batch column order
+REGISTRY = OrderedDict()
+
+
+def register(algorithm) -> Algorithm:
+    if algorithm.name in REGISTRY:
+        raise ValueError(f"Algorithm '{algorithm.name}' is already registered")
+    REGISTRY[algorithm.name] = algorithm
+    return algorithm
+
+
+def get(name) -> Algorithm:
+    """
+    Registered algorithm by name or label.
+    """
+    for algorithm in REGISTRY.values():
+        if name in (algorithm.name, algorithm.label):
+            return algorithm
+    raise ValueError(f"Unknown algorithm '{name}', expected one of {', '.join(REGISTRY)}")
+
+
+def preload(algorithms=None):
+    """
+    Load the given algorithms, every registered one by default, see Algorithm.load.
+    """
+    for algorithm in REGISTRY.values() if algorithms is None else algorithms:
+        algorithm.load()
+
+
+def enabled(names=None, batch=False) -> list:
+    """
+    The algorithms to run.
+
+    Parameters:
+    names (str or list of str): Algorithm names or labels, comma separated when a string, every registered one when empty.
+    batch (bool): Only keep the algorithms the batch pipeline runs, when names is empty.
+
+    Returns:
+    list: Algorithm objects in registry order.
+    """
+    if isinstance(names, str):
+        names = [name.strip() for name in names.split(',') if name.strip()]
+    if not names:
+        return [algorithm for algorithm in REGISTRY.values() if algorithm.batch or not batch]
+    chosen = {get(name).name for name in names}
+    return [algorithm for algorithm in REGISTRY.values() if algorithm.name in chosen]
+
+
+register(Algorithm('Frank', 'Frank', 'algos.frank', 'choose_new_location', context=('index',), top_k=True,
+                   dependencies=('sklearn.neighbors', 'scipy.ndimage')))
+register(Algorithm('Noah_C', 'Noah C', 'algos.noah_c', 'choose_new_location', accepts_array=False))
+register(Algorithm('Noah_S', 'Noah S', 'algos.noah_s', 'choose_new_location_kmeans', context=('index', 'centroids'), top_k=True,
+                   dependencies=('sklearn.neighbors', 'sklearn.cluster')))
+register(Algorithm('Bartley', 'Bartley', 'algos.bartley', 'choose_new_location', context=('index',), batch=False, top_k=True,
+                   dependencies=('sklearn.neighbors',),
+                   params={'ev_range': 45.0, 'min_demand_share': 0.25, 'grid_size': (50, 50), 'solver': 'auto'}))
@@ -0,0 +1,140 @@
+import argparse
+import os
+from functools import lru_cache
+
+import numpy as np
+import orjson
+import pandas as pd
+import shapely
+from algos.distance import EARTH_RADIUS_KM, as_coordinates
+
+#region files and the manifest of their bounds
+ROAD_STORE_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'data', 'roads')
+MANIFEST = 'regions.json'
+
+_KM_PER_DEGREE = np.pi / 180 * EARTH_RADIUS_KM
+
+
+class RoadNetwork:
+    """
+    Road geometries of one region behind an STRtree, queried in a local kilometre projection.
+
+    Geometries are stored as longitude/latitude and projected once, equirectangularly around the
+    region's centre, so nearest-road distances come out in kilometres. Over a city sized region
+    the projection is accurate to well under a percent.
+
+    Parameters:
+    geometries (np.ndarray of shapely geometries): Road lines as (longitude, latitude).
+    """
+
+    def __init__(self, geometries):
+        self.geometries = np.asarray(geometries, dtype=object)
+        west, south, east, north = shapely.total_bounds(self.geometries)
+        self.bounds = (west, south, east, north)
+        self._origin = ((west + east) / 2, (south + north) / 2)
+        self._lon_scale = _KM_PER_DEGREE * np.cos(np.radians(self._origin[1]))
+        self._tree = shapely.STRtree(shapely.transform(self.geometries, self._project))
+
+    def _project(self, coords):
+        # (n, 2) longitude/latitude -> (n, 2) kilometres from the region's centre
+        return np.column_stack(((coords[:, 0] - self._origin[0]) * self._lon_scale,
+                                (coords[:, 1] - self._origin[1]) * _KM_PER_DEGREE))
+
+    def __len__(self) -> int:
+        return len(self.geometries)
+
+    @classmethod
+    def from_parquet(cls, path):
+        return cls(shapely.from_wkb(pd.read_parquet(path, columns=['geometry'], engine='fastparquet')['geometry'].to_numpy()))
+
+    def to_parquet(self, path):
+        pd.DataFrame({'geometry': shapely.to_wkb(self.geometries)}).to_parquet(path, engine='fastparquet')
+
+    def nearest_road_distance(self, points) -> np.ndarray:
+        """
+        Distance in kilometres from every point to its nearest road.
+
+        Parameters:
+        points (array-like): Query locations as (latitude, longitude) coordinates.
+
+        Returns:
+        np.ndarray: Distance per point.
+        """
+        points = as_coordinates(points)
+        distances = np.full(len(points), np.inf)
+        if len(points) == 0 or len(self.geometries) == 0:
+            return distances
+        projected = shapely.points(self._project(points[:, ::-1]))
+        (rows, _), dist = self._tree.query_nearest(projected, return_distance=True, all_matches=False)
+        distances[rows] = dist
+        return distances
+
+
+class RoadNetworkStore:
+    """
+    Directory of pre-extracted road regions, one parquet file of WKB geometries per region
+    plus a manifest of their bounds. Regions are loaded on first use and kept per process.
+
+    Parameters:
+    directory (str): Store directory, data/roads by default.
+    """
+
+    def __init__(self, directory=ROAD_STORE_DIR):
+        self.directory = directory
+
+    def regions(self) -> dict:
+        try:
+            with open(os.path.join(self.directory, MANIFEST), 'rb') as f:
+                return orjson.loads(f.read())
+        except FileNotFoundError:
+            return {}
+
+    def load(self, region) -> RoadNetwork:
+        return _load_region(os.path.join(self.directory, f'{region}.parquet'))
+
+    def for_bbox(self, bbox):
+        """
+        The smallest stored region covering bbox, None when no region covers it.
+
+        Parameters:
+        bbox (tuple): (west, south, east, north) in degrees.
+        """
+        west, south, east, north = bbox
+        covering = [(abs((b[2] - b[0]) * (b[3] - b[1])), region) for region, b in self.regions().items()
+                    if b[0] <= west and b[1] <= south and east <= b[2] and north <= b[3]]
+        return self.load(min(covering)[1]) if covering else None
+
+    def save(self, region, network):
+        os.makedirs(self.directory, exist_ok=True)
+        network.to_parquet(os.path.join(self.directory, f'{region}.parquet'))
+        regions = self.regions()
+        regions[region] = [float(b) for b in network.bounds]
+        #manifest last so a region is never listed before its file is complete
+        with open(os.path.join(self.directory, MANIFEST), 'wb') as f:
+            f.write(orjson.dumps(regions, option=orjson.OPT_INDENT_2 | orjson.OPT_SORT_KEYS))
+        _load_region.cache_clear()
+
+
+@lru_cache(maxsize=8)
+def _load_region(path):
+    return RoadNetwork.from_parquet(path)
+
+
+def ExtractRegion(region, bbox, directory=ROAD_STORE_DIR, network_type='drive'):
+    # Download a region's road network from OpenStreetMap once, so optimizer runs never touch the network
+    import osmnx
+    west, south, east, north = bbox
+    #osmnx 2 takes the box as (west, south, east, north), the positional north, south, east, west form was removed
+    graph = osmnx.graph_from_bbox(bbox=(west, south, east, north), network_type=network_type)
+    edges = osmnx.graph_to_gdfs(graph, nodes=False, edges=True)
+    RoadNetworkStore(directory).save(region, RoadNetwork(edges['geometry'].to_numpy()))
+    print(f"Road network of {region} has been saved to {directory}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Extract an OpenStreetMap road network into the local road store.")
+    parser.add_argument('region', help="name the region is stored under")
+    parser.add_argument('bbox', type=float, nargs=4, metavar=('WEST', 'SOUTH', 'EAST', 'NORTH'))
+    parser.add_argument('--directory', default=ROAD_STORE_DIR)
+    args = parser.parse_args()
+    ExtractRegion(args.region, args.bbox, args.directory)
@@ -0,0 +1,165 @@
+import numpy as np
+from algos.distance import EARTH_RADIUS_KM, as_coordinates, distance_matrix, vincenty
+
+#haversine and WGS-84 distances differ by well under this factor, used to pad radius searches
+_METRIC_SLACK = 1.01
+#query points per radius search in count_within, dense areas return thousands of matches per point
+_RADIUS_CHUNK = 256
+
+
+class StationIndex:
+    """
+    Nearest-neighbour index over a set of station locations.
+
+    The index is a BallTree with the haversine metric built once per station set, so bulk
+    queries cost O(points log stations) instead of a scan over every station. With the default
+    geodesic method the handful of closest haversine matches are re-measured on the WGS-84
+    ellipsoid, giving the same distances as algos.distance.nearest_distance.
+
+    Parameters:
+    locations (list of tuples or np.ndarray): Station locations as (latitude, longitude) coordinates.
+    method (str): 'geodesic' (WGS-84) or 'haversine' distances in the query results.
+    refine (int): Number of haversine candidates re-measured per query point in geodesic mode.
+    """
+
+    def __init__(self, locations, method='geodesic', refine=4, leaf_size=40):
+        if method not in ('geodesic', 'haversine'):
+            raise ValueError(f"Unknown distance method '{method}', expected 'haversine' or 'geodesic'")
+        self.locations = as_coordinates(locations)
+        self.method = method
+        self.refine = refine
+        #sklearn is imported by the first index built, not when the server starts
+        from sklearn.neighbors import BallTree
+        self._tree = BallTree(np.radians(self.locations), metric='haversine', leaf_size=leaf_size)
+
+    def __len__(self) -> int:
+        return len(self.locations)
+
+    def nearest(self, points, k=1):
+        """
+        Find the k nearest stations for every point.
+
+        Parameters:
+        points (array-like): Query locations as (latitude, longitude) coordinates.
+        k (int): Number of neighbours, clipped to the number of stations.
+
+        Returns:
+        tuple: (distances in kilometers of shape (n, k), station indices of shape (n, k)), nearest first.
+        """
+        points = as_coordinates(points)
+        k = min(k, len(self))
+        if self.method == 'haversine':
+            dist, idx = self._tree.query(np.radians(points), k=k)
+            return dist * EARTH_RADIUS_KM, idx
+
+        candidates = min(len(self), k + self.refine - 1)
+        idx = self._tree.query(np.radians(points), k=candidates, return_distance=False)
+        dist = vincenty(points[:, 0, None], points[:, 1, None], self.locations[idx, 0], self.locations[idx, 1])
+        order = np.argsort(dist, axis=1, kind='stable')[:, :k]
+        return np.take_along_axis(dist, order, axis=1), np.take_along_axis(idx, order, axis=1)
+
+    def nearest_distance(self, points):
+        """
+        Distance from every point to its nearest station.
+
+        Returns:
+        tuple: (distances in kilometers of shape (n,), station indices of shape (n,))
+        """
+        dist, idx = self.nearest(points, k=1)
+        return dist[:, 0], idx[:, 0]
+
+    def query_radius(self, points, radius_km, return_distance=False):
+        """
+        Find all stations within radius_km of every point.
+
+        Parameters:
+        points (array-like): Query locations as (latitude, longitude) coordinates.
+        radius_km (float): Search radius in kilometers.
+        return_distance (bool): Also return the distance to every match.
+
+        Returns:
+        list of np.ndarray: Station indices per point, and distances per point if return_distance is set.
+        """
+        points = as_coordinates(points)
+        slack = 1 if self.method == 'haversine' else _METRIC_SLACK
+        idx, dist = self._tree.query_radius(np.radians(points), r=radius_km * slack / EARTH_RADIUS_KM,
+                                            return_distance=True)
+        if self.method == 'haversine':
+            return (list(idx), [d * EARTH_RADIUS_KM for d in dist]) if return_distance else list(idx)
+
+        #re-measure every match on the ellipsoid in one call and drop the ones the padding let in
+        counts = np.array([len(m) for m in idx])
+        rows = np.repeat(np.arange(len(points)), counts)
+        flat = np.concatenate(idx).astype(np.intp) if len(idx) else np.empty(0, dtype=np.intp)
+        exact = vincenty(points[rows, 0], points[rows, 1], self.locations[flat, 0], self.locations[flat, 1])
+        keep = exact <= radius_km
+        splits = np.cumsum(np.bincount(rows[keep], minlength=len(points)))[:-1]
+        idx, dist = np.split(flat[keep], splits), np.split(exact[keep], splits)
+        return (list(idx), dist) if return_distance else list(idx)
+
+    def count_within(self, points, radius_km, weights=None) -> np.ndarray:
+        """
+        Count (or sum the weights of) the stations within radius_km of every point.
+
+        Parameters:
+        points (array-like): Query locations as (latitude, longitude) coordinates.
+        radius_km (float): Search radius in kilometers.
+        weights (array-like): Optional weight per station, e.g. the number of EV users at a cluster.
+
+        Returns:
+        np.ndarray: Count or weight sum per point.
+        """
+        points = as_coordinates(points)
+        if weights is None and self.method == 'haversine':
+            return self._tree.query_radius(np.radians(points), r=radius_km / EARTH_RADIUS_KM, count_only=True)
+
+        #matches are materialised a chunk of points at a time so dense queries stay within memory
+        weights = None if weights is None else np.asarray(weights)
+        totals = np.zeros(len(points), dtype=float if weights is not None else np.int64)
+        for start in range(0, len(points), _RADIUS_CHUNK):
+            matches = self.query_radius(points[start:start + _RADIUS_CHUNK], radius_km)
+            if weights is None:
+                totals[start:start + len(matches)] = [len(m) for m in matches]
+                continue
+            rows = np.repeat(np.arange(len(matches)), [len(m) for m in matches])
+            flat = np.concatenate(matches).astype(np.intp) if matches else np.empty(0, dtype=np.intp)
+            totals[start:start + len(matches)] = np.bincount(rows, weights=weights[flat], minlength=len(matches))
+        return totals
+
+
+class DistanceField:
+    """
+    Distance from a fixed set of points, such as candidate grid cells, to their nearest station,
+    kept current as new stations are placed.
+
+    The field is measured once against the existing stations through a StationIndex. Placing a
+    station then only takes the minimum with the distances to that one location, an O(points)
+    update instead of a new index and a full nearest-station pass.
+
+    Parameters:
+    points (array-like): Locations the field is measured at, as (latitude, longitude) coordinates.
+    index (StationIndex): Index over the existing stations.
+    distances (np.ndarray): Precomputed distances in kilometers, used instead of querying index.
+    method (str): Distance kernel of the updates, the index's method when an index is given.
+    """
+
+    def __init__(self, points, index=None, distances=None, method='geodesic'):
+        self.points = as_coordinates(points)
+        self.method = method if index is None else index.method
+        if distances is None:
+            distances = index.nearest_distance(self.points)[0] if len(self.points) else np.empty(0)
+        self.distances = np.array(distances, dtype=float)
+
+    def __len__(self) -> int:
+        return len(self.points)
+
+    def add(self, location) -> np.ndarray:
+        """
+        Account for a station placed at location.
+
+        Returns:
+        np.ndarray: Distance in kilometers from every point to the new station.
+        """
+        new = distance_matrix(self.points, location, method=self.method)[:, 0]
+        np.minimum(self.distances, new, out=self.distances)
+        return new
@@ -0,0 +1,285 @@
+import argparse
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import numpy as np
+import orjson
+import pandas as pd
+from algos import registry
+from algos.spatial_index import StationIndex
+
+SCALES = [10, 100, 1000, 10000]
+PERCENTILES = [50, 90, 99]
+#coordinate sources of data/ to sample real station layouts from, the first that exists is used
+SAMPLE_SOURCES = ['data/OpenStations.parquet', 'data/MapData.parquet', 'data/predictions.parquet']
+
+def SyntheticStations(n, seed=0):
+    # n stations in a handful of gaussian city clusters around Atlanta, the density the map shows at city zoom
+    rng = np.random.default_rng(seed)
+    n_cities = max(1, n // 200)
+    centers = np.column_stack((rng.uniform(33.0, 34.5, n_cities), rng.uniform(-85.0, -83.5, n_cities)))
+    city = rng.integers(0, n_cities, n)
+    return centers[city] + rng.normal(0, 0.05, (n, 2))
+
+def SampledStations(n, path, seed=0):
+    # The n real locations closest to a random anchor location, a compact region like a map view
+    df = pd.read_parquet(path)
+    lat, lon = df['Latitude'].to_numpy(dtype=float), df['Longitude'].to_numpy(dtype=float)
+    if 'New_Latitude' in df.columns:
+        #predictions.parquet keeps Noah C and Noah S locations in the New_ columns
+        lat = np.where(np.isnan(lat), df['New_Latitude'].to_numpy(dtype=float), lat)
+        lon = np.where(np.isnan(lon), df['New_Longitude'].to_numpy(dtype=float), lon)
+    points = np.unique(np.column_stack((lat, lon))[~(np.isnan(lat) | np.isnan(lon))], axis=0)
+    if len(points) < n:
+        return None
+    anchor = points[np.random.default_rng(seed).integers(len(points))]
+    _, idx = StationIndex(points, method='haversine').nearest(anchor[None, :], k=n)
+    return points[idx[0]]
+
+def StationSets(scales, source, seed=0):
+    # Yield (scale, source name, (n, 2) array) for every requested scale
+    for scale in scales:
+        if source in ('synthetic', 'all'):
+            yield scale, 'synthetic', SyntheticStations(scale, seed)
+        if source in ('sampled', 'all'):
+            path = next((p for p in SAMPLE_SOURCES if os.path.exists(p)), None)
+            points = None if path is None else SampledStations(scale, path, seed)
+            if points is None:
+                print(f"Skipping sampled stations at scale {scale}, data/ has too few locations")
+                continue
+            yield scale, 'sampled', points
+
+def Measure(func, repeats=5, warmup=1):
+    # Latency percentiles in milliseconds over repeats calls, then the traced peak memory of one more call
+    for _ in range(warmup):
+        func()
+    times = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        func()
+        times.append((time.perf_counter() - start) * 1000)
+
+    tracemalloc.start()
+    try:
+        func()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    times = np.array(times)
+    stats = {f'p{p}_ms': float(np.percentile(times, p)) for p in PERCENTILES}
+    stats.update({'mean_ms': float(times.mean()), 'min_ms': float(times.min()), 'max_ms': float(times.max()),
+                  'repeats': repeats, 'peak_mib': peak / 2 ** 20})
+    return stats
+
+def BenchmarkAlgorithms(station_sets, algorithms, repeats):
+    # Time every algorithm through its registry entry point, shared index built per call like /run_model does
+    results = []
+    for scale, source, points in station_sets:
+        for algorithm in algorithms:
+            def run():
+                algorithm(points, {'index': StationIndex(points)})
+            stats = Measure(run, repeats)
+            results.append({'kind': 'algorithm', 'name': algorithm.name, 'scale': scale, 'source': source, **stats})
+            print(f"{algorithm.name:>10} {source:>9} {scale:>6}: p50 {stats['p50_ms']:9.1f} ms, peak {stats['peak_mib']:7.1f} MiB")
+    return results
+
+def SyntheticMapData(points, seed=0):
+    # MapData rows for a station set: the stations as Original rows plus one prediction per algorithm and year
+    rng = np.random.default_rng(seed)
+    years = rng.integers(2010, 2024, len(points))
+    stations = pd.DataFrame({
+        'Station Name': [f'Station {i}' for i in range(len(points))],
+        'Street Address': [f'{i} Main St' for i in range(len(points))],
+        'City': 'Benchmark', 'State': 'GA', 'ZIP': '30301',
+        'Latitude': points[:, 0], 'Longitude': points[:, 1],
+        'Open Date': [f'{year}-01-01' for year in years], 'Year': years, 'Algorithm': 'Original',
+    })
+    names = [algorithm.name for algorithm in registry.enabled(batch=True)]
+    prediction_years = np.repeat(np.arange(2010, 2024), len(names))
+    picked = rng.integers(0, len(points), len(prediction_years))
+    predicted = pd.DataFrame({'City': 'Benchmark', 'State': 'GA', 'Year': prediction_years, 'Algorithm': np.tile(names, 14),
+                              'Latitude': points[picked, 0], 'Longitude': points[picked, 1]})
+    return pd.concat([stations, predicted], ignore_index=True)
+
+def BenchmarkRoutes(station_sets, repeats, cache=False):
+    # Time /run_model and /station_data through the Flask test client with each station set loaded as the station store
+    if not cache:
+        os.environ['PREDICTION_CACHE_BACKEND'] = 'none'
+    #per-request log lines would drown the results
+    os.environ.setdefault('REQUEST_LOG', '0')
+    import server
+    from stationstore import StationStore
+    client = server.app.test_client()
+
+    results = []
+    for scale, source, points in station_sets:
+        server.station_store = StationStore(SyntheticMapData(points))
+        server.station_payloads = None
+        west, south = points.min(axis=0)[::-1]
+        east, north = points.max(axis=0)[::-1]
+        mid_lon, mid_lat = (west + east) / 2, (south + north) / 2
+        payload = {'filtered_station_data': [[lat, lon, '2020-01-01'] for lat, lon in points.tolist()]}
+        requests = {
+            '/run_model': lambda: client.post('/run_model', json=payload),
+            '/station_data': lambda: client.get('/station_data', headers={'Accept-Encoding': 'br'}),
+            '/station_data?bbox&year': lambda: client.get(f'/station_data?bbox={west},{south},{mid_lon},{mid_lat}&year=2020'),
+        }
+        for route, request in requests.items():
+            response = request()
+            if response.status_code != 200:
+                print(f"Skipping {route} at scale {scale}, it answered {response.status_code}")
+                continue
+            stats = Measure(request, repeats)
+            results.append({'kind': 'route', 'name': route, 'scale': scale, 'source': source, **stats})
+            print(f"{route:>24} {source:>9} {scale:>6}: p50 {stats['p50_ms']:9.1f} ms, peak {stats['peak_mib']:7.1f} MiB")
+    return results
+
+#run in a fresh interpreter per startup mode: imports the server in the "master" when preloading, forks the
+#workers, and has each worker import the server if it was not preloaded, answer its first requests and report its memory
+STARTUP_PROBE = r"""
+import os, sys, time
+import orjson
+
+def memory():
+    # Rss, Pss and private (unshared) memory of this process in MiB from smaps_rollup, empty off Linux
+    fields = {}
+    try:
+        with open('/proc/self/smaps_rollup') as f:
+            for line in f:
+                parts = line.split()
+                if len(parts) >= 3 and parts[1].isdigit():
+                    fields[parts[0].rstrip(':')] = int(parts[1]) / 1024
+    except OSError:
+        return {}
+    return {'rss_mib': fields['Rss'], 'pss_mib': fields['Pss'], 'private_mib': fields['Private_Clean'] + fields['Private_Dirty']}
+
+workers, payload = int(sys.argv[1]), orjson.loads(sys.argv[2])
+preload = os.environ.get('PRELOAD_ALGORITHMS') == '1'
+start = time.perf_counter()
+if preload:
+    import server
+master_import = time.perf_counter() - start
+
+pipes = []
+for _ in range(workers):
+    read, write = os.pipe()
+    if os.fork() == 0:
+        os.close(read)
+        start = time.perf_counter()
+        import server
+        boot = time.perf_counter() - start
+        client = server.app.test_client()
+        start = time.perf_counter()
+        client.get('/station_data?year=2020')
+        client.post('/run_model', json=payload)
+        first_request = time.perf_counter() - start
+        os.write(write, orjson.dumps({'boot_s': boot, 'first_request_s': first_request, **memory()}))
+        os._exit(0)
+    os.close(write)
+    pipes.append(read)
+
+reports = []
+for read in pipes:
+    with os.fdopen(read, 'rb') as f:
+        reports.append(orjson.loads(f.read()))
+    os.wait()
+print(orjson.dumps({'master_import_s': master_import, 'master': memory(), 'workers': reports}).decode())
+"""
+
+def BenchmarkStartup(points, source, workers=4, repeats=3):
+    # Cold start and per-worker memory of a gunicorn-like fork of the server, with and without preloading
+    scale = len(points)
+    with tempfile.TemporaryDirectory() as tmp:
+        map_data = os.path.join(tmp, 'MapData.parquet')
+        SyntheticMapData(points).to_parquet(map_data, engine='fastparquet')
+        env = {**os.environ, 'MAP_DATA_PATH': map_data, 'STATION_STORE_DIR': os.path.join(tmp, 'stationstore'),
+               'STATION_PAYLOAD_DIR': os.path.join(tmp, 'payloads'), 'CLUSTER_CACHE_PATH': os.path.join(tmp, 'clusters.parquet'),
+               'PREDICTION_CACHE_BACKEND': 'none', 'REQUEST_LOG': '0'}
+        payload = orjson.dumps({'filtered_station_data': [[lat, lon, '2020-01-01'] for lat, lon in points[:1000].tolist()]}).decode()
+
+        results = []
+        #the first run maps the store and builds the cluster pyramid, later starts find them on disk like a deployed container
+        subprocess.run([sys.executable, '-c', STARTUP_PROBE, '1', payload], env=env, capture_output=True, check=True)
+        for mode, preload in (('per-worker imports', '0'), ('preload', '1')):
+            runs = []
+            for _ in range(repeats):
+                out = subprocess.run([sys.executable, '-c', STARTUP_PROBE, str(workers), payload], env={**env, 'PRELOAD_ALGORITHMS': preload},
+                                     capture_output=True, text=True, check=True).stdout
+                runs.append(orjson.loads(out.strip().splitlines()[-1]))
+            #a worker is ready once the master imported (preload only) and the worker itself booted
+            ready_ms = np.array([(run['master_import_s'] + max(w['boot_s'] for w in run['workers'])) * 1000 for run in runs])
+            worker = lambda key: float(np.mean([w.get(key, np.nan) for run in runs for w in run['workers']]))
+            stats = {f'p{p}_ms': float(np.percentile(ready_ms, p)) for p in PERCENTILES}
+            stats.update({'mean_ms': float(ready_ms.mean()), 'min_ms': float(ready_ms.min()), 'max_ms': float(ready_ms.max()), 'repeats': repeats,
+                          'workers': workers, 'master_import_ms': float(np.mean([run['master_import_s'] for run in runs]) * 1000),
+                          'worker_boot_ms': worker('boot_s') * 1000, 'first_request_ms': worker('first_request_s') * 1000,
+                          'worker_rss_mib': worker('rss_mib'), 'worker_pss_mib': worker('pss_mib'), 'worker_private_mib': worker('private_mib')})
+            results.append({'kind': 'startup', 'name': mode, 'scale': scale, 'source': source, **stats})
+            print(f"{mode:>24} {source:>9} {scale:>6}: ready {stats['p50_ms']:7.0f} ms, first request {stats['first_request_ms']:7.0f} ms, "
+                  f"worker rss {stats['worker_rss_mib']:6.1f} MiB, pss {stats['worker_pss_mib']:6.1f} MiB, private {stats['worker_private_mib']:6.1f} MiB")
+    return results
+
+def Environment():
+    try:
+        commit = subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {'commit': commit, 'python': platform.python_version(), 'platform': platform.platform(),
+            'cpus': os.cpu_count(), 'numpy': np.__version__, 'time': time.strftime('%Y-%m-%dT%H:%M:%S')}
+
+def Compare(results, baseline_path):
+    # Print the p50 change of every measurement also present in a previous results file
+    with open(baseline_path, 'rb') as f:
+        baseline = {(r['kind'], r['name'], r['scale'], r['source']): r for r in orjson.loads(f.read())['results']}
+    print(f"Compared with {baseline_path}:")
+    for r in results:
+        before = baseline.get((r['kind'], r['name'], r['scale'], r['source']))
+        if before is not None:
+            change = (r['p50_ms'] - before['p50_ms']) / before['p50_ms'] * 100
+            print(f"{r['name']:>24} {r['source']:>9} {r['scale']:>6}: p50 {before['p50_ms']:9.1f} -> {r['p50_ms']:9.1f} ms ({change:+.0f}%)")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Time the location algorithms and server routes across station-count scales.")
+    parser.add_argument('--scales', type=int, nargs='+', default=SCALES, help="station counts to benchmark")
+    parser.add_argument('--algorithms', default=None, help="comma separated algorithms, defaults to every registered one")
+    parser.add_argument('--source', choices=['synthetic', 'sampled', 'all'], default='all', help="where station sets come from")
+    parser.add_argument('--suite', choices=['algorithms', 'routes', 'startup', 'all'], default='all')
+    parser.add_argument('--workers', type=int, default=4, help="forked workers per startup measurement")
+    parser.add_argument('--repeats', type=int, default=5, help="timed calls per measurement")
+    parser.add_argument('--cache', action='store_true', help="keep the prediction cache on while timing /run_model")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', default=None, help="JSON results file, benchmark-<time>.json by default")
+    parser.add_argument('--compare', default=None, help="previous results file to compare against")
+    args = parser.parse_args()
+
+    if args.algorithms:
+        #the server only serves the chosen algorithms too
+        os.environ['ENABLED_ALGORITHMS'] = args.algorithms
+    station_sets = list(StationSets(args.scales, args.source, args.seed))
+
+    results = []
+    if args.suite in ('algorithms', 'all'):
+        results += BenchmarkAlgorithms(station_sets, registry.enabled(args.algorithms), args.repeats)
+    if args.suite in ('routes', 'all'):
+        results += BenchmarkRoutes(station_sets, args.repeats, cache=args.cache)
+    if args.suite in ('startup', 'all'):
+        #the largest station set of each source, startup cost grows with the data
+        largest = {}
+        for scale, source, points in station_sets:
+            largest[source] = points
+        for source, points in largest.items():
+            results += BenchmarkStartup(points, source, workers=args.workers)
+
+    output = args.output or f"benchmark-{time.strftime('%Y%m%d-%H%M%S')}.json"
+    with open(output, 'wb') as f:
+        f.write(orjson.dumps({'environment': Environment(), 'arguments': vars(args), 'results': results}, option=orjson.OPT_INDENT_2))
+    print(f"Benchmark results have been saved to {output}")
+    if args.compare:
+        Compare(results, args.compare)
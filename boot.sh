@@ -1,2 +1,9 @@
 #!/bin/sh 
-exec gunicorn -b :5000 --access-logfile - --error-logfile - server:app
\ No newline at end of file
+# gthread workers keep /jobs event streams and polls on threads instead of holding a whole worker each,
+# use a shared PREDICTION_CACHE_BACKEND (filesystem or redis) before raising WEB_WORKERS above 1 so any worker can report on a job
+# --preload imports the app, the algorithms and the mapped station store once in the master, PRELOAD=0 imports per worker instead
+if [ "${PRELOAD:-1}" = "1" ]; then
+    export PRELOAD_ALGORITHMS=1
+    set -- --preload
+fi
+exec gunicorn -b :5000 --worker-class gthread --workers ${WEB_WORKERS:-1} --threads ${WEB_THREADS:-8} "$@" --access-logfile - --error-logfile - server:app
@@ -0,0 +1,174 @@
+import os
+
+import numpy as np
+import orjson
+import pandas as pd
+from stationstore import ORIGINAL
+
+#zoom range of the Leaflet map in static/script.js
+MIN_ZOOM = 4
+MAX_ZOOM = 15
+#deepest tile answered, from the clusters of MAX_ZOOM; well past any map zoom and within int64 cell numbers
+MAX_TILE_ZOOM = 30
+#clusters are 64px grid cells, so a 256px tile holds at most 4 x 4 of them per algorithm
+CELLS_PER_TILE = 4
+
+_LEVEL_COLUMNS = ['cx', 'cy', 'Year', 'Algorithm']
+
+
+def mercator_cells(lat, lon, zoom) -> tuple:
+    """
+    Grid cell of every coordinate at a zoom level of the web mercator tile scheme Leaflet uses.
+    """
+    n = (2 ** zoom) * CELLS_PER_TILE
+    lat = np.clip(np.asarray(lat, dtype=float), -85.05112878, 85.05112878)
+    x = (np.asarray(lon, dtype=float) + 180.0) / 360.0
+    y = (1.0 - np.log(np.tan(np.radians(lat)) + 1.0 / np.cos(np.radians(lat))) / np.pi) / 2.0
+    return (np.clip(np.floor(x * n), 0, n - 1).astype(np.int64),
+            np.clip(np.floor(y * n), 0, n - 1).astype(np.int64))
+
+
+def build_pyramid(store) -> pd.DataFrame:
+    """
+    Aggregate the stations and predictions into grid clusters for every zoom level.
+
+    The finest level is built from the rows and each coarser level by merging 2 x 2 cells of the
+    level below. Rows are kept per (cell, Year, Algorithm) so a query can still pick the stations
+    opened up to a year, or the predictions made for it, without going back to the raw rows.
+
+    Returns:
+    pd.DataFrame: Columns z, cx, cy, Year, Algorithm, count, sum_lat, sum_lon.
+    """
+    cx, cy = mercator_cells(store.lat, store.lon, MAX_ZOOM)
+    level = pd.DataFrame({'cx': cx, 'cy': cy, 'Year': store.year, 'Algorithm': store.algorithm.astype(str),
+                          'count': 1, 'sum_lat': store.lat, 'sum_lon': store.lon})
+    level = level.groupby(_LEVEL_COLUMNS, as_index=False, sort=False).sum()
+
+    levels = []
+    for zoom in range(MAX_ZOOM, MIN_ZOOM - 1, -1):
+        levels.append(level.assign(z=zoom))
+        level = level.assign(cx=level['cx'] // 2, cy=level['cy'] // 2)
+        level = level.groupby(_LEVEL_COLUMNS, as_index=False, sort=False).sum()
+
+    pyramid = pd.concat(levels, ignore_index=True)
+    pyramid = pyramid.sort_values(['z', 'cx', 'cy'], kind='stable').reset_index(drop=True)
+    return pyramid[['z', 'cx', 'cy', 'Year', 'Algorithm', 'count', 'sum_lat', 'sum_lon']]
+
+
+def BuildClusterPyramid(map_data_path, cache_path):
+    # Build step run after MapData.parquet is written, so servers start with the pyramid cached
+    from stationpayload import source_signature
+    from stationstore import StationStore
+    ClusterTiles.load_or_build(StationStore.from_parquet(map_data_path), cache_path, source_signature(map_data_path))
+    print(f"Cluster pyramid has been saved to {cache_path}")
+
+
+class ClusterTiles:
+    """
+    Precomputed grid-cluster pyramid answering z/x/y tile queries.
+
+    Parameters:
+    pyramid (pd.DataFrame): Output of build_pyramid.
+    """
+
+    def __init__(self, pyramid):
+        self.levels = {}
+        for zoom, level in pyramid.groupby('z', sort=True):
+            self.levels[zoom] = {
+                'cx': level['cx'].to_numpy(np.int64),
+                'cy': level['cy'].to_numpy(np.int64),
+                'year': level['Year'].to_numpy(np.int64),
+                'algorithm': level['Algorithm'].to_numpy(dtype=object),
+                'count': level['count'].to_numpy(np.int64),
+                'sum_lat': level['sum_lat'].to_numpy(float),
+                'sum_lon': level['sum_lon'].to_numpy(float),
+            }
+
+    @classmethod
+    def load_or_build(cls, store, cache_path, signature):
+        """
+        Read the pyramid cached on disk, rebuilding it when it was made from other data.
+
+        Parameters:
+        store (StationStore): Station data the pyramid is built from on a cache miss.
+        cache_path (str): Parquet file of the cached pyramid, with its signature beside it.
+        signature (str): Signature of the MapData file the store was loaded from.
+        """
+        signature_path = cache_path + '.source'
+        if os.path.exists(cache_path) and os.path.exists(signature_path):
+            with open(signature_path) as f:
+                if f.read() == signature:
+                    return cls(pd.read_parquet(cache_path))
+
+        pyramid = build_pyramid(store)
+        try:
+            os.makedirs(os.path.dirname(cache_path) or '.', exist_ok=True)
+            pyramid.to_parquet(cache_path, engine='fastparquet')
+            with open(signature_path, 'w') as f:
+                f.write(signature)
+        except OSError:
+            #a read-only deployment still serves the pyramid it just built
+            pass
+        return cls(pyramid)
+
+    def tile(self, z, x, y, year=None, algorithms=None) -> list:
+        """
+        Clusters inside tile z/x/y.
+
+        Parameters:
+        z, x, y (int): Tile coordinates, z is clamped to the precomputed zoom range. Past
+            MAX_ZOOM the tile gets the MAX_ZOOM clusters whose centre lies inside it.
+        year (int): Stations opened up to this year and the predictions made for it.
+        algorithms (list of str): Algorithm values to keep, 'Original' for real stations.
+
+        Returns:
+        list: One {'lat', 'lon', 'count', 'algorithm'} dict per non-empty cell and algorithm.
+        """
+        tile_z, tile_x, tile_y = z, x, y
+        if z not in self.levels:
+            #scale the tile to the nearest precomputed level
+            clamped = min(max(z, MIN_ZOOM), MAX_ZOOM)
+            shift = z - clamped
+            x, y = (x >> shift, y >> shift) if shift > 0 else (x << -shift, y << -shift)
+            span = 2 ** max(0, -shift)
+            z = clamped
+        else:
+            span = 1
+        level = self.levels[z]
+
+        x0, y0 = x * CELLS_PER_TILE, y * CELLS_PER_TILE
+        x1, y1 = x0 + CELLS_PER_TILE * span, y0 + CELLS_PER_TILE * span
+        start, end = np.searchsorted(level['cx'], [x0, x1])
+        rows = np.arange(start, end)
+        rows = rows[(level['cy'][rows] >= y0) & (level['cy'][rows] < y1)]
+
+        algorithm = level['algorithm'][rows]
+        original = algorithm == ORIGINAL
+        if year is not None:
+            years = level['year'][rows]
+            keep = np.where(original, years <= year, years == year)
+            rows, algorithm, original = rows[keep], algorithm[keep], original[keep]
+        if algorithms is not None:
+            keep = np.isin(algorithm, list(algorithms))
+            rows, algorithm = rows[keep], algorithm[keep]
+        if len(rows) == 0:
+            return []
+
+        #merge the years of each (cell, algorithm)
+        cells = level['cx'][rows] * (2 ** 32) + level['cy'][rows]
+        labels, codes = np.unique(algorithm.astype(str), return_inverse=True)
+        keys, inverse = np.unique(np.column_stack((cells, codes)), axis=0, return_inverse=True)
+        inverse = inverse.ravel()
+        count = np.bincount(inverse, weights=level['count'][rows])
+        lat = np.bincount(inverse, weights=level['sum_lat'][rows]) / count
+        lon = np.bincount(inverse, weights=level['sum_lon'][rows]) / count
+        if tile_z > MAX_ZOOM:
+            #the level's cells are larger than the tile, keep the clusters centred in it so each is in one tile only
+            cx, cy = mercator_cells(lat, lon, tile_z)
+            inside = (cx // CELLS_PER_TILE == tile_x) & (cy // CELLS_PER_TILE == tile_y)
+            lat, lon, count, keys = lat[inside], lon[inside], count[inside], keys[inside]
+        return [{'lat': round(a, 5), 'lon': round(o, 5), 'count': int(n), 'algorithm': labels[k]}
+                for a, o, n, k in zip(lat.tolist(), lon.tolist(), count.tolist(), keys[:, 1].tolist())]
+
+    def tile_json(self, z, x, y, year=None, algorithms=None) -> bytes:
+        return orjson.dumps({'z': z, 'x': x, 'y': y, 'clusters': self.tile(z, x, y, year, algorithms)})
@@ -1,73 +1,175 @@
+import argparse
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
 import pandas as pd
-from algos.frank import choose_new_location as frank_choose_new_location
-from algos.noah_c import choose_new_location as noah_choose_new_location
-from algos.noah_s import choose_new_location_kmeans 
-
-def CreateOpenStationsfile(csv_file_path, parquet_file_path):
-    # Read the CSV file
-    df = pd.read_csv(csv_file_path)
-    keep_cols = ['Groups With Access Code', 'Fuel Type Code', 'Station Name', 'Street Address', 'City', 'State', 'ZIP', 'Status Code'
-                    , 'Latitude', 'Longitude', 'Open Date']
-    df = df[keep_cols].dropna(how='any')
-
-    df = df[(df['Status Code'] == 'E') & (df['Fuel Type Code'] == 'ELEC') & (df['Groups With Access Code'].str.contains('Public'))]
-    df.drop(['Status Code', 'Fuel Type Code', 'Groups With Access Code'], axis=1, inplace=True)
-    df['ZIP'] = df['ZIP'].astype(str)
-    df['Year'] = df['Open Date'].apply(lambda x: int(x.split('-')[0]))
+from algos import registry
+from algos.distance import sorted_coordinates
+from algos.spatial_index import StationIndex
+from predictioncache import station_fingerprint
+from predictionlookup import BuildPredictionLookup
+from stationpayload import BuildStationPayloads
+from stationstore import BuildStationStore
+from clustertiles import BuildClusterPyramid
+
+#AFDC columns kept from the raw CSV, every other column is never parsed
+RAW_DTYPES = {
+    'Groups With Access Code': 'str', 'Fuel Type Code': 'str', 'Station Name': 'str', 'Street Address': 'str',
+    'City': 'str', 'State': 'str', 'ZIP': 'str', 'Status Code': 'str',
+    'Latitude': 'float64', 'Longitude': 'float64', 'Open Date': 'str',
+}
+
+def RawStationChunks(csv_file_path, chunksize=50000):
+    # Yield DataFrames of the kept columns a block at a time, with pyarrow's multithreaded reader when it is installed
+    try:
+        import pyarrow as pa
+        from pyarrow import csv
+    except ImportError:
+        yield from pd.read_csv(csv_file_path, usecols=list(RAW_DTYPES), dtype=RAW_DTYPES, chunksize=chunksize)
+        return
+    column_types = {name: pa.float64() if dtype == 'float64' else pa.string() for name, dtype in RAW_DTYPES.items()}
+    reader = csv.open_csv(csv_file_path, read_options=csv.ReadOptions(block_size=16 << 20),
+                          convert_options=csv.ConvertOptions(include_columns=list(RAW_DTYPES), column_types=column_types, strings_can_be_null=True))
+    start = 0
+    for batch in reader:
+        #keep the CSV row numbers as the index, like pd.read_csv does
+        chunk = batch.to_pandas()
+        chunk.index = pd.RangeIndex(start, start + len(chunk))
+        start += len(chunk)
+        yield chunk
+
+def CreateOpenStationsfile(csv_file_path, parquet_file_path, chunksize=50000, row_group_size=50000):
+    # Stream the CSV in chunks, parsing only the kept columns, so memory is bounded by a chunk plus the open stations kept
+    chunks = []
+    for chunk in RawStationChunks(csv_file_path, chunksize):
+        chunk = chunk.dropna(how='any')
+        keep = ((chunk['Status Code'] == 'E') & (chunk['Fuel Type Code'] == 'ELEC')
+                & chunk['Groups With Access Code'].str.contains('Public', regex=False))
+        chunk = chunk.loc[keep, ['Station Name', 'Street Address', 'City', 'State', 'ZIP', 'Latitude', 'Longitude', 'Open Date']]
+        chunk['Year'] = chunk['Open Date'].str.partition('-')[0].astype('int64')
+        chunks.append(chunk)
+    df = pd.concat(chunks)
     df['Algorithm'] = 'Original'
+
+    # City and State repeat heavily, categories are built once over the whole file so every row group shares them
+    df['City'] = df['City'].astype('category')
+    df['State'] = df['State'].astype('category')
     # Convert to Parquet file
-    df.to_parquet(parquet_file_path, engine='fastparquet')
+    df.to_parquet(parquet_file_path, engine='fastparquet', row_group_offsets=row_group_size)
     print(f"OpenStations file has been created to {parquet_file_path}")
-    
-def GeneratePredictions(parquet_file_path, output_file_path):
+
+def PredictionTasks(df, years=range(2010, 2024), min_stations=10):
+    # Yield (year, city, state, locations) for every city with more than min_stations stations opened before year
+    # Locations are sorted like the server sorts a request's stations, so both give the same predictions
+    for year in years:
+        df_year = df[df['Year'] < year]
+        for (city, state), group in df_year.groupby(['City', 'State'], observed=True, sort=True):
+            if len(group) > min_stations:
+                yield year, city, state, sorted_coordinates(group[['Latitude', 'Longitude']].to_numpy(dtype=float))
+
+def PredictGroup(task, algorithms):
+    # Run every algorithm on one (year, city, state) station subset, returns an (algorithms, 2) array
+    # KMeans is fitted cold, so a group's predictions only depend on its own stations and a partial
+    # --incremental run reproduces a full one
+    year, city, state, locations = task
+    context = {'index': StationIndex(locations)}
+    result = np.full((len(algorithms), 2), np.nan)
+    for i, algorithm in enumerate(algorithms):
+        location = algorithm(locations, context)
+        if location is not None:
+            result[i] = location
+    return result
+
+def PredictCity(job):
+    # Run the years of one city, a city is one unit of work for the process pool
+    city_tasks, algorithms = job
+    return [PredictGroup(task, algorithms) for task in city_tasks]
+
+def ExistingPredictions(output_file_path, names):
+    # Map (Year, City, State) -> (fingerprint, (algorithms, 2) array) from a previous run's parquet file
+    if not os.path.exists(output_file_path):
+        return {}
+    existing = pd.read_parquet(output_file_path)
+    if 'Fingerprint' not in existing.columns:
+        return {}
+    existing = existing[existing['Algorithm'].isin(names)]
+    order = {name: i for i, name in enumerate(names)}
+    lookup = {}
+    for (year, city, state, fingerprint), group in existing.groupby(['Year', 'City', 'State', 'Fingerprint'], observed=True, sort=False):
+        if len(group) != len(names):
+            continue
+        coords = np.empty((len(names), 2))
+        coords[group['Algorithm'].map(order).to_numpy()] = group[['Latitude', 'Longitude']].to_numpy()
+        lookup[(year, city, state)] = (fingerprint, coords)
+    return lookup
+
+def GeneratePredictions(parquet_file_path, output_file_path, workers=None, chunksize=2, incremental=False, algorithms=None):
     # Read the list of open stations
     df = pd.read_parquet(parquet_file_path)
-    # Iterate over each row in the DataFrame and call the model to get the new location
     print(f"Total number of open stations: {len(df)}")
     print("Top 5 open stations:")
     print(df.head())
-    # Create a DataFrame to store the predictions
-    predictions = pd.DataFrame(columns=['Algorithm', 'Year', 'City', 'State', 'Latitude', 'Longitude'])
-    for year in range(2010, 2024):
-        df_year = df[df['Year'] < year]
-        city_state_group = df_year.groupby(['City', 'State']).filter(lambda x: len(x) > 10).groupby(['City', 'State'])
-
-        for (city, state), group in list(city_state_group):
-            print(year, city, state)
-            locations = list(group[['Latitude', 'Longitude']].itertuples(index=False, name=None))
-            
-            #Prediction 1
-            new_location = frank_choose_new_location(locations)
-            predictions = pd.concat([predictions, pd.DataFrame([{
-                'Algorithm': 'Frank',
-                'Year': year,
-                'City': city,
-                'State': state,
-                'Latitude': new_location[0],
-                'Longitude': new_location[1]
-            }])], ignore_index=True)
-            
-            #Prediction 2
-            new_location = noah_choose_new_location(locations)
-            predictions = pd.concat([predictions, pd.DataFrame([{
-                 'Algorithm': 'Noah_C',
-                 'Year': year,
-                 'City': city,
-                 'State': state,
-                 'Latitude': new_location[0],
-                 'Longitude': new_location[1]
-            }])], ignore_index=True)
-            
-            #Prediction 3
-            new_location = choose_new_location_kmeans(locations)
-            predictions = pd.concat([predictions, pd.DataFrame([{
-                 'Algorithm': 'Noah_S',
-                 'Year': year,
-                 'City': city,
-                 'State': state,
-                 'Latitude': new_location[0],
-                 'Longitude': new_location[1]
-            }])], ignore_index=True)
+
+    # Registered batch algorithms unless named, e.g. 'Frank,Noah_S'
+    algorithms = registry.enabled(algorithms, batch=True)
+    names = [algorithm.name for algorithm in algorithms]
+    tasks = list(PredictionTasks(df))
+    n_tasks, n_algos = len(tasks), len(algorithms)
+
+    # Fingerprint every station subset, an unchanged fingerprint means the stored predictions are still valid
+    # kmeans='cold' and order='sorted' keep rows of runs that warm-started each year from the one before,
+    # or ran on unsorted stations, from being reused
+    fingerprints = np.array([station_fingerprint(t[3], algorithms=names, kmeans='cold', order='sorted') for t in tasks], dtype=object)
+
+    # Preallocated columnar buffers, one row per (group, algorithm)
+    years = np.repeat(np.array([t[0] for t in tasks], dtype=np.int64), n_algos)
+    cities = np.repeat(np.array([t[1] for t in tasks], dtype=object), n_algos)
+    states = np.repeat(np.array([t[2] for t in tasks], dtype=object), n_algos)
+    algorithm_column = np.tile(np.array(names, dtype=object), n_tasks)
+    coords = np.empty((n_tasks, n_algos, 2))
+
+    todo = list(range(n_tasks))
+    if incremental:
+        existing = ExistingPredictions(output_file_path, names)
+        todo = []
+        for i, (year, city, state, _) in enumerate(tasks):
+            previous = existing.get((year, city, state))
+            if previous is not None and previous[0] == fingerprints[i]:
+                coords[i] = previous[1]
+            else:
+                todo.append(i)
+        print(f"Reusing {n_tasks - len(todo)} unchanged groups from {output_file_path}")
+    print(f"Generating predictions for {len(todo)} (Year, City, State) groups")
+
+    # Bucket the groups city-major, tasks are year-major so every bucket lists its years in order
+    cities_todo = {}
+    for i in todo:
+        cities_todo.setdefault((tasks[i][1], tasks[i][2]), []).append(i)
+
+    # Fan the cities out over a process pool, map keeps the results in bucket order
+    start = time.perf_counter()
+    done = 0
+    report_every = max(1, len(cities_todo) // 20)
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        buckets = list(cities_todo.values())
+        results = pool.map(PredictCity, [([tasks[i] for i in bucket], algorithms) for bucket in buckets], chunksize=chunksize)
+        for n_cities, (bucket, city_results) in enumerate(zip(buckets, results), start=1):
+            coords[bucket] = city_results
+            done += len(bucket)
+            if n_cities % report_every == 0 or n_cities == len(buckets):
+                elapsed = time.perf_counter() - start
+                print(f"{done}/{len(todo)} groups ({done / len(todo):.0%}), {done / elapsed:.1f} groups/s")
+
+    predictions = pd.DataFrame({
+        'Algorithm': algorithm_column,
+        'Year': years,
+        'City': cities,
+        'State': states,
+        'Latitude': coords[:, :, 0].ravel(),
+        'Longitude': coords[:, :, 1].ravel(),
+        'Fingerprint': np.repeat(fingerprints, n_algos),
+    })
 
     # Save the predictions DataFrame to a Parquet file
     predictions.to_parquet(output_file_path, engine='fastparquet')
@@ -80,7 +182,7 @@ def CombineDataFrames(openstations_file_path, predictions_file_path, combined_fi
     predictions_df = pd.read_parquet(predictions_file_path)
 
     # Merge the DataFrames on common columns
-    combined_df = pd.merge(openstations_df, predictions_df, how='outer', on=['City', 'State', 'Latitude', 'Longitude','Year','Algorithm'])
+    combined_df = pd.merge(openstations_df, predictions_df.drop(columns='Fingerprint', errors='ignore'), how='outer', on=['City', 'State', 'Latitude', 'Longitude','Year','Algorithm'])
 
     # Display the OpenStations DataFrame
     print("OpenStations DataFrame:")
@@ -99,10 +201,21 @@ def CombineDataFrames(openstations_file_path, predictions_file_path, combined_fi
     combined_df.to_parquet(combined_file_path, engine='fastparquet')
     print(f"Combined data has been saved to {combined_file_path}")
 
-# Do it
-rawfile = 'data/alt_fuel_station.csv'
-openstations = 'data/OpenStations.parquet'
-predictions = 'data/Predictions.parquet'
-CreateOpenStationsfile(rawfile, openstations)
-GeneratePredictions(openstations, predictions)
-CombineDataFrames(openstations, predictions, 'data/MapData.parquet')
\ No newline at end of file
+# Do it, guarded so the prediction worker processes can import this module
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Build the OpenStations, Predictions and MapData parquet files")
+    parser.add_argument('--incremental', action='store_true', help="only recompute predictions for (City, State, Year) groups whose stations changed")
+    parser.add_argument('--workers', type=int, default=None, help="prediction worker processes, defaults to the core count")
+    parser.add_argument('--algorithms', default=None, help="comma separated algorithms to run, defaults to the registered batch algorithms")
+    args = parser.parse_args()
+
+    rawfile = 'data/alt_fuel_station.csv'
+    openstations = 'data/OpenStations.parquet'
+    predictions = 'data/Predictions.parquet'
+    CreateOpenStationsfile(rawfile, openstations)
+    GeneratePredictions(openstations, predictions, workers=args.workers, incremental=args.incremental, algorithms=args.algorithms)
+    CombineDataFrames(openstations, predictions, 'data/MapData.parquet')
+    BuildStationStore('data/MapData.parquet', 'data/stationstore')
+    BuildStationPayloads('data/MapData.parquet', 'data/payloads')
+    BuildClusterPyramid('data/MapData.parquet', 'data/clusters.parquet')
+    BuildPredictionLookup(predictions, 'data/MapData.parquet')
\ No newline at end of file
@@ -1,5 +1,12 @@
+import argparse
+
 import pandas as pd
 import numpy as np
+from algos.spatial_index import StationIndex
+
+HORIZONS = (1, 3, 5)
+#a prediction within this many kilometers of a station that opened in its window is a hit
+HIT_RADIUS_KM = 5.0
 
 def haversine(lat1, lon1, lat2, lon2):
     # Convert latitude and longitude from degrees to radians
@@ -23,7 +30,7 @@ def CreateExperiments(station_data_path, predictions_path, write_path):
     predictions['Long'] = predictions['Longitude'].fillna(predictions['New_Longitude'])
 
     #first created location in a year
-    first_location = station_data.loc[station_data.groupby(['City', 'State', 'Year'])['Open Date'].idxmin()].reset_index(drop=True)
+    first_location = station_data.loc[station_data.groupby(['City', 'State', 'Year'], observed=True)['Open Date'].idxmin()].reset_index(drop=True)
     #create the year offset
     first_location['Year'] = first_location['Year'] - 1
     
@@ -37,4 +44,99 @@ def CreateExperiments(station_data_path, predictions_path, write_path):
     experiment.to_parquet(write_path, engine='fastparquet')
 
 
-CreateExperiments('data/OpenStations.parquet', 'data/predictions.parquet', 'data/experiment.parquet')
\ No newline at end of file
+def PredictedLocations(predictions):
+    # One row per prediction with a location, the New_ columns coalesced into Latitude and Longitude
+    predictions = predictions.copy()
+    if 'New_Latitude' in predictions.columns:
+        predictions['Latitude'] = predictions['Latitude'].fillna(predictions['New_Latitude'])
+        predictions['Longitude'] = predictions['Longitude'].fillna(predictions['New_Longitude'])
+    predictions = predictions.dropna(subset=['Latitude', 'Longitude'])
+    predictions['City'] = predictions['City'].astype(str)
+    predictions['State'] = predictions['State'].astype(str)
+    return predictions[['Algorithm', 'City', 'State', 'Year', 'Latitude', 'Longitude']].reset_index(drop=True)
+
+def FutureDistances(stations, predictions, horizons=HORIZONS, method='geodesic'):
+    # (predictions, horizons) distance in kilometers to the nearest station opened in the City and State within h years
+    # A prediction labelled Year Y was made from the stations opened before Y, so its h year window is Y .. Y+h-1.
+    # Every (City, State, opening year) gets its own index, queried once by the predictions whose widest window covers
+    # that year, and each horizon keeps the minimum over the years inside its window.
+    horizons = np.asarray(horizons)
+    distances = np.full((len(predictions), len(horizons)), np.inf)
+    cities = predictions.groupby(['City', 'State'], sort=False).indices
+    prediction_years = predictions['Year'].to_numpy()
+    points = predictions[['Latitude', 'Longitude']].to_numpy(dtype=float)
+
+    for (city, state, year), group in stations.groupby(['City', 'State', 'Year'], observed=True, sort=False):
+        rows = cities.get((str(city), str(state)))
+        if rows is None:
+            continue
+        #predictions whose widest window includes this opening year
+        rows = rows[(prediction_years[rows] <= year) & (prediction_years[rows] > year - horizons.max())]
+        if len(rows) == 0:
+            continue
+        index = StationIndex(group[['Latitude', 'Longitude']].to_numpy(dtype=float), method=method)
+        dist, _ = index.nearest_distance(points[rows])
+        in_window = prediction_years[rows, None] > year - horizons
+        distances[rows] = np.minimum(distances[rows], np.where(in_window, dist[:, None], np.inf))
+    return distances
+
+def EvaluatePredictions(station_data_path, predictions_path, write_path, summary_path, horizons=HORIZONS, radius_km=HIT_RADIUS_KM, method='geodesic'):
+    """
+    Score every prediction against the stations that actually opened in its city over the following years.
+
+    For each prediction and horizon h the distance to the nearest station opened in the h years
+    starting with the prediction's Year is measured, a hit is a distance of at most radius_km, and
+    the algorithms predicting the same (City, State, Year) are ranked by that distance, 1 being the
+    closest. Windows running past the last year in the station data are left out, they would
+    count stations that have not opened yet as misses.
+
+    Parameters:
+    station_data_path (str): OpenStations parquet file.
+    predictions_path (str): Predictions parquet file.
+    write_path (str): Parquet file of the per prediction and horizon scores.
+    summary_path (str): Parquet file of the per algorithm and horizon summary.
+    horizons (tuple of int): Window lengths in years.
+    radius_km (float): Largest distance in kilometers that counts as a hit.
+    method (str): 'geodesic' or 'haversine' distances.
+
+    Returns:
+    pd.DataFrame: The summary.
+    """
+    stations = pd.read_parquet(station_data_path, columns=['City', 'State', 'Year', 'Latitude', 'Longitude'])
+    predictions = PredictedLocations(pd.read_parquet(predictions_path))
+    distances = FutureDistances(stations, predictions, horizons, method)
+
+    last_year = stations['Year'].max()
+    scores = pd.concat([predictions.assign(Horizon=h, Distance=distances[:, i]) for i, h in enumerate(horizons)], ignore_index=True)
+    scores = scores[scores['Year'] + scores['Horizon'] - 1 <= last_year].reset_index(drop=True)
+    #no station opened in the window
+    scores['Distance'] = scores['Distance'].replace(np.inf, np.nan)
+    scores['Hit'] = scores['Distance'] <= radius_km
+    scores['Rank'] = scores.groupby(['City', 'State', 'Year', 'Horizon'])['Distance'].rank(method='min')
+    scores.to_parquet(write_path, engine='fastparquet')
+
+    scores['Reciprocal Rank'] = 1 / scores['Rank']
+    scores['Win'] = scores['Rank'] == 1
+    summary = scores.groupby(['Algorithm', 'Horizon']).agg(
+        Predictions=('Distance', 'size'), Scored=('Distance', 'count'), Hit_Rate=('Hit', 'mean'),
+        Mean_Distance=('Distance', 'mean'), Median_Distance=('Distance', 'median'),
+        Mean_Rank=('Rank', 'mean'), MRR=('Reciprocal Rank', 'mean'), Win_Rate=('Win', 'mean'),
+    ).reset_index()
+    summary.columns = [column.replace('_', ' ') for column in summary.columns]
+    summary['Radius km'] = radius_km
+    summary.to_parquet(summary_path, engine='fastparquet')
+    print(f"Evaluation of {len(predictions)} predictions has been saved to {write_path} and {summary_path}")
+    return summary
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Score the predictions against the stations that opened after them")
+    parser.add_argument('--horizons', type=int, nargs='+', default=list(HORIZONS), help="window lengths in years")
+    parser.add_argument('--radius', type=float, default=HIT_RADIUS_KM, help="hit radius in kilometers")
+    parser.add_argument('--method', choices=['geodesic', 'haversine'], default='geodesic')
+    args = parser.parse_args()
+
+    CreateExperiments('data/OpenStations.parquet', 'data/predictions.parquet', 'data/experiment.parquet')
+    summary = EvaluatePredictions('data/OpenStations.parquet', 'data/predictions.parquet', 'data/evaluation.parquet',
+                                  'data/evaluation_summary.parquet', tuple(args.horizons), args.radius, args.method)
+    print(summary.to_string(index=False))
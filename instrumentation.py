@@ -0,0 +1,192 @@
+import bisect
+import os
+import sys
+import threading
+import time
+from collections import Counter as _StackCounter
+from contextlib import contextmanager
+
+import orjson
+
+#latency buckets in seconds, from a cached response to a slow optimizer run
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+class StageTimer:
+    """
+    Wall-clock durations of the stages of one request, in the order they were recorded.
+    """
+
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.stages = {}
+
+    @contextmanager
+    def stage(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(name, time.perf_counter() - start)
+
+    def record(self, name, seconds):
+        self.stages[name] = self.stages.get(name, 0.0) + seconds
+
+    def elapsed(self) -> float:
+        return time.perf_counter() - self.start
+
+    def server_timing(self) -> str:
+        """
+        Server-Timing header value, stage durations in milliseconds plus the total.
+        """
+        entries = [f'{_token(name)};dur={seconds * 1000:.2f}' for name, seconds in self.stages.items()]
+        entries.append(f'total;dur={self.elapsed() * 1000:.2f}')
+        return ', '.join(entries)
+
+
+def _token(name):
+    # Server-Timing metric names are HTTP tokens, so spaces and separators become dashes
+    return ''.join(c if c.isalnum() or c in '-_.' else '-' for c in name.lower())
+
+
+def _labels(names, values):
+    # {name="value",...} with the label values escaped as the exposition format requires
+    if not names:
+        return ''
+    escaped = (str(v).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for v in values)
+    return '{' + ','.join(f'{n}="{v}"' for n, v in zip(names, escaped)) + '}'
+
+
+class Counter:
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *labels, amount=1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def render(self) -> list:
+        lines = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} counter']
+        with self._lock:
+            for labels, value in sorted(self._values.items()):
+                lines.append(f'{self.name}{_labels(self.labels, labels)} {value}')
+        return lines
+
+
+class Histogram:
+    def __init__(self, name, help, labels=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self.buckets = tuple(sorted(buckets))
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, *labels):
+        with self._lock:
+            counts, total = self._values.get(labels, ([0] * (len(self.buckets) + 1), 0.0))
+            counts[bisect.bisect_left(self.buckets, value)] += 1
+            self._values[labels] = (counts, total + value)
+
+    def render(self) -> list:
+        lines = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} histogram']
+        with self._lock:
+            for labels, (counts, total) in sorted(self._values.items()):
+                cumulative = 0
+                for bound, count in zip(self.buckets + (float('inf'),), counts):
+                    cumulative += count
+                    le = '+Inf' if bound == float('inf') else repr(bound)
+                    lines.append(f'{self.name}_bucket{_labels(self.labels + ("le",), labels + (le,))} {cumulative}')
+                lines.append(f'{self.name}_sum{_labels(self.labels, labels)} {total}')
+                lines.append(f'{self.name}_count{_labels(self.labels, labels)} {cumulative}')
+        return lines
+
+
+class Metrics:
+    """
+    Process-local metrics rendered in the Prometheus text format.
+
+    Every gunicorn worker keeps its own values, so a scraper sees the worker that answered;
+    scrape each worker or sum them downstream.
+    """
+
+    def __init__(self):
+        self._metrics = []
+
+    def counter(self, name, help, labels=()) -> Counter:
+        metric = Counter(name, help, labels)
+        self._metrics.append(metric)
+        return metric
+
+    def histogram(self, name, help, labels=(), buckets=DEFAULT_BUCKETS) -> Histogram:
+        metric = Histogram(name, help, labels, buckets)
+        self._metrics.append(metric)
+        return metric
+
+    def render(self) -> str:
+        return '\n'.join(line for metric in self._metrics for line in metric.render()) + '\n'
+
+
+def log_line(logger, **fields):
+    # One JSON object per line, keys sorted so lines diff and grep consistently
+    logger.info(orjson.dumps(fields, option=orjson.OPT_SORT_KEYS | orjson.OPT_SERIALIZE_NUMPY).decode())
+
+
+class SamplingProfiler:
+    """
+    Opt-in wall-clock sampler that keeps a profile of requests slower than a threshold.
+
+    While a request runs, a background thread records the Python stack of every thread each
+    interval. Algorithms run on model runner threads, so all threads are sampled, which also
+    picks up concurrent requests on a threaded worker. Profiles are written in the collapsed
+    stack format flame graph tools read ("frame;frame;frame count" per line).
+
+    Parameters:
+    threshold (float): Requests taking at least this many seconds are dumped.
+    out_dir (str): Directory profiles are written to.
+    interval (float): Seconds between samples.
+    """
+
+    def __init__(self, threshold, out_dir, interval=0.005):
+        self.threshold = threshold
+        self.out_dir = out_dir
+        self.interval = interval
+
+    def start(self):
+        stop = threading.Event()
+        stacks = _StackCounter()
+
+        def sample():
+            me = threading.get_ident()
+            while not stop.wait(self.interval):
+                for ident, frame in sys._current_frames().items():
+                    if ident == me:
+                        continue
+                    stack = []
+                    while frame is not None:
+                        stack.append(f'{frame.f_code.co_name} ({os.path.basename(frame.f_code.co_filename)}:{frame.f_code.co_firstlineno})')
+                        frame = frame.f_back
+                    stacks[';'.join(reversed(stack))] += 1
+
+        thread = threading.Thread(target=sample, name='request-profiler', daemon=True)
+        thread.start()
+        return stop, thread, stacks
+
+    def finish(self, session, elapsed, name):
+        """
+        Stop sampling, returns the profile's path when the request was slow enough to keep it.
+        """
+        stop, thread, stacks = session
+        stop.set()
+        thread.join()
+        if elapsed < self.threshold or not stacks:
+            return None
+        os.makedirs(self.out_dir, exist_ok=True)
+        path = os.path.join(self.out_dir, f"{time.strftime('%Y%m%d-%H%M%S')}-{_token(name)}-{elapsed * 1000:.0f}ms.folded")
+        with open(path, 'w') as f:
+            f.writelines(f'{stack} {count}\n' for stack, count in stacks.most_common())
+        return path
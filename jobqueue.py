@@ -0,0 +1,147 @@
+import os
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+import orjson
+
+
+class QueueFull(Exception):
+    """
+    Raised by JobQueue.submit when the queue already holds its maximum of unfinished jobs.
+    """
+
+
+class JobQueue:
+    """
+    Background model runs whose results are read while they come in.
+
+    A submitted job gets an id at once. A small pool of job threads hands its algorithms to the
+    ModelRunner and writes the job state back to the store as each algorithm finishes, so a
+    client polling or streaming the job sees fast algorithms before slow ones. At most
+    max_pending jobs are queued or running per process; beyond that submit raises QueueFull and
+    the client is expected to retry later.
+
+    The state lives in a cachelib store as JSON bytes. With the filesystem or redis backend any
+    gunicorn worker can answer for a job, with the memory backend only the one that accepted it.
+
+    Parameters:
+    runner (ModelRunner): Runs the algorithms of a job concurrently, with their timeouts.
+    store (cachelib.BaseCache): Where job states are kept.
+    max_pending (int): Unfinished jobs accepted before submit raises QueueFull.
+    workers (int): Jobs running at the same time.
+    ttl (int): Seconds a job state is kept after its last update.
+    """
+
+    def __init__(self, runner, store, max_pending=16, workers=2, ttl=3600):
+        self.runner = runner
+        self.store = store
+        self.max_pending = max_pending
+        self.workers = workers
+        self.ttl = ttl
+        self._pending = 0
+        self._lock = threading.Lock()
+        self._executor = None
+        self._pid = None
+
+    @property
+    def executor(self):
+        #created lazily in each process so it is never inherited across a gunicorn fork, under the lock so
+        #concurrent first submissions share one pool of job threads
+        with self._lock:
+            if self._executor is None or self._pid != os.getpid():
+                self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='job')
+                self._pid = os.getpid()
+            return self._executor
+
+    @property
+    def pending(self) -> int:
+        return self._pending
+
+    def _save(self, state):
+        self.store.set(f"job:{state['id']}", orjson.dumps(state), timeout=self.ttl)
+
+    def get(self, job_id) -> dict:
+        """
+        Current state of a job, None when it is unknown or has expired.
+
+        The state has the job's id, status ('queued', 'running', 'done' or 'failed'), results
+        keyed by algorithm in the order they finished, the algorithms still pending, the ones
+        that timed out or raised (failed), and an error message for a failed job.
+        """
+        state = self.store.get(f'job:{job_id}')
+        return None if state is None else orjson.loads(state)
+
+    def _new(self, tasks, status):
+        return {'id': uuid.uuid4().hex, 'status': status, 'submitted': time.time(), 'finished': None,
+                'results': {}, 'pending': list(tasks), 'timed_out': [], 'failed': [], 'error': None}
+
+    def submit(self, tasks, on_result=None, on_complete=None, results=None) -> str:
+        """
+        Queue a model run.
+
+        Parameters:
+        tasks (dict): Algorithm name -> (function, args, kwargs), see ModelRunner.run.
+        on_result (callable): Called with (name, status, result, seconds) as each algorithm
+            finishes, times out or fails (see ModelRunner.stream), returns the JSON value stored
+            for a finished one. The raw result when omitted.
+        on_complete (callable): Called with the final state of a job that did not fail.
+        results (dict): Results known before the job runs, e.g. precomputed ones, reported at once.
+
+        Returns:
+        str: The job id.
+        """
+        with self._lock:
+            if self._pending >= self.max_pending:
+                raise QueueFull(f'{self._pending} jobs are already waiting')
+            self._pending += 1
+        state = self._new(tasks, 'queued')
+        state['results'] = dict(results or {})
+        try:
+            self._save(state)
+            self.executor.submit(self._run, state, tasks, on_result, on_complete)
+        except BaseException:
+            with self._lock:
+                self._pending -= 1
+            raise
+        return state['id']
+
+    def submit_done(self, results) -> str:
+        """
+        Record a job that is finished already, e.g. answered from the prediction cache.
+        """
+        state = self._new((), 'done')
+        state['results'] = dict(results)
+        state['finished'] = state['submitted']
+        self._save(state)
+        return state['id']
+
+    def _run(self, state, tasks, on_result, on_complete):
+        try:
+            state['status'] = 'running'
+            self._save(state)
+            for name, status, result, seconds in self.runner.stream(tasks):
+                state['pending'].remove(name)
+                value = on_result(name, status, result, seconds) if on_result is not None else result
+                if status == 'done':
+                    state['results'][name] = value
+                else:
+                    state['timed_out' if status == 'timeout' else 'failed'].append(name)
+                self._save(state)
+            state['status'] = 'done'
+        except Exception as e:
+            state['status'] = 'failed'
+            state['error'] = f'{type(e).__name__}: {e}'
+        finally:
+            state['finished'] = time.time()
+            self._save(state)
+            with self._lock:
+                self._pending -= 1
+        if state['status'] == 'done' and on_complete is not None:
+            on_complete(state)
+
+    def shutdown(self):
+        if self._executor is not None and self._pid == os.getpid():
+            self._executor.shutdown(wait=False, cancel_futures=True)
+        self._executor = None
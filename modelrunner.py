@@ -0,0 +1,160 @@
+import logging
+import os
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, ThreadPoolExecutor, wait
+
+
+def _timed_call(func, args, kwargs):
+    # Run one task and measure it where it runs, so queueing in the pool is not counted
+    start = time.perf_counter()
+    result = func(*args, **kwargs)
+    return result, time.perf_counter() - start
+
+
+class ModelRunner:
+    """
+    Runs the location algorithms of a request concurrently with a timeout per algorithm.
+
+    Threads suit the numpy/sklearn heavy algorithms, which release the GIL in their inner loops;
+    processes isolate pure Python algorithms at the cost of pickling the inputs. The pool is
+    created lazily in each process so it is never inherited across a gunicorn fork.
+
+    Neither a thread nor a pool process can be stopped once its algorithm runs. When an algorithm
+    misses its timeout while still running, the runner retires the pool and later tasks go to a fresh
+    one, so a slow algorithm costs CPU until it returns but does not hold one of the max_workers slots
+    other requests queue for. Tasks already submitted to the retired pool still run there. At most
+    max_retired pools with such a task are kept alive; past that the pool is kept, the late algorithm
+    holds its slot, and tasks queued behind it time out at their own deadline without running.
+
+    An algorithm that raises is reported as failed and logged, the other algorithms are unaffected.
+
+    Parameters:
+    kind (str): 'thread' or 'process'.
+    max_workers (int): Pool size, the executor's default when None.
+    timeout (float): Seconds each algorithm may take unless overridden per algorithm.
+    timeouts (dict): Per-algorithm timeouts in seconds keyed by algorithm name.
+    max_retired (int): Retired pools whose late algorithms may still run at the same time.
+    """
+
+    def __init__(self, kind='thread', max_workers=None, timeout=30.0, timeouts=None, max_retired=2):
+        if kind not in ('thread', 'process'):
+            raise ValueError(f"Unknown executor kind '{kind}', expected 'thread' or 'process'")
+        self.kind = kind
+        self.max_workers = max_workers
+        self.timeout = timeout
+        self.timeouts = dict(timeouts or {})
+        self.max_retired = max_retired
+        self._executor = None
+        self._pid = None
+        self._lock = threading.Lock()
+        #retired pool -> its late futures, while any of them still runs
+        self._retired = {}
+
+    @property
+    def executor(self):
+        with self._lock:
+            if self._executor is None or self._pid != os.getpid():
+                pool = ThreadPoolExecutor if self.kind == 'thread' else ProcessPoolExecutor
+                self._executor = pool(max_workers=self.max_workers)
+                #pools retired before a fork belong to the parent
+                if self._pid != os.getpid():
+                    self._retired = {}
+                self._pid = os.getpid()
+            return self._executor
+
+    @property
+    def retired(self) -> int:
+        #retired pools with a late algorithm still running
+        with self._lock:
+            self._prune()
+            return len(self._retired)
+
+    def _prune(self):
+        #a retired pool is forgotten once its late algorithms have returned
+        late = {pool: [future for future in futures if not future.done()] for pool, futures in self._retired.items()}
+        self._retired = {pool: futures for pool, futures in late.items() if futures}
+
+    def _retire(self, executor, future):
+        #the next task gets a fresh pool, the retired one winds down once its running tasks return;
+        #False when max_retired pools are still winding down and this one is kept
+        with self._lock:
+            self._prune()
+            if executor in self._retired:
+                self._retired[executor].append(future)
+                return True
+            if len(self._retired) >= self.max_retired:
+                return False
+            self._retired[executor] = [future]
+            if self._executor is executor:
+                self._executor = None
+        executor.shutdown(wait=False)
+        return True
+
+    def run(self, tasks, durations=None):
+        """
+        Run every task concurrently and collect the ones that finish within their timeout.
+
+        Parameters:
+        tasks (dict): Algorithm name -> (function, args, kwargs).
+        durations (dict): Filled with algorithm name -> seconds the algorithm itself ran, for the ones that finished.
+
+        Returns:
+        tuple: (dict of algorithm name -> result, list of algorithm names that timed out, list of
+            algorithm names that raised)
+        """
+        results = {}
+        missing = {'timeout': [], 'failed': []}
+        for name, status, result, seconds in self.stream(tasks):
+            if status != 'done':
+                missing[status].append(name)
+                continue
+            results[name] = result
+            if durations is not None:
+                durations[name] = seconds
+        #in task order, like a response built from tasks would list them
+        return ({name: results[name] for name in tasks if name in results},
+                [name for name in tasks if name in missing['timeout']], [name for name in tasks if name in missing['failed']])
+
+    def stream(self, tasks):
+        """
+        Run every task concurrently and yield each one as soon as it finishes or times out.
+
+        Parameters:
+        tasks (dict): Algorithm name -> (function, args, kwargs).
+
+        Yields:
+        tuple: (algorithm name, status, result, seconds the algorithm ran), status is 'done',
+            'timeout' or 'failed', result and seconds are None unless it is 'done'.
+        """
+        start = time.monotonic()
+        executor = self.executor
+        futures = {executor.submit(_timed_call, func, args, kwargs): name for name, (func, args, kwargs) in tasks.items()}
+        deadlines = {future: start + self.timeouts.get(name, self.timeout) for future, name in futures.items()}
+
+        pending = set(futures)
+        while pending:
+            now = time.monotonic()
+            for future in [f for f in pending if deadlines[f] <= now and not f.done()]:
+                #a running thread can't be stopped, its result is simply dropped and its pool retired
+                if not future.cancel():
+                    self._retire(executor, future)
+                pending.discard(future)
+                yield futures[future], 'timeout', None, None
+            if not pending:
+                break
+            done, _ = wait(pending, timeout=max(0.0, min(deadlines[f] for f in pending) - now), return_when=FIRST_COMPLETED)
+            for future in done:
+                pending.discard(future)
+                try:
+                    result, seconds = future.result()
+                except Exception:
+                    logging.getLogger(__name__).exception('%s failed', futures[future])
+                    yield futures[future], 'failed', None, None
+                    continue
+                yield futures[future], 'done', result, seconds
+
+    def shutdown(self):
+        if self._executor is not None and self._pid == os.getpid():
+            self._executor.shutdown(wait=False, cancel_futures=True)
+        self._executor = None
@@ -0,0 +1,142 @@
+import hashlib
+import time
+from collections import OrderedDict
+from threading import Lock
+
+import numpy as np
+import orjson
+from cachelib import BaseCache, FileSystemCache, NullCache
+from algos.distance import as_coordinates
+
+
+def station_fingerprint(locations, decimals=5, **params) -> str:
+    """
+    Canonical fingerprint of a station set and the parameters a model run was made with.
+
+    Coordinates are rounded and sorted so the same stations hash the same regardless of the
+    order the frontend sent them in.
+
+    Parameters:
+    locations (list of tuples or np.ndarray): Station locations as (latitude, longitude) coordinates.
+    decimals (int): Decimal places coordinates are rounded to before hashing.
+    params: Algorithm parameters that change the result.
+
+    Returns:
+    str: Hex digest identifying the input.
+    """
+    #adding 0.0 folds -0.0 into 0.0 so both hash the same
+    coords = np.round(as_coordinates(locations), decimals) + 0.0
+    coords = np.ascontiguousarray(coords[np.lexsort((coords[:, 1], coords[:, 0]))])
+    digest = hashlib.sha256(coords.tobytes())
+    digest.update(orjson.dumps(params, option=orjson.OPT_SORT_KEYS | orjson.OPT_SERIALIZE_NUMPY))
+    return digest.hexdigest()
+
+
+def query_fingerprint(query, **params) -> str:
+    """
+    Fingerprint of a station query and the parameters a model run was made with, the station_fingerprint
+    of a run whose stations the server selects itself.
+
+    Parameters:
+    query (dict): Normalized query, e.g. {'bbox': [west, south, east, north], 'year': 2020}, plus the
+        signature of the data it is resolved against.
+    params: Algorithm parameters that change the result.
+
+    Returns:
+    str: Hex digest identifying the input.
+    """
+    return hashlib.sha256(orjson.dumps({'query': query, **params}, option=orjson.OPT_SORT_KEYS | orjson.OPT_SERIALIZE_NUMPY)).hexdigest()
+
+
+class LRUCache(BaseCache):
+    """
+    Thread-safe in-process cache with least-recently-used eviction and per-entry expiry.
+
+    Parameters:
+    threshold (int): Maximum number of entries kept before the least recently used is evicted.
+    default_timeout (int): Seconds an entry lives, 0 keeps it until evicted.
+    """
+
+    def __init__(self, threshold=512, default_timeout=300):
+        super().__init__(default_timeout)
+        self._threshold = threshold
+        self._cache = OrderedDict()
+        self._lock = Lock()
+
+    def _expiry(self, timeout):
+        timeout = self._normalize_timeout(timeout)
+        return time.time() + timeout if timeout > 0 else float('inf')
+
+    def get(self, key):
+        with self._lock:
+            entry = self._cache.get(key)
+            if entry is None:
+                return None
+            expires, value = entry
+            if expires <= time.time():
+                del self._cache[key]
+                return None
+            self._cache.move_to_end(key)
+            return value
+
+    def set(self, key, value, timeout=None):
+        with self._lock:
+            self._cache[key] = (self._expiry(timeout), value)
+            self._cache.move_to_end(key)
+            while len(self._cache) > self._threshold:
+                self._cache.popitem(last=False)
+        return True
+
+    def add(self, key, value, timeout=None):
+        if self.has(key):
+            return False
+        return self.set(key, value, timeout)
+
+    def delete(self, key):
+        with self._lock:
+            return self._cache.pop(key, None) is not None
+
+    def has(self, key):
+        return self.get(key) is not None
+
+    def clear(self):
+        with self._lock:
+            self._cache.clear()
+        return True
+
+    def __len__(self) -> int:
+        return len(self._cache)
+
+
+def make_cache(backend='memory', threshold=512, default_timeout=300, cache_dir=None, redis_url=None,
+               key_prefix='ev_predictions:') -> BaseCache:
+    """
+    Build the cache backend for model predictions.
+
+    Parameters:
+    backend (str): 'memory' (per-process LRU), 'filesystem' or 'redis' (both shared between
+        gunicorn workers) or 'none' to disable caching.
+    threshold (int): Maximum number of cached entries (memory and filesystem backends).
+    default_timeout (int): Seconds a cached prediction lives.
+    cache_dir (str): Directory of the filesystem backend.
+    redis_url (str): Connection url of the redis backend, e.g. redis://localhost:6379/0.
+    key_prefix (str): Prefix of every redis key.
+
+    Returns:
+    cachelib.BaseCache: The configured cache.
+    """
+    if backend == 'memory':
+        return LRUCache(threshold=threshold, default_timeout=default_timeout)
+    if backend == 'filesystem':
+        if not cache_dir:
+            raise ValueError("The filesystem prediction cache needs a cache_dir")
+        return FileSystemCache(cache_dir, threshold=threshold, default_timeout=default_timeout)
+    if backend == 'redis':
+        #redis is only needed by deployments that opt into it
+        import redis
+        from cachelib import RedisCache
+        client = redis.from_url(redis_url or 'redis://localhost:6379/0')
+        return RedisCache(host=client, default_timeout=default_timeout, key_prefix=key_prefix)
+    if backend == 'none':
+        return NullCache()
+    raise ValueError(f"Unknown prediction cache backend '{backend}'")
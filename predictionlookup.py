@@ -0,0 +1,88 @@
+import os
+
+import numpy as np
+import orjson
+import pandas as pd
+
+
+def BuildPredictionLookup(predictions_path, map_data_path):
+    # Build step run after MapData.parquet is written: records which MapData the predictions were merged into,
+    # so a server only answers from predictions made from the stations it serves
+    from stationpayload import source_signature
+    with open(predictions_path + '.source', 'wb') as f:
+        f.write(orjson.dumps({'predictions': source_signature(predictions_path), 'source': source_signature(map_data_path)}))
+    print(f"Prediction lookup of {predictions_path} has been recorded for {map_data_path}")
+
+
+class PredictionLookup:
+    """
+    Predictions of the batch pipeline held in memory, keyed by (City, State, Year).
+
+    datacuration.GeneratePredictions runs the batch algorithms for every city with more than ten
+    stations in every year. The server answers a city query whose group was precomputed from
+    here instead of running those algorithms again.
+
+    A prediction labelled Year Y was made from the stations opened before Y, so the stations a
+    query for year Y selects (opened up to Y) are the ones behind the Year Y + 1 predictions.
+
+    Parameters:
+    predictions (pd.DataFrame): Rows of predictions.parquet, Algorithm, Year, City, State and the
+        location in Latitude and Longitude or, as older files keep it, in New_Latitude and New_Longitude.
+    """
+
+    def __init__(self, predictions):
+        lat = predictions['Latitude'].to_numpy(dtype=float)
+        lon = predictions['Longitude'].to_numpy(dtype=float)
+        if 'New_Latitude' in predictions.columns:
+            lat = np.where(np.isnan(lat), predictions['New_Latitude'].to_numpy(dtype=float), lat)
+            lon = np.where(np.isnan(lon), predictions['New_Longitude'].to_numpy(dtype=float), lon)
+
+        self.groups = {}
+        for algorithm, year, city, state, y, x in zip(predictions['Algorithm'].astype(str), predictions['Year'].to_numpy(np.int64),
+                                                     predictions['City'].astype(str), predictions['State'].astype(str), lat, lon):
+            #NaN marks a group the algorithm found no feasible location for
+            location = None if np.isnan(y) or np.isnan(x) else [float(y), float(x)]
+            self.groups.setdefault((city, state, int(year)), {})[algorithm] = location
+        self.algorithms = sorted({algorithm for group in self.groups.values() for algorithm in group})
+
+    @classmethod
+    def from_parquet(cls, path):
+        return cls(pd.read_parquet(path))
+
+    @classmethod
+    def load(cls, path, signature):
+        """
+        Read a predictions file recorded by BuildPredictionLookup, None when it is missing, was never
+        recorded, changed since, or was merged into another MapData file than the one of signature.
+
+        Parameters:
+        path (str): Predictions parquet file.
+        signature (str): Signature of the MapData file the server serves, see stationpayload.source_signature.
+        """
+        from stationpayload import source_signature
+        try:
+            with open(path + '.source', 'rb') as f:
+                recorded = orjson.loads(f.read())
+        except FileNotFoundError:
+            return None
+        if not os.path.exists(path) or recorded != {'predictions': source_signature(path), 'source': signature}:
+            return None
+        return cls.from_parquet(path)
+
+    def __len__(self) -> int:
+        return len(self.groups)
+
+    def get(self, city, state, year) -> dict:
+        """
+        Precomputed locations of the stations a query selects.
+
+        Parameters:
+        city (str): City name.
+        state (str): Two letter state code.
+        year (int): Year of the query, stations opened up to it.
+
+        Returns:
+        dict: Algorithm name -> [lat, long] or None when it found no feasible location, empty when the
+            group was not precomputed.
+        """
+        return self.groups.get((city, state, year + 1), {})
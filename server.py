@@ -1,17 +1,191 @@
-from flask import Flask, Response, render_template, request, url_for
+from flask import Flask, Response, g, render_template, request, url_for
 from flask_caching import Cache
 from flask_compress import Compress
-import pandas as pd
+import numpy as np
 import orjson
 import json
-from algos.frank import choose_new_location as frank_choose_new_location
-from algos.noah_c import choose_new_location as noah_choose_new_location
-from algos.noah_s import choose_new_location_kmeans 
+import logging
+import os
+import time
+from algos import registry
+from algos.distance import sorted_coordinates
+from algos.noah_s import coverage_field, coverage_metrics
+from algos.spatial_index import StationIndex
+from predictionlookup import PredictionLookup
+from predictioncache import LRUCache, make_cache, query_fingerprint, station_fingerprint
+from modelrunner import ModelRunner
+from jobqueue import JobQueue, QueueFull
+from stationstore import ORIGINAL, StationStore, parse_bbox
+from stationpayload import VARIANTS, StationPayloads, decode_points, encode_binary, source_signature
+from clustertiles import MAX_TILE_ZOOM, ClusterTiles
+from instrumentation import Metrics, SamplingProfiler, StageTimer, log_line
 
 app = Flask(__name__)
 cache = Cache(app, config={'CACHE_TYPE': 'SimpleCache'})
 Compress(app)
 
+MAP_DATA_PATH = os.environ.get('MAP_DATA_PATH', 'data/MapData.parquet')
+#signature of the MapData file everything derived from it is checked and cached against
+MAP_DATA_SOURCE = source_signature(MAP_DATA_PATH) if os.path.exists(MAP_DATA_PATH) else None
+
+#station and prediction data as memory-mapped columns written by stationstore.BuildStationStore, built here when missing;
+#the pages are shared by every worker, and a gunicorn master started with --preload maps them once before forking
+STATION_STORE_DIR = os.environ.get('STATION_STORE_DIR', 'data/stationstore')
+station_store = None
+if MAP_DATA_SOURCE is not None:
+    station_store = StationStore.load_or_build(MAP_DATA_PATH, STATION_STORE_DIR, MAP_DATA_SOURCE)
+
+#prebuilt bodies of the unfiltered station_data request, see stationpayload.BuildStationPayloads
+STATION_PAYLOAD_DIR = os.environ.get('STATION_PAYLOAD_DIR', 'data/payloads')
+station_payloads = None
+if station_store is not None:
+    station_payloads = StationPayloads.load(STATION_PAYLOAD_DIR, MAP_DATA_SOURCE)
+
+#grid-cluster pyramid behind the clustered map view, cached on disk next to MapData
+CLUSTER_CACHE_PATH = os.environ.get('CLUSTER_CACHE_PATH', 'data/clusters.parquet')
+cluster_tiles = None
+if station_store is not None:
+    cluster_tiles = ClusterTiles.load_or_build(station_store, CLUSTER_CACHE_PATH, MAP_DATA_SOURCE)
+
+#batch pipeline predictions answering city queries without running the algorithms, see predictionlookup.PredictionLookup;
+#only used when datacuration recorded them for the MapData file served here, otherwise every query is computed live.
+#Bartley is not precomputed, a city query skips the live run entirely when it is left out, e.g. ENABLED_ALGORITHMS=Frank,Noah_C,Noah_S
+PREDICTIONS_PATH = os.environ.get('PREDICTIONS_PATH', 'data/Predictions.parquet')
+prediction_lookup = None
+if MAP_DATA_SOURCE is not None:
+    prediction_lookup = PredictionLookup.load(PREDICTIONS_PATH, MAP_DATA_SOURCE)
+    if prediction_lookup is None and os.path.exists(PREDICTIONS_PATH):
+        logging.getLogger(__name__).warning('%s was not recorded for %s by datacuration, city queries are computed live',
+                                            PREDICTIONS_PATH, MAP_DATA_PATH)
+
+#model results keyed on the station set, use the filesystem or redis backend to share hits between gunicorn workers
+prediction_cache = make_cache(
+    backend=os.environ.get('PREDICTION_CACHE_BACKEND', 'memory'),
+    threshold=int(os.environ.get('PREDICTION_CACHE_SIZE', 512)),
+    default_timeout=int(os.environ.get('PREDICTION_CACHE_TTL', 3600)),
+    cache_dir=os.environ.get('PREDICTION_CACHE_DIR', '/tmp/ev_prediction_cache'),
+    redis_url=os.environ.get('PREDICTION_CACHE_REDIS_URL'))
+
+#algorithms served by /run_model, e.g. ENABLED_ALGORITHMS=Frank,Noah_S to leave out the slower ones
+algorithms = registry.enabled(os.environ.get('ENABLED_ALGORITHMS'))
+#algorithms and their sklearn/scipy imports are loaded on first use, PRELOAD_ALGORITHMS=1 loads them at import
+#instead, which boot.sh sets together with gunicorn's --preload so the master pays the import cost once for all workers
+if os.environ.get('PRELOAD_ALGORITHMS', '0') == '1':
+    registry.preload(algorithms)
+
+#Bartley's optimizer with the stations standing in for EV user demand, its latency budget is BARTLEY_TIMEOUT seconds
+BARTLEY_PARAMS = {
+    'ev_range': float(os.environ.get('BARTLEY_EV_RANGE', 45)),
+    'min_demand_share': float(os.environ.get('BARTLEY_MIN_DEMAND_SHARE', 0.25)),
+    'grid_size': (int(os.environ.get('BARTLEY_GRID', 50)),) * 2,
+    'solver': os.environ.get('BARTLEY_SOLVER', 'auto'),
+}
+BARTLEY_TIMEOUT = float(os.environ.get('BARTLEY_TIMEOUT', 5))
+
+#algorithms of a request run concurrently, MODEL_TIMEOUTS overrides the timeout per algorithm e.g. '{"Noah S": 5}'
+model_runner = ModelRunner(
+    kind=os.environ.get('MODEL_EXECUTOR', 'thread'),
+    max_workers=int(os.environ['MODEL_WORKERS']) if 'MODEL_WORKERS' in os.environ else None,
+    timeout=float(os.environ.get('MODEL_TIMEOUT', 30)),
+    timeouts={'Bartley': BARTLEY_TIMEOUT, **json.loads(os.environ.get('MODEL_TIMEOUTS', '{}'))},
+    #pools left to late algorithms that may run at once, past that queued algorithms time out instead
+    max_retired=int(os.environ.get('MODEL_MAX_RETIRED_POOLS', 2)))
+
+#background /jobs runs, kept in the prediction cache backend so any worker can report on a job when it is shared
+JOB_STORE_BACKEND = os.environ.get('JOB_STORE_BACKEND', os.environ.get('PREDICTION_CACHE_BACKEND', 'memory'))
+jobs = JobQueue(
+    model_runner,
+    make_cache(
+        backend='memory' if JOB_STORE_BACKEND == 'none' else JOB_STORE_BACKEND,
+        threshold=int(os.environ.get('JOB_STORE_SIZE', 1024)),
+        default_timeout=int(os.environ.get('JOB_TTL', 3600)),
+        cache_dir=os.path.join(os.environ.get('PREDICTION_CACHE_DIR', '/tmp/ev_prediction_cache'), 'jobs'),
+        redis_url=os.environ.get('PREDICTION_CACHE_REDIS_URL'),
+        key_prefix='ev_jobs:'),
+    max_pending=int(os.environ.get('JOB_QUEUE_SIZE', 16)),
+    workers=int(os.environ.get('JOB_WORKERS', 2)),
+    ttl=int(os.environ.get('JOB_TTL', 3600)))
+#seconds between job state reads of an event stream, and how long one stream stays open
+JOB_POLL_INTERVAL = float(os.environ.get('JOB_POLL_INTERVAL', 0.1))
+JOB_STREAM_TIMEOUT = float(os.environ.get('JOB_STREAM_TIMEOUT', 300))
+#seconds a client rejected by a full job queue is told to wait
+JOB_RETRY_AFTER = int(os.environ.get('JOB_RETRY_AFTER', 2))
+
+#grid resolution of Frank's algorithm, requests may ask for finer grids up to the maximum of their field;
+#the exact field costs about a second per 500x500 grid on a request thread, the edt field milliseconds
+FRANK_RESOLUTION = int(os.environ.get('FRANK_RESOLUTION', 25))
+FRANK_MAX_RESOLUTION = int(os.environ.get('FRANK_MAX_RESOLUTION', 300))
+FRANK_MAX_EDT_RESOLUTION = int(os.environ.get('FRANK_MAX_EDT_RESOLUTION', 1000))
+#request overrides the batch pipeline ran with, the entry point defaults; a request asking for others is computed live
+BATCH_PARAMS = {'Frank': {'grid_size': (25, 25), 'field': 'exact'}}
+#most stations one /run_model call may place per algorithm
+MAX_PLACEMENTS = int(os.environ.get('MAX_PLACEMENTS', 25))
+
+#grid points per side of the /coverage distance field, and the "before" fields kept per worker
+COVERAGE_RESOLUTION = int(os.environ.get('COVERAGE_RESOLUTION', 20))
+COVERAGE_MAX_RESOLUTION = int(os.environ.get('COVERAGE_MAX_RESOLUTION', 500))
+coverage_fields = LRUCache(threshold=int(os.environ.get('COVERAGE_CACHE_SIZE', 64)), default_timeout=int(os.environ.get('PREDICTION_CACHE_TTL', 3600)))
+
+#per-worker request metrics served at /metrics in the Prometheus text format
+metrics = Metrics()
+request_latency = metrics.histogram('http_request_duration_seconds', 'Request latency by route.', ('route', 'method', 'status'))
+algorithm_latency = metrics.histogram('model_algorithm_duration_seconds', 'Run time of each location algorithm.', ('algorithm',))
+algorithm_timeouts = metrics.counter('model_algorithm_timeouts_total', 'Algorithm runs dropped at their timeout.', ('algorithm',))
+algorithm_failures = metrics.counter('model_algorithm_failures_total', 'Algorithm runs that raised.', ('algorithm',))
+prediction_cache_requests = metrics.counter('prediction_cache_requests_total', 'Prediction cache lookups by result.', ('result',))
+station_payload_requests = metrics.counter('station_payload_requests_total', 'Prebuilt station_data responses by result.', ('variant', 'encoding', 'result'))
+coverage_field_requests = metrics.counter('coverage_field_requests_total', 'Coverage "before" field lookups by result.', ('result',))
+job_submissions = metrics.counter('model_jobs_total', 'Submitted /jobs runs by result.', ('result',))
+prediction_lookups = metrics.counter('precomputed_prediction_requests_total', 'City queries looked up in the batch predictions by result.', ('result',))
+
+#one JSON line per request on stderr, REQUEST_LOG=0 turns it off
+REQUEST_LOG = os.environ.get('REQUEST_LOG', '1') != '0'
+request_log = logging.getLogger('ev_charging.requests')
+if REQUEST_LOG and not request_log.handlers:
+    request_log.addHandler(logging.StreamHandler())
+    request_log.setLevel(logging.INFO)
+    request_log.propagate = False
+
+#opt-in sampling profiles of slow requests, e.g. PROFILE_SLOW_MS=500 writes PROFILE_DIR/<time>-<route>-<ms>.folded
+profiler = None
+if 'PROFILE_SLOW_MS' in os.environ:
+    profiler = SamplingProfiler(float(os.environ['PROFILE_SLOW_MS']) / 1000, os.environ.get('PROFILE_DIR', 'profiles'),
+                                interval=float(os.environ.get('PROFILE_INTERVAL_MS', 5)) / 1000)
+
+@app.before_request
+def start_request_timer() -> None:
+    g.timer = StageTimer()
+    g.profile = profiler.start() if profiler is not None else None
+
+@app.after_request
+def record_request(response) -> Response:
+    timer = g.timer
+    elapsed = timer.elapsed()
+    route = request.url_rule.rule if request.url_rule is not None else 'unmatched'
+    response.headers['Server-Timing'] = timer.server_timing()
+    request_latency.observe(elapsed, route, request.method, response.status_code)
+
+    profile = None
+    if g.profile is not None:
+        profile = profiler.finish(g.profile, elapsed, route)
+        g.profile = None
+    if REQUEST_LOG:
+        log_line(request_log, route=route, method=request.method, status=response.status_code, duration_ms=round(elapsed * 1000, 3),
+                 stages={name: round(seconds * 1000, 3) for name, seconds in timer.stages.items()},
+                 cache=response.headers.get('X-Prediction-Cache'), profile=profile)
+    return response
+
+@app.teardown_request
+def stop_profile(error=None) -> None:
+    #requests that raised never reach record_request
+    if g.get('profile') is not None:
+        profiler.finish(g.profile, g.timer.elapsed(), 'error')
+        g.profile = None
+
+@app.route('/metrics', methods=['GET'])
+def get_metrics() -> Response:
+    return Response(metrics.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
 @app.route('/', methods=['GET', 'POST'])
 @cache.cached(timeout=300)
 def index() -> None:
@@ -24,42 +198,533 @@ def index() -> None:
     return render_template('main.html')
 
 
+def prebuilt_station_data(variant) -> Response:
+    '''
+    Serve a full station payload from the prebuilt bytes, 304 when the client already has it.
+    '''
+    global station_payloads
+    if station_payloads is None:
+        #no matching build output, serialize and compress once in this worker
+        station_payloads = StationPayloads.from_store(station_store)
+
+    encoding = station_payloads.negotiate(variant, request.headers.get('Accept-Encoding', ''))
+    etag = station_payloads.etag(variant, encoding)
+    headers = {'ETag': f'"{etag}"', 'Vary': 'Accept-Encoding', 'Cache-Control': 'no-cache'}
+    if request.if_none_match.contains(etag):
+        station_payload_requests.inc(variant, encoding, 'not_modified')
+        return Response(status=304, headers=headers)
+    station_payload_requests.inc(variant, encoding, 'sent')
+
+    if encoding != 'identity':
+        headers['Content-Encoding'] = encoding
+    body = station_payloads.bodies[(variant, encoding)]
+    return Response(body, content_type=VARIANTS[variant], headers=headers, direct_passthrough=True)
+
+
 @app.route('/station_data', methods=['GET'])
-@cache.cached(timeout=300)
 def get_data() -> Response:
-    df = pd.read_parquet('data/MapData.parquet')
-    json_data = orjson.dumps(df.to_dict(orient='records'))
+    '''
+    Parameters (query string, all optional):
+    --------
+    bbox: west,south,east,north bounds in degrees
+    year: stations opened up to this year and the predictions made for it
+    state, city: location filters
+    algorithm: comma separated Algorithm values, Original for the real stations
+    format: records (default), columnar or binary (see stationpayload.encode_binary)
+
+    Returns:
+    -------
+    The matching MapData rows
+    '''
+    if station_store is None:
+        return Response(orjson.dumps({'error': f'{MAP_DATA_PATH} has not been built'}), status=503, content_type='application/json')
+
+    args = request.args
+    variant = args.get('format', 'records')
+    if variant not in VARIANTS:
+        return Response(orjson.dumps({'error': f'unknown format {variant}'}), status=400, content_type='application/json')
+    if set(args) <= {'format'}:
+        return prebuilt_station_data(variant)
+
+    try:
+        bbox = parse_bbox(args['bbox'].split(',')) if 'bbox' in args else None
+        year = int(args['year']) if 'year' in args else None
+    except ValueError as e:
+        return Response(orjson.dumps({'error': str(e)}), status=400, content_type='application/json')
+    algorithms = args['algorithm'].split(',') if 'algorithm' in args else None
+
+    with g.timer.stage('select'):
+        rows = station_store.select(bbox=bbox, year=year, state=args.get('state'), city=args.get('city'), algorithms=algorithms)
+    with g.timer.stage('encode'):
+        if variant == 'binary':
+            return Response(encode_binary(station_store, rows), content_type=VARIANTS[variant])
+        if variant == 'columnar':
+            json_data = orjson.dumps(station_store.columnar(rows))
+        else:
+            json_data = orjson.dumps(station_store.records(rows))
     return Response(json_data, content_type='application/json')
 
 
+@app.route('/clusters/<int:z>/<int:x>/<int:y>', methods=['GET'])
+def get_clusters(z, x, y) -> Response:
+    '''
+    Parameters:
+    --------
+    z, x, y: web mercator tile
+    year (query string): stations opened up to this year and the predictions made for it
+    algorithm (query string): comma separated Algorithm values, Original for the real stations
+
+    Returns:
+    -------
+    Clusters in the tile as {z, x, y, clusters: [{lat, lon, count, algorithm}]}
+    '''
+    if cluster_tiles is None:
+        return Response(orjson.dumps({'error': f'{MAP_DATA_PATH} has not been built'}), status=503, content_type='application/json')
+    if z > MAX_TILE_ZOOM:
+        return Response(orjson.dumps({'error': f'z must be at most {MAX_TILE_ZOOM}'}), status=400, content_type='application/json')
+    try:
+        year = int(request.args['year']) if 'year' in request.args else None
+    except ValueError as e:
+        return Response(orjson.dumps({'error': str(e)}), status=400, content_type='application/json')
+    algorithms = request.args['algorithm'].split(',') if 'algorithm' in request.args else None
+
+    tile_json = cluster_tiles.tile_json(z, x, y, year=year, algorithms=algorithms)
+    return Response(tile_json, content_type='application/json', headers={'Cache-Control': 'public, max-age=300'})
+
+
+def _round_locations(locations):
+    if locations is None:
+        return None
+    if isinstance(locations[0], list):
+        return [_round_locations(location) for location in locations]
+    return [round(locations[0], 5), round(locations[1], 5)]
+
+
+def check_points(points) -> np.ndarray:
+    #rejected while parsing, the algorithms would fail on them with a 500 instead
+    if not len(points):
+        raise ValueError('the request has no stations')
+    if not np.isfinite(points).all():
+        raise ValueError('station coordinates must be finite numbers')
+    if (np.abs(points[:, 0]) > 90).any() or (np.abs(points[:, 1]) > 180).any():
+        raise ValueError('station latitudes must be within [-90, 90] and longitudes within [-180, 180]')
+    return points
+
+
+def parse_station_points(entries) -> np.ndarray:
+    '''
+    (n, 2) array of a filtered_station_data list of [lat, long, ...] entries, raises ValueError or
+    TypeError on invalid input, see check_points.
+    '''
+    try:
+        points = np.array([(entry[0], entry[1]) for entry in entries], dtype=float).reshape(-1, 2)
+    except (IndexError, KeyError):
+        raise ValueError('filtered_station_data entries must be [lat, long, ...] lists')
+    return check_points(points)
+
+
+def parse_station_query(body) -> dict:
+    '''
+    Station query of a request body, {bbox, year, city, state} with the keys it sets, or None when
+    the body lists filtered_station_data itself. Raises ValueError or TypeError on invalid input.
+    '''
+    if not isinstance(body, dict):
+        raise TypeError('the request body must be a JSON object')
+    if 'filtered_station_data' in body:
+        return None
+    if not any(body.get(key) is not None for key in ('bbox', 'year', 'city', 'state')):
+        raise ValueError('expected filtered_station_data or a bbox, year, city or state query')
+    if station_store is None:
+        raise ValueError(f'{MAP_DATA_PATH} has not been built, send filtered_station_data instead')
+    query = {}
+    if body.get('bbox') is not None:
+        bbox = body['bbox'].split(',') if isinstance(body['bbox'], str) else body['bbox']
+        #clamped to the globe, then rounded like the station coordinates so nearby views of the same stations share a cache key
+        query['bbox'] = [round(v, 5) for v in parse_bbox(bbox)]
+    if body.get('year') is not None:
+        query['year'] = int(body['year'])
+    for key in ('city', 'state'):
+        if body.get(key) is not None:
+            query[key] = str(body[key])
+    return query
+
+
+def query_points(query) -> np.ndarray:
+    #real stations opened up to the query year, the selection the map used to make in the browser
+    rows = station_store.select(bbox=query.get('bbox'), year=query.get('year'), state=query.get('state'),
+                                city=query.get('city'), algorithms=[ORIGINAL])
+    return station_store.coordinates(rows)
+
+
+def parse_model_request(body, points=None) -> tuple:
+    '''
+    Stations, station query, per-algorithm parameter overrides and k of a /run_model or /jobs body,
+    raises ValueError or TypeError on invalid input. When points are given the stations were sent as
+    a binary body and body only holds the options. Exactly one of points and query is returned, the
+    stations of a query are only selected when its result is not cached, see query_points.
+    '''
+    query = None
+    if points is not None:
+        #float64 bodies stay a view of the request body, float32 ones are widened
+        points = check_points(points.astype(float, copy=False))
+    else:
+        query = parse_station_query(body)
+        if query is None:
+            points = parse_station_points(body['filtered_station_data'])
+    field = body.get('field', 'exact')
+    if field not in ('exact', 'edt'):
+        raise ValueError("field must be 'exact' or 'edt'")
+    resolution = int(body.get('resolution', FRANK_RESOLUTION))
+    max_resolution = FRANK_MAX_RESOLUTION if field == 'exact' else FRANK_MAX_EDT_RESOLUTION
+    if not 1 <= resolution <= max_resolution:
+        raise ValueError(f"resolution must be between 1 and {max_resolution} with the '{field}' field")
+    k = int(body.get('k', 1))
+    if not 1 <= k <= MAX_PLACEMENTS:
+        raise ValueError(f'k must be between 1 and {MAX_PLACEMENTS}')
+
+    #per-request overrides of the registered parameters
+    params = {
+        'Frank': {'grid_size': (resolution, resolution), 'field': field},
+        'Bartley': {**BARTLEY_PARAMS, 'time_limit': BARTLEY_TIMEOUT},
+    }
+    return points, query, params, k
+
+
+def read_model_request() -> tuple:
+    '''
+    parse_model_request of the current request: a JSON body, a GET query string, or a binary body
+    (see stationpayload.decode_points) with the options in the query string.
+    '''
+    if request.is_json:
+        return parse_model_request(request.json)
+    if request.method == 'GET':
+        return parse_model_request(request.args)
+    return parse_model_request(request.args, decode_points(request.get_data(), request.mimetype))
+
+
+def prediction_key(points, query, params, k) -> str:
+    algorithm_params = {algorithm.name: {**algorithm.params, **params.get(algorithm.name, {})} for algorithm in algorithms}
+    if query is not None:
+        #a query is keyed on itself and the data it selects from, not on the stations it resolves to
+        return query_fingerprint({**query, 'source': MAP_DATA_SOURCE}, k=k, algorithms=algorithm_params)
+    return station_fingerprint(points, k=k, algorithms=algorithm_params)
+
+
+def model_tasks(points, params, k, skip=()) -> dict:
+    #sorted so the order-dependent algorithms answer the same for any order of the same stations, like the batch pipeline
+    points = sorted_coordinates(points)
+    #nearest-station index shared by the grid scorers for this request; Noah S gets no CentroidCache and fits
+    #KMeans cold, since a fit warm-started from another request's centroids depends on the requests before it
+    context = {'index': StationIndex(points)}
+    return {algorithm.label: (algorithm, (points,), {'context': context, 'k': k, **params.get(algorithm.name, {})})
+            for algorithm in algorithms if algorithm.label not in skip}
+
+
+def precomputed_predictions(query, params, k) -> dict:
+    '''
+    Batch pipeline locations of a city, state and year query by algorithm label, for the algorithms
+    whose live result is the batch one: those run with the parameters the pipeline used. Empty for
+    any other request, such as a bbox query, k > 1 or a group that was not precomputed. Bartley is
+    not a batch algorithm, so with it enabled a city query still runs it live and only skips the others.
+    '''
+    if prediction_lookup is None or query is None or k != 1 or set(query) != {'city', 'state', 'year'}:
+        return {}
+    group = prediction_lookup.get(query['city'], query['state'], query['year'])
+    prediction_lookups.inc('hit' if group else 'miss')
+    return {algorithm.label: _round_locations(group[algorithm.name]) for algorithm in algorithms
+            if algorithm.name in group and params.get(algorithm.name, {}) == BATCH_PARAMS.get(algorithm.name, {})}
+
+
+def merge_predictions(precomputed, live) -> dict:
+    #response body in registry order, source names the path every algorithm was answered from
+    predictions, source = {}, {}
+    for algorithm in algorithms:
+        for path, found in (('precomputed', precomputed), ('live', live)):
+            if algorithm.label in found:
+                predictions[algorithm.label] = found[algorithm.label]
+                source[algorithm.label] = path
+    return {**predictions, 'source': source}
+
+
+def encode_prediction(pred):
+    #[lat, long] for one placement, a list of them for k, null when nothing was feasible
+    return None if pred is None else _round_locations(pred.tolist())
+
+
 @app.route('/run_model', methods=['GET', 'POST'])
 def run_model() -> Response:
     '''
     Parameters:
     --------
     list_data: this is a list of lists where sublists have form [lat, long, open_date]
+    bbox, year, city, state: instead of list_data, a query for the stations opened up to year in the
+    bbox ([west, south, east, north]), city and state, selected on the server
+    resolution: optional grid size of Frank's algorithm per side, e.g. 500
+    field: optional 'exact' or 'edt' distance field of Frank's algorithm
+    k: optional number of stations every algorithm places greedily, 1 by default
+
+    Instead of JSON the stations can be posted as application/octet-stream (a 16 byte header
+    and float32 or float64 lat, long pairs) or application/x-npy (an (n, 2) float array), with
+    resolution, field and k in the query string
     
     Returns:
     -------
-    List of latitudes and longitudes based on model calls
+    List of latitudes and longitudes based on model calls (null when an algorithm finds no
+    feasible location, a list of up to k [lat, long] pairs when k > 1), a source object naming
+    for every algorithm whether it was 'precomputed' by the batch pipeline (city, state and year
+    queries with k = 1; Bartley, which the pipeline does not run, is always live) or computed
+    'live', a timed_out list naming the algorithms that missed their timeout and a failed list
+    naming the ones that raised, both absent from the response
     '''
     #this will be a method that calls the model on given data
     #post to local file that can be detected and run by javascript
-    data = request.json['filtered_station_data']
-    existing_locations = [(entry[0], entry[1]) for entry in data]
-
-    frank_pred = frank_choose_new_location(existing_locations)
-    noah_c_pred = noah_choose_new_location(existing_locations)
-    noah_s_pred = choose_new_location_kmeans(existing_locations)
-
-    predictions = {
-        'Frank' : [round(float(frank_pred[0]), 5), round(float(frank_pred[1]), 5)],
-        'Noah C' : [round(float(noah_c_pred[0]), 5), round(float(noah_c_pred[1]), 5)],
-        'Noah S' : [round(float(noah_s_pred[0]), 5), round(float(noah_s_pred[1]), 5)]
-        }
-    
-    pred_json = orjson.dumps(predictions)
-    return Response(pred_json, content_type='application/json')
+    timer = g.timer
+    with timer.stage('parse'):
+        try:
+            points, query, params, k = read_model_request()
+        except (TypeError, ValueError) as e:
+            return Response(orjson.dumps({'error': str(e)}), status=400, content_type='application/json')
+
+    with timer.stage('cache'):
+        key = prediction_key(points, query, params, k)
+        pred_json = prediction_cache.get(key)
+    if pred_json is not None:
+        prediction_cache_requests.inc('hit')
+        return Response(pred_json, content_type='application/json', headers={'X-Prediction-Cache': 'HIT'})
+    prediction_cache_requests.inc('miss')
+
+    with timer.stage('lookup'):
+        precomputed = precomputed_predictions(query, params, k)
+
+    results, timed_out, failed = {}, [], []
+    if len(precomputed) < len(algorithms):
+        if points is None:
+            with timer.stage('select'):
+                points = query_points(query)
+            if not len(points):
+                return Response(orjson.dumps({'error': 'the query selects no stations'}), status=400, content_type='application/json')
+        with timer.stage('index'):
+            tasks = model_tasks(points, params, k, skip=precomputed)
+
+        durations = {}
+        with timer.stage('models'):
+            results, timed_out, failed = model_runner.run(tasks, durations)
+        for name, seconds in durations.items():
+            timer.record(f'algo-{name}', seconds)
+            algorithm_latency.observe(seconds, name)
+        for name in timed_out:
+            algorithm_timeouts.inc(name)
+        for name in failed:
+            algorithm_failures.inc(name)
+
+    with timer.stage('encode'):
+        predictions = merge_predictions(precomputed, {name: encode_prediction(pred) for name, pred in results.items()})
+        #names of the algorithms left out of a partial response
+        predictions['timed_out'] = timed_out
+        predictions['failed'] = failed
+        
+        pred_json = orjson.dumps(predictions)
+        if not timed_out and not failed:
+            prediction_cache.set(key, pred_json)
+    return Response(pred_json, content_type='application/json', headers={'X-Prediction-Cache': 'MISS'})
+
+
+def _job_response(job_id, source, headers=None) -> Response:
+    urls = {'status_url': url_for('get_job', job_id=job_id), 'events_url': url_for('job_events', job_id=job_id)}
+    return Response(orjson.dumps({'job_id': job_id, **urls, 'source': source}), status=202, content_type='application/json',
+                    headers={'Location': urls['status_url'], **(headers or {})})
+
+
+@app.route('/jobs', methods=['POST'])
+def submit_job() -> Response:
+    '''
+    Start a /run_model computation in the background, same body as /run_model.
+
+    Returns:
+    -------
+    202 with the job_id, the urls to poll (status_url) or stream (events_url) it and the source
+    of every algorithm as in /run_model, 503 with a Retry-After header when the job queue is full;
+    precomputed results are in the job from the start
+    '''
+    timer = g.timer
+    with timer.stage('parse'):
+        try:
+            points, query, params, k = read_model_request()
+        except (TypeError, ValueError) as e:
+            return Response(orjson.dumps({'error': str(e)}), status=400, content_type='application/json')
+
+    with timer.stage('cache'):
+        key = prediction_key(points, query, params, k)
+        pred_json = prediction_cache.get(key)
+    if pred_json is not None:
+        prediction_cache_requests.inc('hit')
+        job_submissions.inc('cached')
+        predictions = orjson.loads(pred_json)
+        predictions.pop('timed_out', None)
+        predictions.pop('failed', None)
+        source = predictions.pop('source', {})
+        return _job_response(jobs.submit_done(predictions), source, {'X-Prediction-Cache': 'HIT'})
+    prediction_cache_requests.inc('miss')
+
+    def on_result(name, status, result, seconds):
+        if status == 'timeout':
+            algorithm_timeouts.inc(name)
+        if status == 'failed':
+            algorithm_failures.inc(name)
+        if status != 'done':
+            return None
+        algorithm_latency.observe(seconds, name)
+        return encode_prediction(result)
+
+    def on_complete(state):
+        #same body /run_model would have cached, algorithms in their registry order
+        if not state['timed_out'] and not state['failed']:
+            live = {label: location for label, location in state['results'].items() if label not in precomputed}
+            prediction_cache.set(key, orjson.dumps({**merge_predictions(precomputed, live), 'timed_out': [], 'failed': []}))
+
+    with timer.stage('lookup'):
+        precomputed = precomputed_predictions(query, params, k)
+    if len(precomputed) == len(algorithms):
+        job_submissions.inc('precomputed')
+        return _job_response(jobs.submit_done(precomputed), merge_predictions(precomputed, {})['source'], {'X-Prediction-Cache': 'MISS'})
+
+    if points is None:
+        with timer.stage('select'):
+            points = query_points(query)
+        if not len(points):
+            return Response(orjson.dumps({'error': 'the query selects no stations'}), status=400, content_type='application/json')
+    with timer.stage('index'):
+        tasks = model_tasks(points, params, k, skip=precomputed)
+
+    with timer.stage('enqueue'):
+        try:
+            job_id = jobs.submit(tasks, on_result=on_result, on_complete=on_complete, results=precomputed)
+        except QueueFull as e:
+            job_submissions.inc('rejected')
+            return Response(orjson.dumps({'error': str(e)}), status=503, content_type='application/json',
+                            headers={'Retry-After': str(JOB_RETRY_AFTER)})
+    job_submissions.inc('queued')
+    return _job_response(job_id, merge_predictions(precomputed, dict.fromkeys(tasks))['source'], {'X-Prediction-Cache': 'MISS'})
+
+
+@app.route('/jobs/<job_id>', methods=['GET'])
+def get_job(job_id) -> Response:
+    '''
+    Current state of a job: status (queued, running, done or failed), the results of the
+    algorithms finished so far, the pending, timed_out and failed algorithms and an error for a failed job
+    '''
+    state = jobs.store.get(f'job:{job_id}')
+    if state is None:
+        return Response(orjson.dumps({'error': f'unknown job {job_id}'}), status=404, content_type='application/json')
+    return Response(state, content_type='application/json', headers={'Cache-Control': 'no-store'})
+
+
+@app.route('/jobs/<job_id>/events', methods=['GET'])
+def job_events(job_id) -> Response:
+    '''
+    Server-Sent Events of a job: a result event per algorithm as soon as it finishes
+    ({algorithm, location}), a timeout event per algorithm dropped at its timeout, an
+    algorithm_failed event per algorithm that raised, then one done or failed event carrying the
+    final state
+    '''
+    if jobs.get(job_id) is None:
+        return Response(orjson.dumps({'error': f'unknown job {job_id}'}), status=404, content_type='application/json')
+
+    def events():
+        sent = set()
+        deadline = time.monotonic() + JOB_STREAM_TIMEOUT
+        while True:
+            state = jobs.get(job_id)
+            if state is None:
+                yield f"event: failed\ndata: {orjson.dumps({'error': 'job expired'}).decode()}\n\n"
+                return
+            for name, location in state['results'].items():
+                if name not in sent:
+                    sent.add(name)
+                    yield f"event: result\ndata: {orjson.dumps({'algorithm': name, 'location': location}).decode()}\n\n"
+            for name in state['timed_out']:
+                if name not in sent:
+                    sent.add(name)
+                    yield f"event: timeout\ndata: {orjson.dumps({'algorithm': name}).decode()}\n\n"
+            #states written before algorithms could fail on their own have no failed list
+            for name in state.get('failed', ()):
+                if name not in sent:
+                    sent.add(name)
+                    yield f"event: algorithm_failed\ndata: {orjson.dumps({'algorithm': name}).decode()}\n\n"
+            if state['status'] in ('done', 'failed'):
+                yield f"event: {state['status']}\ndata: {orjson.dumps(state).decode()}\n\n"
+                return
+            if time.monotonic() > deadline:
+                #EventSource reconnects on its own and the stream replays the job from the start
+                return
+            time.sleep(JOB_POLL_INTERVAL)
+
+    return Response(events(), content_type='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+
+@app.route('/coverage', methods=['POST'])
+def coverage() -> Response:
+    '''
+    Parameters:
+    --------
+    filtered_station_data: list of [lat, long, open_date] lists, the existing stations
+    bbox, year, city, state: instead of filtered_station_data, a station query as in /run_model
+    locations: object mapping a name, e.g. an algorithm, to a suggested [lat, long] or a list of them
+    resolution: optional grid points per side of the distance field
+
+    Returns:
+    -------
+    Coverage metrics per name (see algos.noah_s.coverage_metrics), null for a null location, and the
+    average and maximum distance to the nearest station before any of them is added
+    '''
+    timer = g.timer
+    with timer.stage('parse'):
+        try:
+            query = parse_station_query(request.json)
+            points = None
+            if query is None:
+                points = parse_station_points(request.json['filtered_station_data'])
+            resolution = int(request.json.get('resolution', COVERAGE_RESOLUTION))
+            if not 2 <= resolution <= COVERAGE_MAX_RESOLUTION:
+                raise ValueError(f'resolution must be between 2 and {COVERAGE_MAX_RESOLUTION}')
+            locations = {name: None if location is None else np.array(location, dtype=float).reshape(-1, 2)
+                         for name, location in request.json.get('locations', {}).items()}
+        except (KeyError, TypeError, ValueError, AttributeError) as e:
+            return Response(orjson.dumps({'error': str(e)}), status=400, content_type='application/json')
+
+    #the before field only depends on the stations and the grid, which also spans the suggestions so one
+    #outside the stations' box still lands on it (as in algos.noah_s.analyze_coverage); a later request
+    #for the same stations and suggestion extent reuses the field
+    with timer.stage('field'):
+        suggested = [location for location in locations.values() if location is not None and len(location)]
+        extent = None
+        if suggested:
+            suggested = np.vstack(suggested)
+            extent = np.round(np.concatenate((suggested.min(axis=0), suggested.max(axis=0))), 5).tolist()
+        if query is not None:
+            key = query_fingerprint({**query, 'source': MAP_DATA_SOURCE}, coverage_resolution=resolution, extent=extent)
+        else:
+            key = station_fingerprint(points, coverage_resolution=resolution, extent=extent)
+        before = coverage_fields.get(key)
+        if before is None:
+            if points is None:
+                points = query_points(query)
+                if not len(points):
+                    return Response(orjson.dumps({'error': 'the query selects no stations'}), status=400, content_type='application/json')
+            bounds = points if extent is None else np.vstack((points, np.reshape(extent, (2, 2))))
+            before = coverage_field(points, grid_size=resolution, bounds=bounds)
+            coverage_fields.set(key, before)
+            coverage_field_requests.inc('miss')
+        else:
+            coverage_field_requests.inc('hit')
+
+    with timer.stage('update'):
+        results = {name: None if location is None else coverage_metrics(before, location) for name, location in locations.items()}
+        results['before'] = {'avg_distance': before.distances.mean(), 'max_distance': before.distances.max()}
+    with timer.stage('encode'):
+        json_data = orjson.dumps(results, option=orjson.OPT_SERIALIZE_NUMPY)
+    return Response(json_data, content_type='application/json')
 
 
 if __name__ == "__main__":
@@ -18,6 +18,47 @@ function getMapBounds() {
     return [bounds.getNorth(), bounds.getSouth(), bounds.getWest(), bounds.getEast()]
 }
 
+// Clear existing markers
+function clearStationMarkers() {
+    map.eachLayer(layer => {
+        if (layer instanceof L.CircleMarker) {
+            map.removeLayer(layer);
+        }
+    });
+}
+
+function algorithmColor(algorithm) {
+    switch (algorithm) {
+        case 'Original':
+            return '#3388ff';
+        case 'Frank':
+            return 'red';
+        case 'Noah_C':
+            return 'green';
+        case 'Noah_S':
+            return 'black';
+        default:
+            return 'red';
+    }
+}
+
+// Draw server side clusters, one marker per grid cell and algorithm
+function displayClusters(tiles) {
+    clearStationMarkers();
+
+    tiles.forEach(tile => {
+        if (tile === undefined) return;
+        tile.clusters.forEach(cluster => {
+            const color = algorithmColor(cluster.algorithm);
+            const label = cluster.algorithm === 'Original' ? 'stations' : cluster.algorithm + ' predictions';
+            L.circleMarker([cluster.lat, cluster.lon], { radius: 3 + 2 * Math.log2(cluster.count), renderer: myRenderer })
+                .setStyle({ color: color, fillColor: color })
+                .addTo(map)
+                .bindPopup(cluster.count + ' ' + label);
+        });
+    });
+}
+
 function displayStations(leftLong, rightLong, bottomLat, topLat, station_data, selectedYear) {
     // Filter station data by map bounds and selected date
     const filtered_station_data = station_data.filter(obj => {
@@ -31,14 +72,7 @@ function displayStations(leftLong, rightLong, bottomLat, topLat, station_data, s
         );
     });
 
-    // Clear existing markers
-    map.eachLayer(layer => {
-       console.log(layer);
-    if (layer instanceof L.CircleMarker) {
-        console.log(layer.constructor.name);
-            map.removeLayer(layer);
-        }
-    });
+    clearStationMarkers();
 
     // Loop through filtered data and add markers
     for (let i = 0; i<filtered_station_data.length; i++) {
@@ -51,20 +85,7 @@ function displayStations(leftLong, rightLong, bottomLat, topLat, station_data, s
                     + '<br>' + station.City + ', ' + station.State + '<br>Open Date: ' + station['Open Date']);
         }
         else if (station['Year'] == selectedYear) {
-            let color;
-            switch (station['Algorithm']) {
-                case 'Frank':
-                    color = 'red';
-                    break;
-                case 'Noah_C':
-                    color = 'green';
-                    break;
-                case 'Noah_S':
-                    color = 'black';
-                    break;
-                default:
-                    color = 'red';
-            }
+            const color = algorithmColor(station['Algorithm']);
 
             L.circleMarker([station['Latitude'], station['Longitude']], { radius: 5, renderer: myRenderer })
                 .setStyle({ color: color, fillColor: color })
@@ -178,77 +199,149 @@ dateSlider.value = 2024;
 // Initialize date display
 updateDateDisplay();
 
-//get data
-getData('/station_data').then((data) => {
-    //dispose of existing prediction(s)
-    loaderContainer.style.display = 'none'
-    const station_data = data
-    console.log(data)
+let stationRequest = 0;
 
+function stationQuery(selectedYear) {
+    const [top, bottom, left, right] = getMapBounds();
+    return `/station_data?bbox=${left},${bottom},${right},${top}&year=${selectedYear}`;
+}
 
-    var [top, bottom, left, right] = getMapBounds();
+// Below this zoom the map shows server side clusters instead of one marker per station
+const CLUSTER_ZOOM = 12;
 
+async function refreshStations() {
     const selectedYear = getYear();
-    displayStations(left, right, bottom, top, station_data, selectedYear);
+    // Drop responses that arrive after a newer pan or year change
+    const request = ++stationRequest;
 
-    map.on("moveend", () => {
-        const [top, bottom, left, right] = getMapBounds();
-        const selectedYear = getYear();
-    
-        // Call displayStations with the updated date and map bounds
-        displayStations(left, right, bottom, top, station_data, selectedYear);
-    });
-    loadCities(station_data);
+    if (map.getZoom() < CLUSTER_ZOOM) {
+        // Fetch the visible z/x/y tiles so the marker count stays bounded at any zoom
+        const z = Math.floor(map.getZoom());
+        const bounds = map.getBounds();
+        const nw = map.project(bounds.getNorthWest(), z).divideBy(256).floor();
+        const se = map.project(bounds.getSouthEast(), z).divideBy(256).floor();
+        const tiles = [];
+        for (let x = nw.x; x <= se.x; x++) {
+            for (let y = nw.y; y <= se.y; y++) {
+                tiles.push(getData(`/clusters/${z}/${x}/${y}?year=${selectedYear}`));
+            }
+        }
+        const data = await Promise.all(tiles);
+        if (request !== stationRequest) return;
+
+        displayClusters(data);
+        return;
+    }
+
+    const data = await getData(stationQuery(selectedYear));
+    if (data === undefined || request !== stationRequest) return;
+
+    const [top, bottom, left, right] = getMapBounds();
+    displayStations(left, right, bottom, top, data, selectedYear);
+}
+
+async function refreshCities() {
+    // Cities with predictions for the selected year populate the dropdown
+    const predictions = await getData(`/station_data?year=${getYear()}&algorithm=Frank,Noah_C,Noah_S`);
+    if (predictions !== undefined) {
+        loadCities(predictions);
+    }
+}
+
+//get data
+refreshStations().then(() => {
+    //dispose of existing prediction(s)
+    loaderContainer.style.display = 'none'
+
+    map.on("moveend", refreshStations);
+    refreshCities();
     dateSlider.addEventListener("input", updateDateDisplay);
     dateSlider.addEventListener("input", () => {
-        const [top, bottom, left, right] = getMapBounds();
-        const selectedYear = getYear();
-        loadCities(station_data);
-        displayStations(left, right, bottom, top, station_data, selectedYear);       
+        refreshCities();
+        refreshStations();
     });
     
 
     document.getElementById('modelSend').addEventListener('click', () => {
         const [top, bottom, left, right] = getMapBounds();
         const selectedYear = getYear();
+
+        // The server selects the stations opened up to the selected year itself: those of the city picked in the
+        // dropdown, which it can answer from the batch predictions, or else the ones in view
+        const selectedCity = document.getElementById('locationDropdown').value;
+        const separator = selectedCity.lastIndexOf(', ');
+        const modelQuery = separator > 0
+            ? { city: selectedCity.slice(0, separator), state: selectedCity.slice(separator + 2), year: selectedYear }
+            : { bbox: [left, bottom, right, top], year: selectedYear };
     
-        // Filter by map bounds and date
-        let filtered_station_data = station_data.filter(obj => {
-            const openDate = parseDate(obj["Open Date"]);
-            return (
-                obj.Longitude >= left &&
-                obj.Longitude <= right &&
-                obj.Latitude >= bottom &&
-                obj.Latitude <= top &&
-                obj.Year <= selectedYear
+        const zoom = map.getZoom();
+        map.setZoom(zoom - 3);
+
+        const suggestions = {};
+        const markers = {};
+        const addPrediction = (algo, result) => {
+            // null when an algorithm found no feasible location
+            if (result === null || algo in markers) return;
+            suggestions[algo] = result;
+            // a list of [lat, long] pairs when k stations were requested
+            const locations = Array.isArray(result[0]) ? result : [result];
+            markers[algo] = locations.map((location, i) =>
+                L.circleMarker([+location[0], +location[1]], { radius: 10, renderer: myRenderer })
+                    .setStyle({ color: 'green', fillColor: 'green' })
+                    .addTo(map)
+                    .bindPopup("Prediction: " + algo + (locations.length > 1 ? " #" + (i + 1) : ""))
             );
+        };
+
+        // coverage gain of every suggestion, measured against one cached distance field
+        const showCoverage = () => fetch('/coverage', {
+            method: 'POST',
+            headers: { 'Content-Type': 'application/json' },
+            body: JSON.stringify({ ...modelQuery, locations: suggestions }),
+        })
+        .then(response => response.json())
+        .then(coverage => {
+            Object.entries(markers).forEach(([algo, algoMarkers]) => {
+                const metrics = coverage[algo];
+                if (!metrics) return;
+                algoMarkers.forEach(marker => marker.setPopupContent(
+                    marker.getPopup().getContent() +
+                    "<br>Avg distance to a station: " + metrics.avg_distance_before.toFixed(2) + " km -> " +
+                    metrics.avg_distance_after.toFixed(2) + " km (" + metrics.coverage_improvement_percent.toFixed(1) + "% better)"
+                ));
+            });
         });
-    
-        const keepKeys = ['Latitude', 'Longitude', 'Open Date'];
-        filtered_station_data = filtered_station_data.map(obj => {
-            const new_obj = {};
-            keepKeys.forEach(e => new_obj[e] = obj[e]);
-            return Object.values(new_obj);
-        });
-    
-        console.log(filtered_station_data);
-    
-        fetch('/run_model', {
+
+        // synchronous run, used when the job queue is full
+        const runModel = () => fetch('/run_model', {
             method: 'POST',
             headers: { 'Content-Type': 'application/json' },
-            body: JSON.stringify({ filtered_station_data }),
+            body: JSON.stringify(modelQuery),
         })
         .then(response => response.json())
         .then(data => {
-            const zoom = map.getZoom();
-            map.setZoom(zoom - 3);
-    
-            Object.entries(data).forEach(([algo, result]) => {
-                L.circleMarker([+result[0], +result[1]], { radius: 10, renderer: myRenderer })
-                    .setStyle({ color: 'green', fillColor: 'green' })
-                    .addTo(map)
-                    .bindPopup("Prediction: " + algo);
-            });
+            // timed_out and failed list the algorithms missing from a partial response, source how each was answered
+            Object.entries(data).forEach(([algo, result]) => { if (!['timed_out', 'failed', 'source'].includes(algo)) addPrediction(algo, result); });
+            return showCoverage();
+        });
+
+        // background job, every algorithm's suggestion is drawn as soon as it finishes
+        fetch('/jobs', {
+            method: 'POST',
+            headers: { 'Content-Type': 'application/json' },
+            body: JSON.stringify(modelQuery),
+        })
+        .then(response => {
+            if (response.status === 503 || !window.EventSource) return runModel();
+            return response.json().then(job => new Promise((resolve, reject) => {
+                const events = new EventSource(job.events_url);
+                events.addEventListener('result', e => {
+                    const result = JSON.parse(e.data);
+                    addPrediction(result.algorithm, result.location);
+                });
+                events.addEventListener('done', () => { events.close(); resolve(showCoverage()); });
+                events.addEventListener('failed', e => { events.close(); reject(JSON.parse(e.data).error); });
+            }));
         })
         .catch(error => console.error('Error:', error));
     });
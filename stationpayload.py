@@ -0,0 +1,237 @@
+import gzip
+import hashlib
+import io
+import os
+import struct
+
+import brotli
+import numpy as np
+import orjson
+import zstandard
+
+#full station_data bodies that are built once instead of per request
+VARIANTS = {
+    'records': 'application/json',
+    'columnar': 'application/json',
+    'binary': 'application/octet-stream',
+}
+
+#Content-Encoding -> (file suffix, compressor), in server preference order
+ENCODINGS = {
+    'br': ('.br', lambda data: brotli.compress(data, quality=11)),
+    'zstd': ('.zst', lambda data: zstandard.ZstdCompressor(level=19).compress(data)),
+    'gzip': ('.gz', lambda data: gzip.compress(data, compresslevel=9, mtime=0)),
+}
+
+#cheaper levels for a worker that has to build the payloads itself
+FAST_ENCODINGS = {
+    'br': lambda data: brotli.compress(data, quality=5),
+    'zstd': lambda data: zstandard.ZstdCompressor(level=3).compress(data),
+    'gzip': lambda data: gzip.compress(data, compresslevel=6, mtime=0),
+}
+
+MANIFEST = 'manifest.json'
+
+#binary layout: magic, version, byte length of the JSON algorithm labels, row count
+BINARY_MAGIC = b'EVST'
+BINARY_VERSION = 1
+_BINARY_HEADER = struct.Struct('<4sHHI')
+
+#binary station coordinates posted to /run_model: magic, version, bytes per value, flags, point count, padded to 16 bytes
+#so the values that follow stay aligned for a Float64Array on the client and a zero-copy view on the server
+POINTS_MAGIC = b'EVPT'
+POINTS_VERSION = 1
+_POINTS_HEADER = struct.Struct('<4sHBBI4x')
+_POINTS_DTYPES = {4: np.dtype('<f4'), 8: np.dtype('<f8')}
+#request Content-Types decode_points understands
+POINTS_CONTENT_TYPES = ('application/octet-stream', 'application/x-npy')
+
+
+def encode_binary(store, rows=None) -> bytes:
+    """
+    Compact little-endian encoding of the rows' position, year and algorithm, every row when rows is None.
+
+    Layout: 12 byte header (b'EVST', uint16 version, uint16 label length, uint32 row count),
+    the algorithm labels as a JSON list padded to 4 bytes, then float32 latitudes, float32
+    longitudes, int16 years and uint8 indexes into the label list.
+    """
+    rows = slice(None) if rows is None else rows
+    labels, codes = np.unique(store.algorithm[rows].astype(str), return_inverse=True)
+    label_bytes = orjson.dumps(labels.tolist())
+    label_bytes += b' ' * (-len(label_bytes) % 4)
+    return b''.join((
+        _BINARY_HEADER.pack(BINARY_MAGIC, BINARY_VERSION, len(label_bytes), len(codes)),
+        label_bytes,
+        store.lat[rows].astype('<f4').tobytes(),
+        store.lon[rows].astype('<f4').tobytes(),
+        store.year[rows].astype('<i2').tobytes(),
+        codes.astype(np.uint8).tobytes(),
+    ))
+
+
+def encode_points(points, dtype='<f8') -> bytes:
+    """
+    Binary /run_model body of (n, 2) coordinates, see decode_points.
+    """
+    points = np.ascontiguousarray(points, dtype=dtype).reshape(-1, 2)
+    return _POINTS_HEADER.pack(POINTS_MAGIC, POINTS_VERSION, points.itemsize, 0, len(points)) + points.tobytes()
+
+
+def decode_points(data, content_type='application/octet-stream') -> np.ndarray:
+    """
+    Station coordinates of a binary /run_model body as a read-only (n, 2) view of the body, no copy is made.
+
+    application/octet-stream: 16 byte header (b'EVPT', uint16 version, uint8 bytes per value 4 or 8,
+    uint8 flags, uint32 point count, 4 padding bytes) followed by little-endian float32 or float64
+    latitude, longitude pairs.
+    application/x-npy: a .npy file of a float32 or float64 array of shape (n, 2), C order.
+
+    Raises:
+    ValueError: The body does not match its format.
+    """
+    if content_type == 'application/x-npy':
+        stream = io.BytesIO(data)
+        version = np.lib.format.read_magic(stream)
+        read_header = np.lib.format.read_array_header_1_0 if version == (1, 0) else np.lib.format.read_array_header_2_0
+        shape, fortran_order, dtype = read_header(stream)
+        if fortran_order or dtype.kind != 'f' or dtype.itemsize not in _POINTS_DTYPES or len(shape) != 2 or shape[1] != 2:
+            raise ValueError('the .npy body must be a C order float32 or float64 array of shape (n, 2)')
+        count, offset = shape[0], stream.tell()
+    elif content_type == 'application/octet-stream':
+        if len(data) < _POINTS_HEADER.size:
+            raise ValueError('binary body is shorter than its header')
+        magic, version, itemsize, _, count = _POINTS_HEADER.unpack_from(data)
+        if magic != POINTS_MAGIC or version != POINTS_VERSION or itemsize not in _POINTS_DTYPES:
+            raise ValueError(f'binary body must start with {POINTS_MAGIC!r} version {POINTS_VERSION} and 4 or 8 byte values')
+        dtype, offset = _POINTS_DTYPES[itemsize], _POINTS_HEADER.size
+    else:
+        raise ValueError(f"unsupported Content-Type {content_type}, expected application/json or one of {', '.join(POINTS_CONTENT_TYPES)}")
+
+    if len(data) != offset + count * 2 * dtype.itemsize:
+        raise ValueError(f'binary body should hold {count} points')
+    return np.frombuffer(data, dtype=dtype, count=count * 2, offset=offset).reshape(count, 2)
+
+
+def build_payloads(store) -> dict:
+    """
+    Serialize every variant of the full station payload.
+
+    Parameters:
+    store (StationStore): The loaded station data.
+
+    Returns:
+    dict: variant -> uncompressed bytes.
+    """
+    return {
+        'records': orjson.dumps(store.records()),
+        'columnar': orjson.dumps(store.columnar()),
+        'binary': encode_binary(store),
+    }
+
+
+def source_signature(path) -> str:
+    stat = os.stat(path)
+    return f'{stat.st_size}-{stat.st_mtime_ns}'
+
+
+def write_payloads(out_dir, payloads, signature) -> dict:
+    """
+    Write every variant in every encoding plus a manifest with their ETags.
+
+    Parameters:
+    out_dir (str): Directory the files are written to.
+    payloads (dict): variant -> uncompressed bytes.
+    signature (str): Signature of the MapData file the payloads were built from.
+
+    Returns:
+    dict: The manifest.
+    """
+    os.makedirs(out_dir, exist_ok=True)
+    manifest = {'source': signature, 'variants': {}}
+    for variant, data in payloads.items():
+        files = {'identity': f'stations.{variant}'}
+        for encoding, (suffix, compress) in ENCODINGS.items():
+            files[encoding] = f'stations.{variant}{suffix}'
+            with open(os.path.join(out_dir, files[encoding]), 'wb') as f:
+                f.write(compress(data))
+        with open(os.path.join(out_dir, files['identity']), 'wb') as f:
+            f.write(data)
+        manifest['variants'][variant] = {'etag': hashlib.sha256(data).hexdigest()[:32], 'files': files}
+    #manifest last so a half written directory is never picked up
+    with open(os.path.join(out_dir, MANIFEST), 'wb') as f:
+        f.write(orjson.dumps(manifest, option=orjson.OPT_INDENT_2))
+    print(f"Station payloads have been written to {out_dir}")
+    return manifest
+
+
+def BuildStationPayloads(map_data_path, out_dir):
+    # Build step run after MapData.parquet is written
+    from stationstore import StationStore
+    write_payloads(out_dir, build_payloads(StationStore.from_parquet(map_data_path)), source_signature(map_data_path))
+
+
+class StationPayloads:
+    """
+    Pre-serialized, pre-compressed station_data bodies held in memory.
+
+    Parameters:
+    bodies (dict): (variant, encoding) -> bytes, encoding 'identity' for uncompressed.
+    etags (dict): variant -> ETag of the uncompressed body.
+    """
+
+    def __init__(self, bodies, etags):
+        self.bodies = bodies
+        self.etags = etags
+
+    @classmethod
+    def load(cls, out_dir, signature=None):
+        """
+        Read a directory written by write_payloads, None if it is missing or was built from other data.
+        """
+        try:
+            with open(os.path.join(out_dir, MANIFEST), 'rb') as f:
+                manifest = orjson.loads(f.read())
+        except FileNotFoundError:
+            return None
+        if signature is not None and manifest.get('source') != signature:
+            return None
+        bodies, etags = {}, {}
+        for variant, entry in manifest['variants'].items():
+            etags[variant] = entry['etag']
+            for encoding, name in entry['files'].items():
+                with open(os.path.join(out_dir, name), 'rb') as f:
+                    bodies[(variant, encoding)] = f.read()
+        return cls(bodies, etags)
+
+    @classmethod
+    def from_store(cls, store):
+        # Fallback when no prebuilt directory matches, compressed once per process
+        bodies, etags = {}, {}
+        for variant, data in build_payloads(store).items():
+            etags[variant] = hashlib.sha256(data).hexdigest()[:32]
+            bodies[(variant, 'identity')] = data
+            for encoding, compress in FAST_ENCODINGS.items():
+                bodies[(variant, encoding)] = compress(data)
+        return cls(bodies, etags)
+
+    def etag(self, variant, encoding) -> str:
+        return self.etags[variant] if encoding == 'identity' else f'{self.etags[variant]}-{encoding}'
+
+    def negotiate(self, variant, accept_encoding) -> str:
+        """
+        Pick the best prebuilt encoding the client accepts.
+        """
+        accepted = {}
+        for part in accept_encoding.split(','):
+            name, _, params = part.strip().partition(';')
+            q = 1.0
+            if params.strip().startswith('q='):
+                try:
+                    q = float(params.strip()[2:])
+                except ValueError:
+                    q = 0.0
+            accepted[name.strip().lower()] = q
+        for encoding in ENCODINGS:
+            if accepted.get(encoding, accepted.get('*', 0.0)) > 0 and (variant, encoding) in self.bodies:
+                return encoding
+        return 'identity'
@@ -0,0 +1,359 @@
+import os
+
+import numpy as np
+import orjson
+import pandas as pd
+
+#rows of MapData that are real stations, every other Algorithm value is a prediction
+ORIGINAL = 'Original'
+
+MANIFEST = 'manifest.json'
+#arrays of a GridYearIndex, saved beside the columns so a mapped store needs no rebuild
+_INDEX_ARRAYS = ('rows', 'year', 'cells', 'starts', 'ends')
+
+
+def parse_bbox(values) -> list:
+    """
+    [west, south, east, north] of a bounding box given as four numbers, clamped to the globe.
+
+    Raises:
+    ValueError: The values are not four finite numbers with west <= east and south <= north.
+    """
+    bbox = [float(v) for v in values]
+    if len(bbox) != 4:
+        raise ValueError('bbox needs west,south,east,north')
+    if not np.isfinite(bbox).all():
+        raise ValueError('bbox values must be finite numbers')
+    west, south, east, north = bbox
+    if west > east or south > north:
+        raise ValueError('bbox needs west <= east and south <= north')
+    return [min(max(west, -180.0), 180.0), min(max(south, -90.0), 90.0), min(max(east, -180.0), 180.0), min(max(north, -90.0), 90.0)]
+
+
+def _map(path):
+    # Read-only memory map of a .npy file, numpy cannot map an empty array so those are read
+    array = np.load(path, mmap_mode='r')
+    return np.asarray(array) if array.size == 0 else array
+
+
+class StringColumn:
+    """
+    Read-only string column stored as one UTF-8 blob and the offset of every value in it.
+
+    Backed by memory-mapped arrays, so the strings of a saved store live in the page cache and
+    are shared by every process mapping the same files; values are only decoded for the rows
+    asked for.
+
+    Parameters:
+    offsets (np.ndarray): (n + 1,) int64 byte offsets, value i is blob[offsets[i]:offsets[i + 1]].
+    blob (np.ndarray): uint8 UTF-8 bytes of all the values.
+    valid (np.ndarray): (n,) bool, False where the value is missing (None).
+    """
+
+    def __init__(self, offsets, blob, valid):
+        self.offsets = offsets
+        self.blob = blob
+        self.valid = valid
+        self._buffer = memoryview(blob).cast('B') if len(blob) else b''
+
+    @classmethod
+    def from_values(cls, values):
+        encoded = [b'' if value is None else str(value).encode('utf-8') for value in values]
+        offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+        np.cumsum([len(value) for value in encoded], out=offsets[1:])
+        valid = np.array([value is not None for value in values], dtype=bool)
+        return cls(offsets, np.frombuffer(b''.join(encoded), dtype=np.uint8), valid)
+
+    def __len__(self) -> int:
+        return len(self.valid)
+
+    def __getitem__(self, rows):
+        if np.isscalar(rows):
+            return self[np.array([rows])][0]
+        idx = np.arange(len(self))[rows]
+        values = np.empty(len(idx), dtype=object)
+        buffer = self._buffer
+        values[:] = [str(buffer[start:end], 'utf-8') if valid else None
+                     for start, end, valid in zip(self.offsets[idx].tolist(), self.offsets[idx + 1].tolist(), self.valid[idx].tolist())]
+        return values
+
+    def __array__(self, dtype=None, copy=None):
+        return self[:] if dtype is None else self[:].astype(dtype)
+
+    def __eq__(self, other):
+        return self[:] == other
+
+    def astype(self, dtype):
+        return self[:].astype(dtype)
+
+    def tolist(self) -> list:
+        return self[:].tolist()
+
+
+class GridYearIndex:
+    """
+    Spatial and year index over a set of rows.
+
+    Rows are bucketed into cell_deg x cell_deg degree cells and sorted by (cell, year) so a
+    bounding box query only visits the cells it overlaps, and within a cell the rows opened up
+    to or in a given year are one contiguous slice found by binary search.
+
+    Parameters:
+    lat, lon (np.ndarray): Coordinates of the rows.
+    year (np.ndarray): Year of the rows.
+    rows (np.ndarray): Row numbers in the owning store.
+    cell_deg (float): Cell size in degrees.
+    """
+
+    def __init__(self, lat, lon, year, rows, cell_deg=1.0):
+        self.cell_deg = cell_deg
+        self._n_cols = int(np.ceil(360 / cell_deg)) + 1
+        key = self._cell_key(lat, lon)
+        order = np.lexsort((year, key))
+        self.rows = rows[order]
+        self.year = year[order]
+        self.cells, self.starts = np.unique(key[order], return_index=True)
+        self.ends = np.append(self.starts[1:], len(order))
+
+    @classmethod
+    def from_arrays(cls, arrays, cell_deg=1.0):
+        index = cls.__new__(cls)
+        index.cell_deg = cell_deg
+        index._n_cols = int(np.ceil(360 / cell_deg)) + 1
+        for name in _INDEX_ARRAYS:
+            setattr(index, name, arrays[name])
+        return index
+
+    def _cell_key(self, lat, lon):
+        cell_lat = np.floor((np.asarray(lat) + 90) / self.cell_deg).astype(np.int64)
+        cell_lon = np.floor((np.asarray(lon) + 180) / self.cell_deg).astype(np.int64)
+        return cell_lat * self._n_cols + cell_lon
+
+    def _cells_in(self, bbox):
+        if bbox is None:
+            return np.arange(len(self.cells))
+        west, south, east, north = bbox
+        #clipped to the cells of the globe, a box past it never enumerates more cells than there are
+        lat_range = np.clip(np.floor((np.array([south, north]) + 90) / self.cell_deg), 0, np.ceil(180 / self.cell_deg))
+        lon_range = np.clip(np.floor((np.array([west, east]) + 180) / self.cell_deg), 0, self._n_cols - 1)
+        lat_cells = np.arange(lat_range[0], lat_range[1] + 1, dtype=np.int64)
+        lon_cells = np.arange(lon_range[0], lon_range[1] + 1, dtype=np.int64)
+        keys = (lat_cells[:, None] * self._n_cols + lon_cells[None, :]).ravel()
+        found = np.searchsorted(self.cells, keys)
+        present = found < len(self.cells)
+        found, keys = found[present], keys[present]
+        return found[self.cells[found] == keys]
+
+    def query(self, bbox=None, year=None, exact_year=False) -> np.ndarray:
+        """
+        Candidate rows in the cells overlapping bbox, optionally restricted by year.
+
+        Parameters:
+        bbox (tuple): (west, south, east, north) in degrees, None for everything.
+        year (int): Keep rows with Year <= year, or Year == year when exact_year is set.
+        exact_year (bool): Match the year exactly instead of up to it.
+
+        Returns:
+        np.ndarray: Store row numbers, rows at the cell edges still need an exact bbox check.
+        """
+        slices = []
+        for cell in self._cells_in(bbox):
+            start, end = self.starts[cell], self.ends[cell]
+            if year is not None:
+                years = self.year[start:end]
+                if exact_year:
+                    start, end = start + np.searchsorted(years, year, 'left'), start + np.searchsorted(years, year, 'right')
+                else:
+                    end = start + np.searchsorted(years, year, 'right')
+            if end > start:
+                slices.append(self.rows[start:end])
+        return np.concatenate(slices) if slices else np.empty(0, dtype=self.rows.dtype)
+
+
+class StationStore:
+    """
+    Station and prediction data held as columnar arrays with a spatial and year index.
+
+    Loaded once per process from MapData.parquet. Real stations and predictions are indexed
+    separately because the map shows stations opened up to the selected year but only the
+    predictions made for that year.
+
+    Parameters:
+    df (pd.DataFrame): MapData rows.
+    """
+
+    def __init__(self, df):
+        df = df.reset_index(drop=True)
+        columns = {}
+        for name in df.columns:
+            column = df[name]
+            if pd.api.types.is_numeric_dtype(column.dtype):
+                columns[name] = column.to_numpy()
+            else:
+                #missing strings become None so they serialize as null
+                columns[name] = column.astype(object).where(column.notna(), None).to_numpy(dtype=object)
+        self._attach(list(df.columns), columns)
+
+    def _attach(self, column_names, columns, indexes=None):
+        self.column_names = column_names
+        self.columns = columns
+        #asarray keeps memory-mapped columns mapped when they already have the right dtype
+        self.lat = np.asarray(self.columns['Latitude'], dtype=float)
+        self.lon = np.asarray(self.columns['Longitude'], dtype=float)
+        self.year = np.asarray(self.columns['Year'], dtype=np.int64)
+        self.algorithm = self.columns['Algorithm']
+
+        if indexes is None:
+            rows = np.arange(len(self.lat))
+            original = self.algorithm == ORIGINAL
+            indexes = (GridYearIndex(self.lat[original], self.lon[original], self.year[original], rows[original]),
+                       GridYearIndex(self.lat[~original], self.lon[~original], self.year[~original], rows[~original]))
+        self._original, self._predicted = indexes
+
+    @classmethod
+    def from_parquet(cls, path):
+        return cls(pd.read_parquet(path))
+
+    def save(self, directory, signature=None):
+        """
+        Write the store as one .npy file per array plus a manifest, the layout load maps.
+
+        Numeric columns are saved as they are, string columns as a StringColumn (offsets, UTF-8 blob
+        and a missing-value mask), and the arrays of both indexes beside them.
+
+        Parameters:
+        directory (str): Directory the files are written to.
+        signature (str): Signature of the MapData file the store was loaded from.
+        """
+        os.makedirs(directory, exist_ok=True)
+        manifest = {'source': signature, 'rows': len(self), 'cell_deg': self._original.cell_deg, 'columns': []}
+        for i, name in enumerate(self.column_names):
+            column = self.columns[name]
+            if isinstance(column, StringColumn) or column.dtype == object:
+                strings = column if isinstance(column, StringColumn) else StringColumn.from_values(column)
+                for part in ('offsets', 'blob', 'valid'):
+                    np.save(os.path.join(directory, f'c{i}.{part}.npy'), getattr(strings, part))
+                manifest['columns'].append({'name': name, 'kind': 'string', 'file': f'c{i}'})
+            else:
+                np.save(os.path.join(directory, f'c{i}.npy'), np.ascontiguousarray(column))
+                manifest['columns'].append({'name': name, 'kind': 'numeric', 'file': f'c{i}'})
+        for prefix, index in (('original', self._original), ('predicted', self._predicted)):
+            for part in _INDEX_ARRAYS:
+                np.save(os.path.join(directory, f'{prefix}.{part}.npy'), getattr(index, part))
+        #manifest last so a half written directory is never picked up
+        with open(os.path.join(directory, MANIFEST), 'wb') as f:
+            f.write(orjson.dumps(manifest, option=orjson.OPT_INDENT_2))
+
+    @classmethod
+    def load(cls, directory, signature=None):
+        """
+        Memory-map a directory written by save, None if it is missing or was built from other data.
+
+        Nothing is read up front: the pages of the columns and indexes are loaded on first access
+        and shared through the page cache by every process mapping them, such as forked gunicorn workers.
+        """
+        try:
+            with open(os.path.join(directory, MANIFEST), 'rb') as f:
+                manifest = orjson.loads(f.read())
+        except FileNotFoundError:
+            return None
+        if signature is not None and manifest.get('source') != signature:
+            return None
+
+        columns = {}
+        for column in manifest['columns']:
+            path = os.path.join(directory, column['file'])
+            if column['kind'] == 'string':
+                columns[column['name']] = StringColumn(*(_map(f'{path}.{part}.npy') for part in ('offsets', 'blob', 'valid')))
+            else:
+                columns[column['name']] = _map(f'{path}.npy')
+        indexes = tuple(GridYearIndex.from_arrays({part: _map(os.path.join(directory, f'{prefix}.{part}.npy')) for part in _INDEX_ARRAYS},
+                                                  manifest['cell_deg'])
+                        for prefix in ('original', 'predicted'))
+        store = cls.__new__(cls)
+        store._attach([column['name'] for column in manifest['columns']], columns, indexes)
+        return store
+
+    @classmethod
+    def load_or_build(cls, map_data_path, directory, signature):
+        """
+        Map the saved store of a MapData file, building and saving it first when it is missing or stale.
+
+        Parameters:
+        map_data_path (str): MapData parquet file.
+        directory (str): Directory of the saved store.
+        signature (str): Signature of map_data_path, see stationpayload.source_signature.
+        """
+        store = cls.load(directory, signature)
+        if store is not None:
+            return store
+        store = cls.from_parquet(map_data_path)
+        try:
+            store.save(directory, signature)
+        except OSError:
+            #a read-only deployment still serves the store it just parsed
+            return store
+        return cls.load(directory, signature)
+
+    def __len__(self) -> int:
+        return len(self.lat)
+
+    def select(self, bbox=None, year=None, state=None, city=None, algorithms=None) -> np.ndarray:
+        """
+        Row numbers matching the filters, in store order.
+
+        Parameters:
+        bbox (tuple): (west, south, east, north) in degrees.
+        year (int): Stations opened up to this year and predictions made for this year.
+        state (str): Two letter state code.
+        city (str): City name.
+        algorithms (list of str): Algorithm values to keep, 'Original' for real stations.
+
+        Returns:
+        np.ndarray: Sorted row numbers.
+        """
+        parts = []
+        if algorithms is None or ORIGINAL in algorithms:
+            parts.append(self._original.query(bbox, year))
+        if algorithms is None or any(a != ORIGINAL for a in algorithms):
+            parts.append(self._predicted.query(bbox, year, exact_year=True))
+        rows = np.sort(np.concatenate(parts))
+
+        keep = np.ones(len(rows), dtype=bool)
+        if bbox is not None:
+            west, south, east, north = bbox
+            lat, lon = self.lat[rows], self.lon[rows]
+            keep &= (lon >= west) & (lon <= east) & (lat >= south) & (lat <= north)
+        if state is not None:
+            keep &= self.columns['State'][rows] == state
+        if city is not None:
+            keep &= self.columns['City'][rows] == city
+        if algorithms is not None:
+            keep &= np.isin(self.algorithm[rows], list(algorithms))
+        return rows[keep]
+
+    def coordinates(self, rows=None) -> np.ndarray:
+        """
+        (n, 2) latitude, longitude array of the rows, the input the location algorithms take.
+        """
+        return np.column_stack((self.lat, self.lon)) if rows is None else np.column_stack((self.lat[rows], self.lon[rows]))
+
+    def records(self, rows=None) -> list:
+        """
+        Rows as a list of {column: value} dicts, the shape the map script consumes.
+        """
+        columns = [self.columns[name] if rows is None else self.columns[name][rows] for name in self.column_names]
+        return [dict(zip(self.column_names, values)) for values in zip(*(c.tolist() for c in columns))]
+
+    def columnar(self, rows=None) -> dict:
+        """
+        Rows as a {column: list of values} dict, much smaller on the wire than records.
+        """
+        return {name: (self.columns[name] if rows is None else self.columns[name][rows]).tolist() for name in self.column_names}
+
+
+def BuildStationStore(map_data_path, out_dir):
+    # Build step run after MapData.parquet is written, so servers map the columns instead of parsing the parquet file
+    from stationpayload import source_signature
+    StationStore.from_parquet(map_data_path).save(out_dir, source_signature(map_data_path))
+    print(f"Station store has been written to {out_dir}")
@@ -0,0 +1,48 @@
+import os
+import sys
+
+import numpy as np
+import pytest
+
+#the modules are flat at the repository root, as the server and the batch scripts import them
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+@pytest.fixture
+def stations():
+    # Scattered stations over a metro-sized area, with a dense core like a real city
+    rng = np.random.default_rng(7)
+    core = rng.normal((33.75, -84.39), 0.04, size=(25, 2))
+    spread = rng.uniform((33.4, -84.8), (34.1, -84.0), size=(20, 2))
+    return np.vstack((core, spread))
+
+
+@pytest.fixture
+def map_data(stations):
+    # MapData rows: the stations opened over 2015-2019 in two cities, and a prediction per city and year
+    import pandas as pd
+    rng = np.random.default_rng(11)
+    years = rng.integers(2015, 2020, size=len(stations))
+    cities = np.where(np.arange(len(stations)) < 25, 'Atlanta', 'Marietta')
+    rows = pd.DataFrame({'City': cities, 'State': 'GA', 'Latitude': stations[:, 0], 'Longitude': stations[:, 1],
+                         'Year': years, 'Algorithm': 'Original'})
+    predictions = pd.DataFrame([{'City': city, 'State': 'GA', 'Latitude': 33.7 + 0.01 * i, 'Longitude': -84.4 - 0.01 * j,
+                                 'Year': year, 'Algorithm': algorithm}
+                                for i, (city, year) in enumerate([(c, y) for c in ('Atlanta', 'Marietta') for y in range(2016, 2021)])
+                                for j, algorithm in enumerate(('Frank', 'Noah_C', 'Noah_S'))])
+    return pd.concat((rows, predictions), ignore_index=True)
+
+
+@pytest.fixture
+def served(monkeypatch, map_data):
+    # The server with a station store built from the synthetic MapData in place of data/MapData.parquet
+    server = pytest.importorskip('server')
+    from stationstore import StationStore
+    monkeypatch.setattr(server, 'station_store', StationStore(map_data))
+    monkeypatch.setattr(server, 'station_payloads', None)
+    return map_data
+
+
+@pytest.fixture
+def client():
+    return pytest.importorskip('server').app.test_client()
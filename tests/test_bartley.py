@@ -0,0 +1,66 @@
+import numpy as np
+import pytest
+from geopy.distance import geodesic
+
+from algos.bartley import candidate_grid, choose_new_location, optimize_new_ev_station_location
+
+
+@pytest.fixture
+def demand():
+    rng = np.random.default_rng(3)
+    return rng.uniform((33.4, -84.8), (34.1, -84.0), size=(40, 2)), rng.integers(1, 20, size=40).astype(float)
+
+
+def reference_location(stations, users, densities, ev_range, min_ev_users, candidates, exclude=()):
+    # Brute force of the selection model: farthest candidate from a station, in range of one and with enough users around it
+    best, best_dist = None, -1.0
+    for i, candidate in enumerate(candidates):
+        if i in exclude:
+            continue
+        dist = min(geodesic(candidate, s).km for s in stations)
+        covered = sum(d for u, d in zip(users, densities) if geodesic(candidate, u).km <= ev_range)
+        if dist <= ev_range and covered >= min_ev_users and dist > best_dist:
+            best, best_dist = i, dist
+    return best
+
+
+def test_auto_solver_matches_brute_force(stations, demand):
+    users, densities = demand
+    location = optimize_new_ev_station_location(stations, users, densities, [20.0], grid_size=(8, 8), min_ev_users=60)
+    candidates = candidate_grid(stations, (8, 8))
+    best = reference_location(stations, users, densities, 20.0, 60, candidates)
+    assert (location['Latitude'], location['Longitude']) == tuple(candidates[best])
+
+
+def test_milp_solver_agrees_with_auto(stations, demand):
+    pytest.importorskip('pulp')
+    users, densities = demand
+    kwargs = dict(grid_size=(8, 8), min_ev_users=60)
+    auto = optimize_new_ev_station_location(stations, users, densities, [20.0], solver='auto', **kwargs)
+    milp = optimize_new_ev_station_location(stations, users, densities, [20.0], solver='milp', **kwargs)
+    #equally far candidates may be tied, the objective is what has to agree
+    nearest = lambda loc: min(geodesic((loc['Latitude'], loc['Longitude']), s).km for s in stations)
+    assert nearest(milp) == pytest.approx(nearest(auto), abs=1e-6)
+
+
+def test_top_k_matches_placing_one_at_a_time(stations, demand):
+    users, densities = demand
+    placed = optimize_new_ev_station_location(stations, users, densities, [20.0], grid_size=(8, 8), min_ev_users=60, k=2)
+    candidates = candidate_grid(stations, (8, 8))
+    first = reference_location(stations, users, densities, 20.0, 60, candidates)
+    second = reference_location(np.vstack((stations, candidates[first])), users, densities, 20.0, 60, candidates, exclude={first})
+    assert [(p['Latitude'], p['Longitude']) for p in placed] == [tuple(candidates[first]), tuple(candidates[second])]
+
+
+def test_candidate_filter_mask_is_left_unchanged(stations, demand):
+    users, densities = demand
+    mask = np.ones(64, dtype=bool)
+    mask[:8] = False
+    optimize_new_ev_station_location(stations, users, densities, [20.0], grid_size=(8, 8), min_ev_users=60, k=3,
+                                     candidate_filter=lambda candidates: mask)
+    assert mask.sum() == 56 and not mask[:8].any()
+
+
+def test_infeasible_demand_returns_none(stations):
+    assert choose_new_location(stations, min_demand_share=2.0, grid_size=(10, 10)) is None
+    assert choose_new_location(stations, min_demand_share=2.0, grid_size=(10, 10), k=2) == []
@@ -0,0 +1,49 @@
+import numpy as np
+import pytest
+
+from clustertiles import CELLS_PER_TILE, MAX_ZOOM, MIN_ZOOM, ClusterTiles, build_pyramid, mercator_cells
+from stationstore import ORIGINAL, StationStore
+
+
+@pytest.fixture
+def tiles(map_data):
+    return ClusterTiles(build_pyramid(StationStore(map_data)))
+
+
+def tile_of(lat, lon, z):
+    cx, cy = mercator_cells([lat], [lon], z)
+    return int(cx[0]) // CELLS_PER_TILE, int(cy[0]) // CELLS_PER_TILE
+
+
+def test_a_low_zoom_tile_counts_every_station(tiles, map_data):
+    x, y = tile_of(33.75, -84.39, MIN_ZOOM)
+    clusters = tiles.tile(MIN_ZOOM, x, y, algorithms=[ORIGINAL])
+    assert sum(c['count'] for c in clusters) == (map_data['Algorithm'] == ORIGINAL).sum()
+    #tiles below the pyramid are scaled to its coarsest level
+    coarser = tiles.tile(MIN_ZOOM - 2, x >> 2, y >> 2, algorithms=[ORIGINAL])
+    assert sum(c['count'] for c in coarser) == (map_data['Algorithm'] == ORIGINAL).sum()
+
+
+@pytest.mark.parametrize('depth', [1, 2, 4])
+def test_tiles_past_max_zoom_split_the_parent_clusters(tiles, map_data, depth):
+    lat, lon = map_data.loc[0, ['Latitude', 'Longitude']]
+    x, y = tile_of(lat, lon, MAX_ZOOM)
+    parent = tiles.tile(MAX_ZOOM, x, y)
+    assert parent
+
+    z, children = MAX_ZOOM + depth, []
+    for cx in range(x << depth, (x + 1) << depth):
+        for cy in range(y << depth, (y + 1) << depth):
+            clusters = tiles.tile(z, cx, cy)
+            assert all(tile_of(c['lat'], c['lon'], z) == (cx, cy) for c in clusters)
+            children += clusters
+    #every parent cluster is in exactly one child tile
+    key = lambda c: (c['algorithm'], c['lat'], c['lon'], c['count'])
+    assert sorted(children, key=key) == sorted(parent, key=key)
+
+
+def test_tiles_past_the_deepest_zoom_are_rejected(client, monkeypatch, tiles):
+    server = pytest.importorskip('server')
+    monkeypatch.setattr(server, 'cluster_tiles', tiles)
+    assert client.get(f'/clusters/{server.MAX_TILE_ZOOM + 1}/0/0').status_code == 400
+    assert client.get(f'/clusters/{server.MAX_TILE_ZOOM}/0/0').status_code == 200
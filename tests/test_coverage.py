@@ -0,0 +1,30 @@
+import numpy as np
+import pytest
+
+from algos.noah_s import analyze_coverage, coverage_field, coverage_metrics
+
+
+def test_incremental_metrics_match_analyze_coverage(stations):
+    location = (33.9, -84.5)
+    before = coverage_field(stations, bounds=np.vstack((stations, location)))
+    distances = before.distances.copy()
+
+    metrics = coverage_metrics(before, [location])
+    assert metrics == pytest.approx(analyze_coverage(stations, location))
+    #the cached "before" field is shared between requests and must not change
+    np.testing.assert_array_equal(before.distances, distances)
+
+
+def test_coverage_endpoint_counts_suggestions_outside_the_stations(stations):
+    server = pytest.importorskip('server')
+    client = server.app.test_client()
+    outside = [33.2, -84.9]
+    body = {'filtered_station_data': stations.tolist(), 'locations': {'Bartley': outside, 'none': None}}
+
+    response = client.post('/coverage', json=body)
+    assert response.status_code == 200
+    result = response.get_json()
+    assert result['none'] is None
+    assert result['Bartley']['coverage_improvement_percent'] == pytest.approx(
+        analyze_coverage(stations, tuple(outside))['coverage_improvement_percent'])
+    assert result['Bartley']['coverage_improvement_percent'] > 0
@@ -0,0 +1,36 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from datacuration import GeneratePredictions
+
+
+def open_stations(seed=0):
+    # OpenStations rows of two cities, opened over 2008-2020
+    rng = np.random.default_rng(seed)
+    frames = []
+    for city, centre in (('Atlanta', (33.75, -84.39)), ('Macon', (32.84, -83.63))):
+        points = rng.normal(centre, 0.05, size=(30, 2))
+        frames.append(pd.DataFrame({'City': city, 'State': 'GA', 'Latitude': points[:, 0], 'Longitude': points[:, 1],
+                                    'Year': rng.integers(2008, 2021, size=30), 'Algorithm': 'Original'}))
+    return pd.concat(frames, ignore_index=True)
+
+
+def test_an_incremental_run_matches_a_full_run(tmp_path, capsys):
+    before, after = open_stations(), open_stations()
+    #one more Macon station in 2016 changes the Macon groups from 2017 on, nothing else
+    after.loc[len(after)] = {'City': 'Macon', 'State': 'GA', 'Latitude': 32.9, 'Longitude': -83.7, 'Year': 2016, 'Algorithm': 'Original'}
+    before.to_parquet(tmp_path / 'before.parquet')
+    after.to_parquet(tmp_path / 'after.parquet')
+
+    incremental, full = str(tmp_path / 'incremental.parquet'), str(tmp_path / 'full.parquet')
+    GeneratePredictions(str(tmp_path / 'before.parquet'), incremental, workers=1)
+    capsys.readouterr()
+    GeneratePredictions(str(tmp_path / 'after.parquet'), incremental, workers=1, incremental=True)
+    out = capsys.readouterr().out
+    GeneratePredictions(str(tmp_path / 'after.parquet'), full, workers=1)
+
+    #the unchanged groups were reused, the Macon ones from 2017 on recomputed
+    recomputed = int(out.split('Generating predictions for ')[1].split()[0])
+    assert recomputed == 2023 - 2017 + 1
+    pd.testing.assert_frame_equal(pd.read_parquet(incremental), pd.read_parquet(full))
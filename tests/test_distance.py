@@ -0,0 +1,52 @@
+import numpy as np
+import pytest
+from geopy.distance import geodesic, great_circle
+
+from algos.distance import EARTH_RADIUS_KM, haversine, nearest_distance, vincenty
+
+
+@pytest.fixture
+def pairs():
+    rng = np.random.default_rng(0)
+    #continental US, plus a few long haul pairs
+    a = rng.uniform((24.0, -125.0), (49.0, -67.0), size=(200, 2))
+    b = np.vstack((a[:150] + rng.normal(0, 0.2, size=(150, 2)), rng.uniform((24.0, -125.0), (49.0, -67.0), size=(50, 2))))
+    return a, b
+
+
+def test_haversine_matches_geopy_great_circle(pairs):
+    a, b = pairs
+    #geopy rounds the mean radius to 6371.009 km, compare on the same sphere
+    expected = [great_circle(p, q, radius=EARTH_RADIUS_KM).km for p, q in zip(a, b)]
+    np.testing.assert_allclose(haversine(a[:, 0], a[:, 1], b[:, 0], b[:, 1]), expected, rtol=1e-9)
+
+
+def test_vincenty_matches_geopy_geodesic(pairs):
+    a, b = pairs
+    expected = [geodesic(p, q).km for p, q in zip(a, b)]
+    #well under a millimetre
+    np.testing.assert_allclose(vincenty(a[:, 0], a[:, 1], b[:, 0], b[:, 1]), expected, rtol=0, atol=1e-6)
+
+
+def test_vincenty_of_identical_points_is_zero():
+    assert vincenty(33.75, -84.39, 33.75, -84.39) == 0
+
+
+def sphere(p, q):
+    return great_circle(p, q, radius=EARTH_RADIUS_KM)
+
+
+@pytest.mark.parametrize('method, reference, atol', [('geodesic', geodesic, 1e-6), ('haversine', sphere, 1e-9)])
+def test_nearest_distance_matches_geopy(stations, method, reference, atol):
+    rng = np.random.default_rng(1)
+    points = rng.uniform((33.3, -84.9), (34.2, -83.9), size=(60, 2))
+    expected = np.array([[reference(p, s).km for s in stations] for p in points])
+
+    dist, idx = nearest_distance(points, stations, method=method)
+    np.testing.assert_allclose(dist, expected.min(axis=1), rtol=0, atol=atol)
+    np.testing.assert_array_equal(idx, expected.argmin(axis=1))
+
+
+def test_unknown_method_is_rejected(stations):
+    with pytest.raises(ValueError):
+        nearest_distance(stations, stations, method='manhattan')
@@ -0,0 +1,53 @@
+import numpy as np
+import pytest
+from geopy.distance import geodesic
+
+from algos.frank import choose_new_location
+
+
+def reference_location(locations, grid_size):
+    # The original loop: occupancy grid, then the empty cell farthest from its nearest station by geopy
+    min_lat, min_lon = locations.min(axis=0)
+    max_lat, max_lon = locations.max(axis=0)
+    lat_step = (max_lat - min_lat) / grid_size[0]
+    lon_step = (max_lon - min_lon) / grid_size[1]
+    grid = np.zeros(grid_size)
+    for lat, lon in locations:
+        grid[int((lat - min_lat) * (grid_size[0] / (max_lat - min_lat))) - 1, int((lon - min_lon) * (grid_size[1] / (max_lon - min_lon))) - 1] = 1
+
+    best, best_dist = (0, 0), 0.0
+    for i in range(grid_size[0]):
+        for j in range(grid_size[1]):
+            if grid[i, j]:
+                continue
+            cell = (i * lat_step + min_lat, j * lon_step + min_lon)
+            dist = min(geodesic(cell, station).km for station in locations)
+            if dist > best_dist:
+                best, best_dist = (i, j), dist
+    return ((best[0] + 1) * lat_step + min_lat, (best[1] + 1) * lon_step + min_lon)
+
+
+@pytest.mark.parametrize('grid_size', [(10, 10), (25, 25), (12, 30)])
+def test_exact_field_matches_the_reference_loop(stations, grid_size):
+    np.testing.assert_allclose(choose_new_location(stations, grid_size=grid_size), reference_location(stations, grid_size))
+
+
+def test_edt_field_lands_near_the_exact_answer(stations):
+    exact = np.array(choose_new_location(stations, grid_size=(200, 200)))
+    approximate = np.array(choose_new_location(stations, grid_size=(200, 200), field='edt'))
+    #both pick a point of the largest gap between the stations
+    assert np.abs(exact - approximate).max() < 0.1
+
+
+def test_top_k_starts_with_the_single_placement(stations):
+    single = choose_new_location(stations, grid_size=(25, 25))
+    placed = choose_new_location(stations, grid_size=(25, 25), k=3)
+    assert len(placed) == 3
+    np.testing.assert_allclose(placed[0], single)
+    #each placement covers its gap, so the next one goes elsewhere
+    assert len({tuple(np.round(p, 9)) for p in placed}) == 3
+
+
+def test_unknown_field_is_rejected(stations):
+    with pytest.raises(ValueError):
+        choose_new_location(stations, field='fast')
@@ -0,0 +1,113 @@
+import threading
+import time
+
+import numpy as np
+import orjson
+import pytest
+
+from jobqueue import JobQueue, QueueFull
+from modelrunner import ModelRunner
+from predictioncache import LRUCache
+
+
+def wait_for(event):
+    event.wait(5)
+    return 'late'
+
+
+def fail_after(seconds):
+    time.sleep(seconds)
+    raise RuntimeError('no feasible grid')
+
+
+@pytest.fixture
+def release():
+    event = threading.Event()
+    yield event
+    event.set()
+
+
+def finished(queue, job_id, timeout=5):
+    deadline = time.monotonic() + timeout
+    while queue.get(job_id)['status'] not in ('done', 'failed'):
+        assert time.monotonic() < deadline
+        time.sleep(0.01)
+    return queue.get(job_id)
+
+
+def test_concurrent_first_submissions_share_one_pool():
+    queue = JobQueue(ModelRunner(), LRUCache(), workers=2)
+    barrier = threading.Barrier(8)
+    pools = []
+
+    def first_use():
+        barrier.wait()
+        pools.append(queue.executor)
+
+    threads = [threading.Thread(target=first_use) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len({id(pool) for pool in pools}) == 1
+
+
+def test_a_full_queue_rejects_jobs_until_one_finishes(release):
+    queue = JobQueue(ModelRunner(timeout=5), LRUCache(), max_pending=1, workers=1)
+    job_id = queue.submit({'slow': (wait_for, (release,), {})})
+    with pytest.raises(QueueFull):
+        queue.submit({'fast': (min, ([3, 1],), {})})
+    assert queue.pending == 1
+
+    release.set()
+    assert finished(queue, job_id)['results'] == {'slow': 'late'}
+    assert queue.pending == 0
+    assert finished(queue, queue.submit({'fast': (min, ([3, 1],), {})}))['results'] == {'fast': 1}
+
+
+def test_job_state_reports_every_algorithm(release):
+    queue = JobQueue(ModelRunner(timeout=0.3), LRUCache())
+    job_id = queue.submit({'fast': (min, ([3, 1],), {}), 'slow': (wait_for, (release,), {}), 'broken': (fail_after, (0,), {})},
+                          results={'precomputed': [33.7, -84.4]})
+    state = queue.get(job_id)
+    assert state['status'] in ('queued', 'running') and state['results']['precomputed'] == [33.7, -84.4]
+
+    state = finished(queue, job_id)
+    assert state['status'] == 'done' and state['error'] is None
+    assert state['results'] == {'precomputed': [33.7, -84.4], 'fast': 1}
+    assert state['timed_out'] == ['slow'] and state['failed'] == ['broken'] and state['pending'] == []
+    assert queue.get('unknown') is None
+
+
+def test_a_job_whose_callback_raises_is_failed():
+    queue = JobQueue(ModelRunner(), LRUCache())
+
+    def on_result(name, status, result, seconds):
+        raise ValueError('cannot encode')
+
+    state = finished(queue, queue.submit({'fast': (min, ([3, 1],), {})}, on_result=on_result))
+    assert state['status'] == 'failed' and state['error'] == 'ValueError: cannot encode'
+    assert queue.pending == 0
+
+
+def test_job_events_arrive_in_order(client, monkeypatch, stations, release):
+    server = pytest.importorskip('server')
+    #locations come back as arrays, like the algorithms return them
+    tasks = {'fast': (np.array, ([33.7, -84.4],), {}), 'broken': (fail_after, (0.1,), {}), 'slow': (wait_for, (release,), {})}
+    monkeypatch.setattr(server, 'model_tasks', lambda points, params, k, skip=(): tasks)
+    monkeypatch.setattr(server, 'jobs', JobQueue(ModelRunner(timeout=0.3), LRUCache()))
+    monkeypatch.setattr(server, 'prediction_cache', LRUCache())
+
+    response = client.post('/jobs', json={'filtered_station_data': stations.tolist()})
+    assert response.status_code == 202
+    job = response.get_json()
+    assert client.get(job['status_url']).get_json()['id'] == job['job_id']
+
+    body = client.get(job['events_url']).get_data(as_text=True)
+    events = [(block.split('\n')[0][len('event: '):], orjson.loads(block.split('\n')[1][len('data: '):]))
+              for block in body.strip().split('\n\n')]
+    assert [(name, data.get('algorithm')) for name, data in events] == [
+        ('result', 'fast'), ('algorithm_failed', 'broken'), ('timeout', 'slow'), ('done', None)]
+    assert events[0][1]['location'] == [33.7, -84.4]
+    assert events[-1][1]['status'] == 'done'
+    assert client.get('/jobs/unknown/events').status_code == 404
@@ -0,0 +1,87 @@
+import os
+import threading
+import time
+
+import pytest
+
+from modelrunner import ModelRunner
+
+
+def wait_for(event):
+    event.wait(5)
+    return 'late'
+
+
+def fail():
+    raise RuntimeError('no feasible grid')
+
+
+@pytest.fixture
+def release():
+    #lets the late algorithms of a test return when it ends
+    event = threading.Event()
+    yield event
+    event.set()
+
+
+def test_partial_results_leave_out_timed_out_and_failed_algorithms(release):
+    runner = ModelRunner(timeout=0.2)
+    tasks = {'fast': (min, ([3, 1, 2],), {}), 'slow': (wait_for, (release,), {}), 'broken': (fail, (), {})}
+    durations = {}
+
+    results, timed_out, failed = runner.run(tasks, durations)
+    assert results == {'fast': 1}
+    assert timed_out == ['slow'] and failed == ['broken']
+    assert set(durations) == {'fast'}
+
+
+def test_per_algorithm_timeouts(release):
+    runner = ModelRunner(timeout=0.05, timeouts={'patient': 5})
+    tasks = {'patient': (time.sleep, (0.2,), {}), 'slow': (wait_for, (release,), {})}
+    results, timed_out, _ = runner.run(tasks)
+    assert list(results) == ['patient'] and timed_out == ['slow']
+
+
+def test_a_late_algorithm_does_not_hold_a_slot(release):
+    runner = ModelRunner(max_workers=1, timeout=0.1)
+    assert runner.run({'slow': (wait_for, (release,), {})})[1] == ['slow']
+    assert runner.retired == 1
+    #the single slot of the fresh pool is free
+    assert runner.run({'fast': (min, ([3, 1],), {})})[0] == {'fast': 1}
+
+
+def test_retired_pools_are_capped(release):
+    runner = ModelRunner(max_workers=1, timeout=0.1, max_retired=1)
+    runner.run({'slow': (wait_for, (release,), {})})
+    kept = runner.executor
+    runner.run({'slow': (wait_for, (release,), {})})
+    #past the cap the pool is kept and its late algorithm holds the only slot
+    assert runner.retired == 1 and runner.executor is kept
+    results, timed_out, _ = runner.run({'queued': (min, ([3, 1],), {})})
+    assert results == {} and timed_out == ['queued']
+
+    release.set()
+    time.sleep(0.1)
+    assert runner.retired == 0
+    assert runner.run({'fast': (min, ([3, 1],), {})})[0] == {'fast': 1}
+
+
+@pytest.mark.skipif(not hasattr(os, 'fork'), reason='needs os.fork')
+def test_pool_is_recreated_after_a_fork():
+    runner = ModelRunner(timeout=5)
+    parent = runner.executor
+    assert runner.run({'fast': (min, ([3, 1],), {})})[0] == {'fast': 1}
+
+    pid = os.fork()
+    if pid == 0:
+        #the parent's pool threads do not exist in the child
+        ok = runner.executor is not parent and runner.run({'fast': (min, ([3, 1],), {})})[0] == {'fast': 1}
+        os._exit(0 if ok else 1)
+    _, status = os.waitpid(pid, 0)
+    assert os.waitstatus_to_exitcode(status) == 0
+    assert runner.executor is parent
+
+
+def test_unknown_kind_is_rejected():
+    with pytest.raises(ValueError):
+        ModelRunner(kind='fiber')
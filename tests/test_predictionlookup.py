@@ -0,0 +1,96 @@
+import os
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from algos import registry
+from algos.distance import sorted_coordinates
+from datacuration import PredictGroup
+from predictionlookup import BuildPredictionLookup, PredictionLookup
+from stationpayload import source_signature
+
+
+@pytest.fixture
+def predictions():
+    return pd.DataFrame({'Algorithm': ['Frank', 'Noah_S', 'Frank', 'Noah_S'], 'Year': [2019, 2019, 2020, 2020],
+                         'City': 'Atlanta', 'State': 'GA', 'Latitude': [33.7, np.nan, 33.8, 33.9], 'Longitude': [-84.4, np.nan, -84.5, -84.6]})
+
+
+def test_a_query_year_gets_the_predictions_of_the_next_year(predictions):
+    lookup = PredictionLookup(predictions)
+    #stations opened up to 2019 are the ones the 2020 predictions were made from
+    assert lookup.get('Atlanta', 'GA', 2019) == {'Frank': [33.8, -84.5], 'Noah_S': [33.9, -84.6]}
+    #NaN marks no feasible location
+    assert lookup.get('Atlanta', 'GA', 2018) == {'Frank': [33.7, -84.4], 'Noah_S': None}
+    assert lookup.get('Atlanta', 'GA', 2020) == {}
+    assert lookup.get('Macon', 'GA', 2019) == {}
+
+
+def test_older_files_keep_the_location_in_new_columns(predictions):
+    older = predictions.assign(New_Latitude=predictions['Latitude'], New_Longitude=predictions['Longitude'],
+                               Latitude=np.nan, Longitude=np.nan)
+    assert PredictionLookup(older).groups == PredictionLookup(predictions).groups
+
+
+@pytest.fixture
+def recorded(tmp_path, predictions):
+    path, map_data = str(tmp_path / 'Predictions.parquet'), str(tmp_path / 'MapData.parquet')
+    predictions.to_parquet(path)
+    predictions.to_parquet(map_data)
+    BuildPredictionLookup(path, map_data)
+    return path, map_data
+
+
+def test_a_recorded_file_is_loaded_for_its_map_data(recorded):
+    path, map_data = recorded
+    lookup = PredictionLookup.load(path, source_signature(map_data))
+    assert lookup is not None and len(lookup) == 2
+
+
+def test_a_file_recorded_for_other_map_data_is_not_loaded(recorded, tmp_path, predictions):
+    path, map_data = recorded
+    other = str(tmp_path / 'Other.parquet')
+    predictions.head(1).to_parquet(other)
+    assert PredictionLookup.load(path, source_signature(other)) is None
+
+
+def test_a_file_changed_since_it_was_recorded_is_not_loaded(recorded, predictions):
+    path, map_data = recorded
+    predictions.head(2).to_parquet(path)
+    assert PredictionLookup.load(path, source_signature(map_data)) is None
+
+
+def test_an_unrecorded_or_missing_file_is_not_loaded(recorded):
+    path, map_data = recorded
+    os.remove(path + '.source')
+    assert PredictionLookup.load(path, source_signature(map_data)) is None
+    assert PredictionLookup.load(path + '.missing', source_signature(map_data)) is None
+
+
+def test_city_queries_are_answered_from_the_batch_predictions_like_live(client, monkeypatch, served):
+    server = pytest.importorskip('server')
+    from predictioncache import LRUCache
+    batch = registry.enabled(None, batch=True)
+    monkeypatch.setattr(server, 'algorithms', batch)
+
+    #the batch pipeline's Atlanta group made from the stations opened up to 2018, labelled 2019
+    stations = served[(served['Algorithm'] == 'Original') & (served['City'] == 'Atlanta') & (served['Year'] <= 2018)]
+    locations = PredictGroup((2019, 'Atlanta', 'GA', sorted_coordinates(stations[['Latitude', 'Longitude']].to_numpy())), batch)
+    rows = pd.DataFrame({'Algorithm': [a.name for a in batch], 'Year': 2019, 'City': 'Atlanta', 'State': 'GA',
+                         'Latitude': locations[:, 0], 'Longitude': locations[:, 1]})
+    query = {'city': 'Atlanta', 'state': 'GA', 'year': 2018}
+
+    with monkeypatch.context() as patch:
+        patch.setattr(server, 'prediction_lookup', PredictionLookup(rows))
+        patch.setattr(server, 'prediction_cache', LRUCache())
+        #every enabled algorithm is precomputed, so nothing runs
+        patch.setattr(server.model_runner, 'run', lambda *args: pytest.fail('ran the algorithms for a precomputed query'))
+        precomputed = client.post('/run_model', json=query).get_json()
+    assert set(precomputed.pop('source').values()) == {'precomputed'}
+
+    monkeypatch.setattr(server, 'prediction_lookup', None)
+    monkeypatch.setattr(server, 'prediction_cache', LRUCache())
+    live = client.post('/run_model', json=query).get_json()
+    assert set(live.pop('source').values()) == {'live'}
+    assert precomputed == live
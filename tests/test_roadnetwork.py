@@ -0,0 +1,74 @@
+import numpy as np
+import pytest
+import shapely
+
+from algos.bartley import candidate_grid, optimize_new_ev_station_location as optimize_without_roads
+from algos.bartley_with_road_network import optimize_new_ev_station_location
+from algos.distance import haversine
+from algos.roadnetwork import RoadNetworkStore
+
+
+@pytest.fixture
+def roads():
+    #the small region bundled in data/roads for tests
+    return RoadNetworkStore().load('fixture')
+
+
+@pytest.fixture
+def demand(stations):
+    rng = np.random.default_rng(3)
+    return rng.uniform((33.4, -84.8), (34.1, -84.0), size=(40, 2)), rng.integers(1, 20, size=40).astype(float)
+
+
+def test_the_store_finds_the_fixture_region():
+    store = RoadNetworkStore()
+    assert 'fixture' in store.regions()
+    assert len(store.for_bbox((-84.5, 33.6, -84.3, 33.9))) == len(store.load('fixture'))
+    assert store.for_bbox((-100.0, 40.0, -99.0, 41.0)) is None
+
+
+def test_nearest_road_distance_matches_a_brute_force_snap(roads):
+    rng = np.random.default_rng(2)
+    points = rng.uniform((33.1, -85.0), (34.2, -83.9), size=(50, 2))
+    #roads densified to vertices about 10 m apart, the nearest vertex on the sphere is the snap
+    vertices = shapely.get_coordinates(shapely.segmentize(roads.geometries, 1e-4))
+    expected = haversine(points[:, None, 0], points[:, None, 1], vertices[None, :, 1], vertices[None, :, 0]).min(axis=1)
+    #the local projection is accurate to a fraction of a percent over the region
+    np.testing.assert_allclose(roads.nearest_road_distance(points), expected, rtol=0.01, atol=0.01)
+
+
+def test_a_point_on_a_road_is_at_distance_zero(roads):
+    lon, lat = shapely.get_coordinates(roads.geometries[0])[0]
+    assert roads.nearest_road_distance([(lat, lon)])[0] == pytest.approx(0.0, abs=1e-9)
+
+
+@pytest.mark.parametrize('max_distance', [0.5, 2.0])
+def test_road_variant_only_places_near_a_road(stations, demand, roads, max_distance):
+    users, densities = demand
+    kwargs = dict(grid_size=(12, 12), min_ev_users=60)
+    location = optimize_new_ev_station_location(stations, users, densities, [20.0], max_distance_to_road=max_distance, roads=roads, **kwargs)
+
+    candidates = candidate_grid(stations, (12, 12))
+    near = roads.nearest_road_distance(candidates) <= max_distance
+    expected = optimize_without_roads(stations, users, densities, [20.0], candidate_filter=lambda c: near, **kwargs)
+    assert location == expected
+    #the unconstrained pick is farther from a road, so the limit decides the answer
+    assert location != optimize_without_roads(stations, users, densities, [20.0], **kwargs)
+    assert roads.nearest_road_distance([(location['Latitude'], location['Longitude'])])[0] <= max_distance
+
+
+def test_road_variant_without_a_road_limit_matches_the_plain_optimizer(stations, demand):
+    users, densities = demand
+    #the city core, whose candidate area the fixture region covers
+    stations = stations[:25]
+    kwargs = dict(grid_size=(12, 12), min_ev_users=20)
+    #roads looked up in the local store by the candidate area
+    assert (optimize_new_ev_station_location(stations, users, densities, [20.0], max_distance_to_road=np.inf, **kwargs)
+            == optimize_without_roads(stations, users, densities, [20.0], **kwargs))
+
+
+def test_road_variant_needs_a_stored_region(demand):
+    users, densities = demand
+    far = np.array([[45.0, -100.0], [45.2, -100.3], [45.1, -99.8]])
+    with pytest.raises(LookupError):
+        optimize_new_ev_station_location(far, users, densities, [20.0], road_store=RoadNetworkStore())
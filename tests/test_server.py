@@ -0,0 +1,86 @@
+import numpy as np
+import pytest
+
+server = pytest.importorskip('server')
+
+
+@pytest.mark.parametrize('body', [
+    [[33.7, -84.4]],
+    {'filtered_station_data': []},
+    {'filtered_station_data': [[33.7, float('nan')], [33.8, -84.3]]},
+    {'filtered_station_data': [[33.7]]},
+    {'filtered_station_data': [[95.0, -84.4], [33.8, -84.3]]},
+    {'filtered_station_data': [[1e308, -84.4], [33.8, -84.3]]},
+    {'filtered_station_data': [[33.7, -184.4], [33.8, -84.3]]},
+])
+def test_malformed_station_bodies_are_rejected(client, body):
+    #/coverage also needs the suggestions to score
+    for route, extra in (('/run_model', {}), ('/coverage', {'locations': {}})):
+        response = client.post(route, json={**body, **extra} if isinstance(body, dict) else body)
+        assert response.status_code == 400, route
+        assert 'error' in response.get_json()
+
+
+@pytest.mark.parametrize('field, limit', [('exact', server.FRANK_MAX_RESOLUTION), ('edt', server.FRANK_MAX_EDT_RESOLUTION)])
+def test_resolution_is_capped_per_field(client, stations, field, limit):
+    body = {'filtered_station_data': stations.tolist(), 'field': field, 'resolution': limit + 1}
+    response = client.post('/run_model', json=body)
+    assert response.status_code == 400
+    assert str(limit) in response.get_json()['error']
+
+
+def test_out_of_range_binary_points_are_rejected(client):
+    from stationpayload import encode_points
+    body = encode_points(np.array([[95.0, -84.4], [33.8, -84.3]]))
+    response = client.post('/run_model', data=body, content_type='application/octet-stream')
+    assert response.status_code == 400
+    assert 'latitudes' in response.get_json()['error']
+
+
+@pytest.mark.parametrize('bbox', ['nan,0,1,1', '0,0,inf,1', '1,0,0,1', '0,1,1,0', '0,0,1', 'west,0,1,1'])
+def test_station_data_rejects_invalid_boxes(client, served, bbox):
+    response = client.get(f'/station_data?bbox={bbox}')
+    assert response.status_code == 400
+    assert 'error' in response.get_json()
+
+
+def test_station_data_clamps_a_box_past_the_globe(client, served):
+    response = client.get('/station_data?bbox=-1e5,-1e5,1e5,1e5&algorithm=Original')
+    assert response.status_code == 200
+    assert len(response.get_json()) == (served['Algorithm'] == 'Original').sum()
+
+
+def test_noah_s_does_not_depend_on_earlier_requests(client, monkeypatch, stations):
+    from algos.distance import sorted_coordinates
+    from algos.spatial_index import StationIndex
+    from predictioncache import LRUCache
+    noah_s = server.registry.get('Noah_S')
+    monkeypatch.setattr(server, 'algorithms', [noah_s])
+    #most of the stations plus a few others, a set a warm start would reuse the centroids of
+    rng = np.random.default_rng(5)
+    others = [np.vstack((stations[:38], rng.uniform((33.4, -84.8), (34.1, -84.0), size=(8, 2)))) for _ in range(3)]
+
+    answers = []
+    for points in others + [stations]:
+        #every request is computed, not answered from the prediction cache
+        monkeypatch.setattr(server, 'prediction_cache', LRUCache())
+        response = client.post('/run_model', json={'filtered_station_data': points.tolist()})
+        assert response.status_code == 200
+        answers.append(response.get_json()['Noah S'])
+    #the cold fit of a fresh worker, the one the batch pipeline makes
+    points = sorted_coordinates(stations)
+    np.testing.assert_allclose(answers[-1], noah_s(points, {'index': StationIndex(points)}), atol=1e-5)
+
+
+@pytest.mark.parametrize('bbox', [[float('nan'), 0, 1, 1], [0, 0, float('inf'), 1], [1, 0, 0, 1], [0, 1, 1, 0], [0, 0, 1], 'west,0,1,1', 5])
+def test_station_queries_reject_invalid_boxes(client, served, bbox):
+    for route, extra in (('/run_model', {}), ('/jobs', {}), ('/coverage', {'locations': {}})):
+        response = client.post(route, json={'bbox': bbox, 'year': 2020, **extra})
+        assert response.status_code == 400, route
+        assert 'error' in response.get_json()
+
+
+def test_station_queries_clamp_a_box_past_the_globe(client, served):
+    response = client.post('/coverage', json={'bbox': [-1e5, -1e5, 1e5, 1e5], 'year': 2020, 'locations': {'Frank': [33.9, -84.5]}})
+    assert response.status_code == 200
+    assert response.get_json()['Frank']['coverage_improvement_percent'] >= 0
@@ -0,0 +1,45 @@
+import numpy as np
+import pytest
+from geopy.distance import geodesic
+
+from algos.distance import distance_matrix, nearest_distance
+from algos.spatial_index import DistanceField, StationIndex
+
+
+@pytest.fixture
+def points():
+    return np.random.default_rng(2).uniform((33.3, -84.9), (34.2, -83.9), size=(80, 2))
+
+
+@pytest.mark.parametrize('method', ['geodesic', 'haversine'])
+def test_index_nearest_matches_brute_force(stations, points, method):
+    dist, idx = StationIndex(stations, method=method).nearest_distance(points)
+    expected_dist, expected_idx = nearest_distance(points, stations, method=method)
+    np.testing.assert_allclose(dist, expected_dist, rtol=0, atol=1e-9)
+    np.testing.assert_array_equal(idx, expected_idx)
+
+
+def test_count_within_matches_geopy(stations, points):
+    radius = 15.0
+    weights = np.arange(1, len(stations) + 1, dtype=float)
+    within = np.array([[geodesic(p, s).km <= radius for s in stations] for p in points])
+
+    index = StationIndex(stations)
+    np.testing.assert_array_equal(index.count_within(points, radius), within.sum(axis=1))
+    np.testing.assert_allclose(index.count_within(points, radius, weights=weights), within @ weights)
+
+
+def test_distance_field_add_matches_recomputing(stations, points):
+    field = DistanceField(points, StationIndex(stations))
+    new = np.array([[33.5, -84.7], [34.05, -84.1]])
+    for location in new:
+        field.add(location)
+
+    expected, _ = nearest_distance(points, np.vstack((stations, new)))
+    np.testing.assert_allclose(field.distances, expected, rtol=0, atol=1e-9)
+
+
+def test_distance_field_add_returns_distances_to_the_new_station(stations, points):
+    field = DistanceField(points, StationIndex(stations))
+    new = field.add((33.5, -84.7))
+    np.testing.assert_allclose(new, distance_matrix(points, [(33.5, -84.7)], method='geodesic')[:, 0])
@@ -0,0 +1,111 @@
+import io
+import struct
+
+import numpy as np
+import orjson
+import pytest
+
+from stationpayload import BINARY_MAGIC, StationPayloads, decode_points, encode_binary, encode_points
+from stationstore import StationStore
+
+
+@pytest.fixture
+def store(map_data):
+    return StationStore(map_data)
+
+
+def decode_binary(data):
+    # The reader of the map script, in numpy
+    magic, version, label_length, count = struct.unpack_from('<4sHHI', data)
+    assert magic == BINARY_MAGIC
+    labels = orjson.loads(data[12:12 + label_length])
+    offset = 12 + label_length
+    lat = np.frombuffer(data, '<f4', count, offset)
+    lon = np.frombuffer(data, '<f4', count, offset + 4 * count)
+    year = np.frombuffer(data, '<i2', count, offset + 8 * count)
+    codes = np.frombuffer(data, np.uint8, count, offset + 10 * count)
+    assert len(data) == offset + 11 * count
+    return lat, lon, year, np.array(labels)[codes]
+
+
+@pytest.mark.parametrize('rows', [None, np.array([0, 3, 30, 46])])
+def test_binary_payload_round_trips(store, map_data, rows):
+    lat, lon, year, algorithm = decode_binary(encode_binary(store, rows))
+    expected = map_data if rows is None else map_data.iloc[rows]
+    np.testing.assert_allclose(lat, expected['Latitude'], rtol=1e-7)
+    np.testing.assert_allclose(lon, expected['Longitude'], rtol=1e-7)
+    np.testing.assert_array_equal(year, expected['Year'])
+    np.testing.assert_array_equal(algorithm, expected['Algorithm'])
+
+
+@pytest.mark.parametrize('accept, encoding', [
+    ('br, gzip', 'br'),
+    ('gzip, deflate', 'gzip'),
+    ('gzip;q=0, br;q=0.5', 'br'),
+    ('gzip, br;q=0', 'gzip'),
+    ('identity', 'identity'),
+    ('', 'identity'),
+    ('*', 'br'),
+    ('*, br;q=0, zstd;q=0', 'gzip'),
+])
+def test_negotiate_picks_the_best_accepted_encoding(store, accept, encoding):
+    assert StationPayloads.from_store(store).negotiate('records', accept) == encoding
+
+
+@pytest.mark.parametrize('accept, encoding', [('br', 'br'), ('gzip', 'gzip'), ('identity', 'identity')])
+def test_station_data_is_not_resent_for_a_matching_etag(client, served, accept, encoding):
+    response = client.get('/station_data', headers={'Accept-Encoding': accept})
+    assert response.status_code == 200
+    assert response.headers.get('Content-Encoding', 'identity') == encoding
+    etag = response.headers['ETag']
+
+    response = client.get('/station_data', headers={'Accept-Encoding': accept, 'If-None-Match': etag})
+    assert response.status_code == 304 and response.headers['ETag'] == etag and not response.data
+    #the ETag of another encoding names other bytes
+    other = 'gzip' if encoding != 'gzip' else 'br'
+    response = client.get('/station_data', headers={'Accept-Encoding': other, 'If-None-Match': etag})
+    assert response.status_code == 200
+
+
+@pytest.mark.parametrize('dtype', ['<f4', '<f8'])
+def test_binary_points_round_trip(stations, dtype):
+    points = decode_points(encode_points(stations, dtype))
+    assert points.dtype == np.dtype(dtype) and points.shape == stations.shape
+    np.testing.assert_array_equal(points, stations.astype(dtype))
+
+
+@pytest.mark.parametrize('dtype', ['<f4', '<f8'])
+def test_npy_points_round_trip(stations, dtype):
+    buffer = io.BytesIO()
+    np.save(buffer, stations.astype(dtype))
+    np.testing.assert_array_equal(decode_points(buffer.getvalue(), 'application/x-npy'), stations.astype(dtype))
+
+
+@pytest.mark.parametrize('data, content_type', [
+    (b'EVPT', 'application/octet-stream'),
+    (b'XXXX' + encode_points(np.zeros((2, 2)))[4:], 'application/octet-stream'),
+    (encode_points(np.zeros((2, 2)))[:-8], 'application/octet-stream'),
+    (encode_points(np.zeros((2, 2))), 'text/plain'),
+])
+def test_malformed_binary_points_are_rejected(data, content_type):
+    with pytest.raises(ValueError):
+        decode_points(data, content_type)
+
+
+def test_npy_points_of_the_wrong_shape_are_rejected():
+    buffer = io.BytesIO()
+    np.save(buffer, np.zeros((4, 3)))
+    with pytest.raises(ValueError):
+        decode_points(buffer.getvalue(), 'application/x-npy')
+
+
+def test_binary_and_json_bodies_get_the_same_answer(client, monkeypatch, stations):
+    server = pytest.importorskip('server')
+    from predictioncache import LRUCache
+    monkeypatch.setattr(server, 'algorithms', [server.registry.get('Frank')])
+    monkeypatch.setattr(server, 'prediction_cache', LRUCache())
+    binary = client.post('/run_model', data=encode_points(stations), content_type='application/octet-stream')
+    monkeypatch.setattr(server, 'prediction_cache', LRUCache())
+    json = client.post('/run_model', json={'filtered_station_data': stations.tolist()})
+    assert binary.status_code == json.status_code == 200
+    assert binary.get_json() == json.get_json()
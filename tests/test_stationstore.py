@@ -0,0 +1,39 @@
+import numpy as np
+import pytest
+
+from stationstore import ORIGINAL, StationStore, parse_bbox
+
+
+@pytest.fixture
+def store(map_data):
+    return StationStore(map_data)
+
+
+def brute_force(map_data, bbox=None, year=None):
+    keep = (map_data['Algorithm'] == ORIGINAL) & (map_data['Year'] <= (year if year is not None else 9999))
+    if bbox is not None:
+        west, south, east, north = bbox
+        keep &= map_data['Longitude'].between(west, east) & map_data['Latitude'].between(south, north)
+    return np.flatnonzero(keep)
+
+
+@pytest.mark.parametrize('bbox, year', [(None, None), ((-84.5, 33.6, -84.3, 33.9), None), ((-84.5, 33.6, -84.3, 33.9), 2017), (None, 2016)])
+def test_select_matches_a_brute_force_filter(store, map_data, bbox, year):
+    np.testing.assert_array_equal(store.select(bbox=bbox, year=year, algorithms=[ORIGINAL]), brute_force(map_data, bbox, year))
+
+
+def test_a_box_past_the_globe_visits_only_its_cells(store, map_data):
+    #clamped like a request bbox, the cell ranges are clipped as well so nothing past the grid is enumerated
+    assert len(store._original._cells_in((-1e5, -1e5, 1e5, 1e5))) == len(store._original.cells)
+    np.testing.assert_array_equal(store.select(bbox=(-1e5, -1e5, 1e5, 1e5), algorithms=[ORIGINAL]), brute_force(map_data))
+
+
+def test_parse_bbox_clamps_to_the_globe():
+    assert parse_bbox(['-1e5', '-100', '1e5', '100']) == [-180.0, -90.0, 180.0, 90.0]
+    assert parse_bbox((-84.5, 33.6, -84.3, 33.9)) == [-84.5, 33.6, -84.3, 33.9]
+
+
+@pytest.mark.parametrize('values', [['nan', '0', '1', '1'], ['0', '0', 'inf', '1'], ['1', '0', '0', '1'], ['0', '1', '1', '0'], ['0', '0', '1']])
+def test_parse_bbox_rejects_invalid_boxes(values):
+    with pytest.raises(ValueError):
+        parse_bbox(values)